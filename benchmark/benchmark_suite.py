@@ -0,0 +1,334 @@
+"""Benchmark suite for the PMI hot paths.
+
+Builds a synthetic, reproducible system (random sequences and beads,
+seeded) of configurable size and times system building, restraint
+setup, sampling, output writing and the analysis tools on it.
+Results are written as JSON and can be compared against a stored
+baseline; the script exits with a non-zero status if any benchmark
+regressed by more than the given tolerance.
+
+Example:
+  python benchmark_suite.py --molecules 10 --residues 200 \
+      --json current.json --baseline baseline.json
+"""
+
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.atom
+import IMP.benchmark
+import IMP.isd.gmm_tools
+import IMP.rmf
+import IMP.pmi.analysis
+import IMP.pmi.dof
+import IMP.pmi.io.crosslink
+import IMP.pmi.output
+import IMP.pmi.restraints.crosslinking
+import IMP.pmi.restraints.em
+import IMP.pmi.restraints.stereochemistry
+import IMP.pmi.samplers
+import IMP.pmi.tools
+import IMP.pmi.topology
+import RMF
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class DummyFile(object):
+    def write(self, txt):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Timer(object):
+    """Time a block of code; the elapsed wall time is in `elapsed`.
+    Output printed by PMI inside the block is discarded."""
+    def __init__(self, quiet=True):
+        self.quiet = quiet
+        self.elapsed = None
+
+    def __enter__(self):
+        if self.quiet:
+            self.old_stdout = sys.stdout
+            sys.stdout = DummyFile()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
+        if self.quiet:
+            sys.stdout = self.old_stdout
+
+
+class Results(object):
+    """Collect benchmark values together with their units and whether
+    a higher value means better performance."""
+    def __init__(self):
+        self.values = {}
+
+    def add(self, name, value, unit, higher_is_better=False):
+        self.values[name] = {"value": value, "unit": unit,
+                             "higher_is_better": higher_is_better}
+        print("%-36s %14.6g %s" % (name, value, unit))
+
+    def write(self, fname, args):
+        data = {"parameters": {"molecules": args.molecules,
+                               "residues": args.residues,
+                               "crosslinks": args.crosslinks,
+                               "frames": args.frames,
+                               "mc_steps": args.mc_steps,
+                               "seed": args.seed},
+                "benchmarks": self.values}
+        with open(fname, "w") as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+
+    def compare(self, fname, tolerance):
+        """Compare against a baseline JSON file.
+        @return the list of names of benchmarks that regressed"""
+        with open(fname) as fh:
+            baseline = json.load(fh)["benchmarks"]
+        regressions = []
+        print("\n%-36s %14s %14s %8s" % ("benchmark", "baseline",
+                                          "current", "ratio"))
+        for name in sorted(self.values):
+            if name not in baseline:
+                continue
+            cur = self.values[name]
+            base = baseline[name]["value"]
+            if base <= 0.:
+                continue
+            ratio = cur["value"] / base
+            if cur["higher_is_better"]:
+                regressed = ratio < 1.0 - tolerance
+            else:
+                regressed = ratio > 1.0 + tolerance
+            IMP.benchmark.report(name, cur["value"], base)
+            print("%-36s %14.6g %14.6g %8.3f%s"
+                  % (name, base, cur["value"], ratio,
+                     "  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append(name)
+        return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark PMI system building, restraints, sampling, "
+                    "output and analysis on a synthetic system.")
+    parser.add_argument("--molecules", type=int, default=5,
+                        help="Number of molecules (default 5)")
+    parser.add_argument("--residues", type=int, default=100,
+                        help="Number of residues per molecule (default 100)")
+    parser.add_argument("--crosslinks", type=int, default=200,
+                        help="Number of synthetic cross-links (default 200)")
+    parser.add_argument("--frames", type=int, default=20,
+                        help="Number of output frames (default 20)")
+    parser.add_argument("--mc-steps", type=int, default=100,
+                        help="Number of Monte Carlo steps (default 100)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Random seed (default 42)")
+    parser.add_argument("--json", default="benchmark_suite.json",
+                        help="File to write the results to")
+    parser.add_argument("--baseline",
+                        help="Baseline JSON file to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed fractional slowdown relative to the "
+                             "baseline (default 0.2)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show output printed by PMI")
+    return parser.parse_known_args()
+
+
+def make_sequences(nmolecules, nresidues, rng):
+    return [''.join(rng.choice(AMINO_ACIDS) for i in range(nresidues))
+            for j in range(nmolecules)]
+
+
+def write_crosslinks(fname, sequences, ncrosslinks, rng):
+    """Write a CSV file of random inter- and intra-molecular cross-links
+    between lysines (or any residue, if a molecule has no lysine)."""
+    sites = []
+    for n, seq in enumerate(sequences):
+        lys = [i + 1 for i, aa in enumerate(seq) if aa == 'K']
+        sites.append(lys if lys else list(range(1, len(seq) + 1)))
+    with open(fname, "w") as fh:
+        fh.write("prot1,res1,prot2,res2\n")
+        for i in range(ncrosslinks):
+            m1 = rng.randrange(len(sequences))
+            m2 = rng.randrange(len(sequences))
+            fh.write("P%d,%d,P%d,%d\n" % (m1, rng.choice(sites[m1]),
+                                          m2, rng.choice(sites[m2])))
+
+
+def get_coordinates(hier):
+    ps = IMP.pmi.tools.select_at_all_resolutions(hier, resolution=1)
+    return [IMP.core.XYZ(p).get_coordinates() for p in ps
+            if IMP.core.XYZ.get_is_setup(p)]
+
+
+def main():
+    args, imp_args = parse_args()
+    IMP.setup_from_argv([sys.argv[0]] + imp_args, "PMI benchmark suite.")
+    IMP.set_log_level(IMP.SILENT)
+    quiet = not args.verbose
+    rng = random.Random(args.seed)
+    IMP.random_number_generator.seed(args.seed)
+    results = Results()
+    tmpdir = tempfile.mkdtemp(prefix="pmi_benchmark_")
+    try:
+        sequences = make_sequences(args.molecules, args.residues, rng)
+
+        # topology
+        mdl = IMP.Model()
+        with Timer(quiet) as t:
+            s = IMP.pmi.topology.System(mdl)
+            st = s.create_state()
+            mols = []
+            for n, seq in enumerate(sequences):
+                mol = st.create_molecule("P%d" % n, sequence=seq,
+                                         chain_id=CHAIN_IDS[n % len(CHAIN_IDS)])
+                mol.add_representation(mol, resolutions=[1, 10],
+                                       setup_particles_as_densities=True)
+                mols.append(mol)
+            hier = s.build()
+        results.add("system_build", t.elapsed, "s")
+
+        dof = IMP.pmi.dof.DegreesOfFreedom(mdl)
+        for mol in mols:
+            dof.create_rigid_body(mol)
+        with Timer(quiet):
+            IMP.pmi.tools.shuffle_configuration(hier, max_translation=100.)
+        mdl.update()
+
+        # restraint setup
+        xl_fname = os.path.join(tmpdir, "crosslinks.csv")
+        write_crosslinks(xl_fname, sequences, args.crosslinks, rng)
+        with Timer(quiet) as t:
+            cldbkc = IMP.pmi.io.crosslink.CrossLinkDataBaseKeywordsConverter()
+            cldbkc.set_protein1_key("prot1")
+            cldbkc.set_protein2_key("prot2")
+            cldbkc.set_residue1_key("res1")
+            cldbkc.set_residue2_key("res2")
+            cldb = IMP.pmi.io.crosslink.CrossLinkDataBase(cldbkc)
+            cldb.create_set_from_file(xl_fname)
+            xlr = IMP.pmi.restraints.crosslinking.\
+                CrossLinkingMassSpectrometryRestraint(
+                    root_hier=hier, CrossLinkDataBase=cldb,
+                    length=21.0, resolution=1, filelabel="benchmark")
+            xlr.add_to_model()
+        results.add("crosslink_restraint_setup", t.elapsed, "s")
+
+        densities = IMP.atom.Selection(
+            hier, representation_type=IMP.atom.DENSITIES).get_selected_particles()
+        gmm_fname = os.path.join(tmpdir, "target_gmm.txt")
+        with Timer(quiet):
+            IMP.isd.gmm_tools.write_gmm_to_text(densities, gmm_fname)
+        with Timer(quiet) as t:
+            emr = IMP.pmi.restraints.em.GaussianEMRestraint(
+                densities, target_fn=gmm_fname, scale_target_to_mass=True)
+            emr.add_to_model()
+        results.add("em_restraint_setup", t.elapsed, "s")
+
+        with Timer(quiet) as t:
+            evr = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+                included_objects=mols, resolution=10)
+            evr.add_to_model()
+        results.add("ev_restraint_setup", t.elapsed, "s")
+
+        with Timer(quiet) as t:
+            IMP.pmi.tools.get_restraint_set(mdl).evaluate(True)
+        results.add("score_evaluation", t.elapsed, "s")
+
+        # sampling
+        movers = dof.get_movers()
+        mc = IMP.pmi.samplers.MonteCarlo(mdl, movers, 1.0)
+        with Timer(quiet) as t:
+            mc.optimize(args.mc_steps)
+        results.add("mc_steps_per_second",
+                    args.mc_steps * len(movers) / t.elapsed, "1/s",
+                    higher_is_better=True)
+
+        # output
+        output_objects = [xlr, emr, evr, mc]
+        output = IMP.pmi.output.Output()
+        stat_fname = os.path.join(tmpdir, "stat.out")
+        rmf_fname = os.path.join(tmpdir, "frames.rmf3")
+        with Timer(quiet):
+            output.init_stat2(stat_fname, output_objects)
+            output.init_rmf(rmf_fname, [hier])
+        stat_time = 0.
+        rmf_time = 0.
+        for i in range(args.frames):
+            with Timer(quiet):
+                IMP.pmi.tools.shuffle_configuration(
+                    hier, max_translation=100., avoidcollision_rb=False)
+                mdl.update()
+                IMP.pmi.tools.get_restraint_set(mdl).evaluate(False)
+            with Timer(quiet) as t:
+                output.write_stat2(stat_fname)
+            stat_time += t.elapsed
+            with Timer(quiet) as t:
+                output.write_rmf(rmf_fname)
+            rmf_time += t.elapsed
+        output.close_rmf(rmf_fname)
+        results.add("write_stat2_per_frame", stat_time / args.frames, "s")
+        results.add("write_rmf_per_frame", rmf_time / args.frames, "s")
+
+        # analysis
+        with Timer(quiet) as t:
+            po = IMP.pmi.output.ProcessOutput(stat_fname)
+            po.get_fields(po.get_keys())
+        results.add("process_output_get_fields", t.elapsed, "s")
+
+        amdl = IMP.Model()
+        rh = RMF.open_rmf_file_read_only(rmf_fname)
+        ahier = IMP.rmf.create_hierarchies(rh, amdl)[0]
+        clustering = IMP.pmi.analysis.Clustering()
+        density = IMP.pmi.analysis.GetModelDensity(
+            custom_ranges=dict(("P%d" % n, ["P%d" % n])
+                               for n in range(len(sequences))))
+        density_time = 0.
+        for i in range(rh.get_number_of_frames()):
+            IMP.rmf.load_frame(rh, RMF.FrameID(i))
+            clustering.fill(i, get_coordinates(ahier))
+            with Timer(quiet) as t:
+                density.add_subunits_density(ahier)
+            density_time += t.elapsed
+        del rh
+        results.add("density_per_frame",
+                    density_time / args.frames, "s")
+        with Timer(quiet) as t:
+            clustering.dist_matrix()
+        results.add("clustering_dist_matrix", t.elapsed, "s")
+
+        with Timer(quiet) as t:
+            pr = IMP.pmi.analysis.Precision(IMP.Model(), resolution=1)
+            pr.add_structures([(rmf_fname, i) for i in range(args.frames)],
+                              "benchmark")
+            pr.get_precision("benchmark", "benchmark")
+        results.add("precision", t.elapsed, "s")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    results.write(args.json, args)
+    if args.baseline:
+        regressions = results.compare(args.baseline, args.tolerance)
+        if regressions:
+            print("\n%d benchmark(s) regressed: %s"
+                  % (len(regressions), ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+/**
+ *  \file IMP/pmi/BiStableDistanceRestraint.h
+ *  \brief A distance restraint with a bistable potential.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_BI_STABLE_DISTANCE_RESTRAINT_H
+#define IMPPMI_BI_STABLE_DISTANCE_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! A distance restraint with a bistable potential.
+/** The score is \f$-\log(w_1 g_1(d) + w_2 g_2(d))\f$, where \f$d\f$ is
+    the distance between the two particles and \f$g_i\f$ is an
+    unnormalized Gaussian centered at the equilibrium distance
+    \f$d_i\f$ with standard deviation \f$\sigma_i\f$. The weights
+    (populations) must sum to one.
+    Authors: G. Bouvier, R. Pellarin. Pasteur Institute.
+ */
+class IMPPMIEXPORT BiStableDistanceRestraint : public Restraint
+{
+    ParticleIndex p1_;
+    ParticleIndex p2_;
+    double dist1_;
+    double dist2_;
+    double sigma1_;
+    double sigma2_;
+    double weight1_;
+    double weight2_;
+
+public:
+
+  //! Create the restraint.
+  /** \throws ValueException if the weights do not sum to one.
+   */
+  BiStableDistanceRestraint(Model *m, ParticleIndexAdaptor p1,
+                            ParticleIndexAdaptor p2, double dist1,
+                            double dist2, double sigma1, double sigma2,
+                            double weight1, double weight2,
+                            std::string name="BiStableDistanceRestraint%1%");
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(BiStableDistanceRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_BI_STABLE_DISTANCE_RESTRAINT_H */
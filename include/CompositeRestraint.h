@@ -12,13 +12,17 @@
 #include "pmi_config.h"
 #include <IMP/Restraint.h>
 #include <IMP/Particle.h>
-#include <IMP/tuple_macros.h>
+#include <IMP/algebra/Sphere3D.h>
 //#include <IMP/container/CloseBipartitePairContainer.h>
 
 IMPPMI_BEGIN_NAMESPACE
 //! A restraint for ambiguous cross-linking MS data and multiple state approach.
 /** It marginalizes the false positive rate and depends on the expected fpr and
     an uncertainty parameter beta.
+
+    The probability is computed by dynamic programming over subsets of
+    elements, so the cost grows as \f$n^2 2^n\f$ for \f$n\f$ elements;
+    at most 20 elements are supported.
  */
 class IMPPMIEXPORT CompositeRestraint : public Restraint
 {
@@ -27,14 +31,6 @@ class IMPPMIEXPORT CompositeRestraint : public Restraint
     ParticleIndexes handle_particle_indexes_;
     double coffd_;
     double l_;
-    IMP_NAMED_TUPLE_2(CacheKey, CacheKeys,
-                  Int, ipart, Ints, excluded, );
-
-    IMP_NAMED_TUPLE_2(CacheKeyPot, CacheKeyPots,
-                  Int, ipart, Int, kpart, );
-
-    typedef boost::unordered_map<CacheKey, double> Cache;
-    typedef boost::unordered_map<CacheKeyPot, double> CachePot;
 
     //variables needed to tabulate the exponential
     Floats prob_grid_;
@@ -67,9 +63,18 @@ class IMPPMIEXPORT CompositeRestraint : public Restraint
     //boost::unordered_map<std::tuple<unsigned int,unsigned int>,
     //          Pointer<container::CloseBipartitePairContainer>> map_cont_;
 
+    // tables reused between evaluations: pair probabilities between
+    // elements, spheres of all particles, and the probabilities
+    // indexed by (element, subset of excluded elements)
+    mutable Floats pair_prob_;
+    mutable Floats table_;
+    mutable algebra::Sphere3Ds coords_;
+
+  /* fill pair_prob_ from the current particle coordinates */
+  void update_pair_probabilities() const;
+
   /* call for probability */
-  double get_probability_per_particle_excluding(unsigned int ipart,
-                                    Ints excluded_ps, Cache& cache, CachePot& cachepot) const;
+  double get_probability_from_table() const;
 
 public:
 
@@ -80,7 +85,11 @@ public:
                      double coffd, double l, bool tabprob, double plateau,
                      std::string name="CompositeRestraint%1%");
 
-  void add_composite_particle(ParticleIndexesAdaptor pi){pis_.push_back(pi);}
+  //! Add another element to the restraint.
+  /** \throws ValueException if the restraint already has the maximum
+      of 20 elements.
+   */
+  void add_composite_particle(ParticleIndexesAdaptor pi);
 
 
   unsigned int get_number_of_elements() const {return pis_.size();}
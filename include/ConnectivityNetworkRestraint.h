@@ -0,0 +1,75 @@
+/**
+ *  \file IMP/pmi/ConnectivityNetworkRestraint.h
+ *  \brief Restrain a set of particle blocks to form a connected network.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_CONNECTIVITY_NETWORK_RESTRAINT_H
+#define IMPPMI_CONNECTIVITY_NETWORK_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+#include <IMP/pmi/internal/sphere_grid.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Restrain a set of particle blocks to form a connected network.
+/** The distance between two blocks is the minimum distance between the
+    surfaces of their spheres (zero if they touch). The score is the sum,
+    over the edges of the minimum spanning tree of the blocks, of
+    \f$-\log(1-(1-p)/(1+\exp(-(d-\theta)/s))) + l d\f$, where \f$d\f$ is
+    the edge distance, \f$\theta\f$ the contact distance, \f$s\f$ the
+    slope of the sigmoid, \f$p\f$ the plateau and \f$l\f$ the linear slope.
+    Derivatives are applied to the closest pair of particles of each edge.
+    Authors: G. Bouvier, R. Pellarin. Pasteur Institute.
+ */
+class IMPPMIEXPORT ConnectivityNetworkRestraint : public Restraint
+{
+    Vector<ParticleIndexes> blocks_;
+    double slope_;
+    double theta_;
+    double plateau_;
+    double linear_slope_;
+
+    // reused between evaluations
+    mutable Vector<internal::SphereGrid> grids_;
+
+    /* compute the minimum spanning tree of the blocks; for each edge
+       store the distance and the closest particle pair */
+    void compute_minimum_spanning_tree(IntPairs &edges, Floats &distances,
+                                      ParticleIndexPairs &closest) const;
+
+public:
+
+  //! Create the restraint.
+  ConnectivityNetworkRestraint(Model *m, double slope=1.0, double theta=0.0,
+                               double plateau=0.0000000001,
+                               double linear_slope=0.015,
+                               std::string name="ConnectivityNetworkRestraint%1%");
+
+  //! Add a block of particles, which are connected to each other
+  void add_particles(ParticleIndexesAdaptor ps) {blocks_.push_back(ps);}
+
+  unsigned int get_number_of_particle_blocks() const {return blocks_.size();}
+
+  unsigned int get_number_of_particles_for_block(unsigned int block_index) const
+  {return blocks_[block_index].size();}
+
+  //! Get the probability of a contact between blocks at distance dist
+  double get_sigmoid(double dist) const;
+
+  //! Get the edges of the minimum spanning tree, as pairs of block indexes
+  IntPairs get_minimum_spanning_tree() const;
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(ConnectivityNetworkRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_CONNECTIVITY_NETWORK_RESTRAINT_H */
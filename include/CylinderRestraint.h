@@ -0,0 +1,58 @@
+/**
+ *  \file IMP/pmi/CylinderRestraint.h
+ *  \brief Restrain particles within a cylinder along the z axis.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_CYLINDER_RESTRAINT_H
+#define IMPPMI_CYLINDER_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Restrain particles within a cylinder along the z axis.
+/** The cylinder is centered at x,y=0,0. The distance of each particle
+    from the axis is restrained by a sigmoid to be smaller than the radius
+    (or larger, if repulsive is true). Optionally, the cylindrical angle
+    of each particle is restrained to within [mintheta, maxtheta] degrees.
+ */
+class IMPPMIEXPORT CylinderRestraint : public Restraint
+{
+    ParticleIndexes pis_;
+    double radius_;
+    double mintheta_;
+    double maxtheta_;
+    bool use_angles_;
+    bool repulsive_;
+    double softness_;
+    double softness_angle_;
+    double plateau_;
+
+public:
+
+  //! Create the restraint, with no restraint on the angle.
+  CylinderRestraint(Model *m, ParticleIndexesAdaptor ps, double radius,
+                    bool repulsive=false,
+                    std::string name="CylinderRestraint%1%");
+
+  //! Create the restraint, keeping the angle within [mintheta, maxtheta].
+  CylinderRestraint(Model *m, ParticleIndexesAdaptor ps, double radius,
+                    double mintheta, double maxtheta, bool repulsive=false,
+                    std::string name="CylinderRestraint%1%");
+
+  double get_radius() const {return radius_;}
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(CylinderRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_CYLINDER_RESTRAINT_H */
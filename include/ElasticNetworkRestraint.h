@@ -0,0 +1,64 @@
+/**
+ *  \file IMP/pmi/ElasticNetworkRestraint.h
+ *  \brief Harmonic restraints on a list of particle pairs.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_ELASTIC_NETWORK_RESTRAINT_H
+#define IMPPMI_ELASTIC_NETWORK_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Harmonic restraints on a list of particle pairs.
+/** Each pair \f$i\f$ is scored by \f$0.5 k (d_i-d_{0,i})^2\f$, where
+    \f$d_i\f$ is the distance between the particle centers, \f$d_{0,i}\f$
+    the rest length of the pair and \f$k\f$ the strength, as for
+    IMP::core::HarmonicDistancePairScore. The pairs and rest lengths are
+    stored in flat arrays and evaluated in a single loop, which is much
+    cheaper than one restraint per pair for large networks.
+    \see create_elastic_network()
+ */
+class IMPPMIEXPORT ElasticNetworkRestraint : public Restraint
+{
+    ParticleIndexPairs pairs_;
+    Floats lengths_;
+    double strength_;
+
+public:
+
+  //! Create the restraint.
+  ElasticNetworkRestraint(Model *m, double strength,
+                          std::string name="ElasticNetworkRestraint%1%");
+
+  //! Add a pair of particles restrained at the given rest length
+  void add_pair(ParticleIndex p1, ParticleIndex p2, double rest_length) {
+    pairs_.push_back(ParticleIndexPair(p1, p2));
+    lengths_.push_back(rest_length);
+  }
+
+  unsigned int get_number_of_pairs() const {return pairs_.size();}
+
+  const ParticleIndexPairs &get_pairs() const {return pairs_;}
+
+  double get_rest_length(unsigned int pair_index) const
+  {return lengths_[pair_index];}
+
+  double get_strength() const {return strength_;}
+
+  void set_strength(double strength) {strength_ = strength;}
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(ElasticNetworkRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_ELASTIC_NETWORK_RESTRAINT_H */
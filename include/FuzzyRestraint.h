@@ -0,0 +1,76 @@
+/**
+ *  \file IMP/pmi/FuzzyRestraint.h
+ *  \brief Fully ambiguous contact restraint built with boolean logic.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_FUZZY_RESTRAINT_H
+#define IMPPMI_FUZZY_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/Pointer.h>
+#include <IMP/particle_index.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Fully ambiguous contact restraint built with boolean logic.
+/** A leaf restraint scores the contact between two particles as
+    \f$-\log(1-(1-p)/(1+\exp(-(d-\theta)/s))) + l d\f$, where \f$d\f$
+    is the distance between the particles. Restraints can be combined,
+    treating \f$\exp(-score)\f$ as a fuzzy truth value: AND adds the
+    scores \f$a\f$ and \f$b\f$, OR scores
+    \f$-\log(e^{-a}+e^{-b}-e^{-a-b})\f$ and NOT scores
+    \f$-\log(1-e^{-a})\f$.
+    R. Pellarin. Pasteur Institute.
+ */
+class IMPPMIEXPORT FuzzyRestraint : public Restraint
+{
+public:
+  enum Operator {AND_OPERATOR, OR_OPERATOR, NOT_OPERATOR};
+
+private:
+    // leaf contact
+    ParticleIndex p1_;
+    ParticleIndex p2_;
+    double theta_;
+    double slope_;
+    double plateau_;
+    double innerslope_;
+
+    // combination of other restraints
+    bool leaf_;
+    Operator op_;
+    PointerMember<FuzzyRestraint> r1_;
+    PointerMember<FuzzyRestraint> r2_;
+
+    // score of the last evaluation, used for the derivatives
+    mutable double value_;
+
+    double compute_value() const;
+    void add_derivatives(double dscore, DerivativeAccumulator &accum) const;
+    void add_particle_indexes(ParticleIndexes &pis) const;
+
+public:
+
+  //! Create a restraint on the contact between two particles.
+  FuzzyRestraint(Model *m, ParticleIndexAdaptor p1, ParticleIndexAdaptor p2,
+                 double theta=5.0, double slope=2.0,
+                 double plateau=0.00000000000001, double innerslope=0.01,
+                 std::string name="FuzzyRestraint%1%");
+
+  //! Combine two restraints (r2 is ignored, and may be None, for NOT).
+  FuzzyRestraint(FuzzyRestraint *r1, FuzzyRestraint *r2, Operator op,
+                 std::string name="FuzzyRestraint%1%");
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(FuzzyRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_FUZZY_RESTRAINT_H */
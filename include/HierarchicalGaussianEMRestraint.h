@@ -0,0 +1,83 @@
+/**
+ *  \file IMP/pmi/HierarchicalGaussianEMRestraint.h
+ *  \brief Gaussian EM restraint with a tree of merged target Gaussians.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_HIERARCHICAL_GAUSSIAN_EM_RESTRAINT_H
+#define IMPPMI_HIERARCHICAL_GAUSSIAN_EM_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+#include <IMP/pmi/internal/gaussian_tree.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Gaussian EM restraint with a tree of merged target Gaussians.
+/** The score is the same as that of IMP::isd::GaussianEMRestraint
+    without the slope term, \f$-\log(2 MD/(MM+DD))\f$, where MM, MD and
+    DD are the sums of the overlaps of the model and target (density)
+    Gaussians, weighted by their masses.
+
+    The target Gaussians are stored in a binary tree whose nodes are
+    merged by moment matching. When the overlap of a model Gaussian
+    with a whole node is provably negligible, the node is replaced by
+    its merged Gaussian, so that distant parts of a large map cost
+    little. The approximations are bounded so that the score differs
+    from the exact one by at most (approximately) the tolerance; if the
+    bound is exceeded, the model-density term is recomputed exactly.
+    With a tolerance of zero the score is exact.
+
+    The target Gaussians are read when the restraint is created; call
+    update_target() if they are moved.
+ */
+class IMPPMIEXPORT HierarchicalGaussianEMRestraint : public Restraint
+{
+    ParticleIndexes model_ps_;
+    ParticleIndexes density_ps_;
+    double tolerance_;
+    internal::GaussianTree tree_;
+    double dd_;
+
+public:
+
+  //! Create the restraint.
+  /** \param[in] m The Model
+      \param[in] model_ps Particles of the model, decorated as
+                 IMP::core::Gaussian and IMP::atom::Mass
+      \param[in] density_ps Particles of the target density, decorated
+                 as IMP::core::Gaussian and IMP::atom::Mass
+      \param[in] tolerance Largest allowed error of the score
+      \param[in] name Name of the restraint
+   */
+  HierarchicalGaussianEMRestraint(
+      Model *m, ParticleIndexes model_ps, ParticleIndexes density_ps,
+      double tolerance=0.0,
+      std::string name="HierarchicalGaussianEMRestraint%1%");
+
+  //! Rebuild the tree from the current target Gaussians
+  void update_target();
+
+  double get_tolerance() const { return tolerance_; }
+  void set_tolerance(double tolerance) { tolerance_ = tolerance; }
+
+  //! Get the number of nodes in the tree of target Gaussians
+  unsigned int get_number_of_nodes() const {
+    return tree_.get_number_of_nodes();
+  }
+
+  //! Get the density-density overlap term
+  double get_density_density_overlap() const { return dd_; }
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(HierarchicalGaussianEMRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_HIERARCHICAL_GAUSSIAN_EM_RESTRAINT_H */
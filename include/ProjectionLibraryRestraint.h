@@ -0,0 +1,117 @@
+/**
+ *  \file IMP/pmi/ProjectionLibraryRestraint.h
+ *  \brief Fit of model projections to EM class averages.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_PROJECTION_LIBRARY_RESTRAINT_H
+#define IMPPMI_PROJECTION_LIBRARY_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/algebra/Rotation3D.h>
+#include <IMP/pmi/internal/projection.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Fit of model projections to EM class averages.
+/** The model is projected along projection_number directions, spread
+    uniformly over the sphere. Each projection is aligned to each image
+    by its centroid and principal axis, and the score is the sum over
+    the images of one minus the best cross correlation. Particles are
+    drawn as Gaussians whose width depends on the resolution and on
+    their radius, weighted by their mass if they have one.
+
+    Rigid bodies are not redrawn particle by particle. Instead, each
+    rigid body is projected once along library_size directions in its
+    own frame (its projection library), and on evaluation the library
+    image closest to the required direction is rotated in plane and
+    moved into place. Particles that are not rigid members are drawn
+    directly.
+
+    The library is built on the first evaluation; call update_library()
+    if rigid bodies are created or changed after that.
+ */
+class IMPPMIEXPORT ProjectionLibraryRestraint : public Restraint
+{
+    ParticleIndexes ps_;
+    unsigned int rows_, cols_;
+    double pixel_size_;
+    double resolution_;
+    unsigned int library_size_;
+    unsigned int nthreads_;
+    algebra::Rotation3Ds projection_rotations_;
+    // images to fit, with zero mean
+    Vector<internal::ProjectionImage> images_;
+    Vector<internal::ImageMoments> image_moments_;
+    Floats image_sds_;
+
+    // projection library
+    mutable bool library_built_;
+    algebra::Vector3Ds library_directions_;
+    algebra::Rotation3Ds library_rotations_;
+    mutable ParticleIndexes bodies_;
+    mutable Vector<Vector<internal::ProjectionImage> > library_;
+    mutable Floats body_radii_;
+    mutable ParticleIndexes flexible_;
+
+    void build_library() const;
+    double get_sigma(ParticleIndex pi) const;
+    double get_weight(ParticleIndex pi) const;
+    internal::ProjectionImage get_projection_image(unsigned int k,
+                                                   bool use_library) const;
+
+public:
+
+  //! Create the restraint.
+  /** \param[in] m The Model
+      \param[in] ps The particles to project
+      \param[in] rows Number of rows of the images
+      \param[in] cols Number of columns of the images
+      \param[in] pixel_size Pixel size in angstroms
+      \param[in] resolution Resolution of the images in angstroms
+      \param[in] projection_number Number of projection directions
+      \param[in] library_size Number of directions in the projection
+                 library of each rigid body
+      \param[in] name Name of the restraint
+   */
+  ProjectionLibraryRestraint(Model *m, ParticleIndexes ps,
+                             unsigned int rows, unsigned int cols,
+                             double pixel_size, double resolution,
+                             unsigned int projection_number,
+                             unsigned int library_size=1000,
+                             std::string name="ProjectionLibraryRestraint%1%");
+
+  //! Add an image to fit, as rows*cols values in row-major order
+  void add_image(const Floats &pixels);
+
+  unsigned int get_number_of_images() const { return images_.size(); }
+
+  unsigned int get_number_of_projections() const {
+    return projection_rotations_.size();
+  }
+
+  //! Rebuild the projection libraries of the rigid bodies
+  void update_library() { library_built_ = false; }
+
+  //! Set the number of threads used to compute the projections
+  /** This only has an effect if IMP was built with OpenMP. */
+  void set_number_of_threads(unsigned int nthreads) { nthreads_ = nthreads; }
+
+  //! Get the projection along the kth direction, as in add_image()
+  /** If use_library is false, all particles are drawn directly. */
+  Floats get_projection(unsigned int k, bool use_library=true) const;
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(ProjectionLibraryRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_PROJECTION_LIBRARY_RESTRAINT_H */
@@ -0,0 +1,48 @@
+/**
+ *  \file IMP/pmi/TorqueRestraint.h
+ *  \brief Keep particles within an angular range of their centroid.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#ifndef IMPPMI_TORQUE_RESTRAINT_H
+#define IMPPMI_TORQUE_RESTRAINT_H
+#include "pmi_config.h"
+#include <IMP/Restraint.h>
+#include <IMP/particle_index.h>
+
+IMPPMI_BEGIN_NAMESPACE
+
+//! Keep particles within an angular range of their centroid.
+/** The cylindrical angle (around the z axis) of each particle is
+    restrained by a sigmoid to within angular_tolerance degrees of the
+    angle of the centroid of all the particles.
+ */
+class IMPPMIEXPORT TorqueRestraint : public Restraint
+{
+    ParticleIndexes pis_;
+    double angular_tolerance_;
+    double softness_angle_;
+    double plateau_;
+
+public:
+
+  //! Create the restraint.
+  TorqueRestraint(Model *m, ParticleIndexesAdaptor ps,
+                  double angular_tolerance, double softness_angle=0.5,
+                  double plateau=1e-10,
+                  std::string name="TorqueRestraint%1%");
+
+  double get_angular_tolerance() const {return angular_tolerance_;}
+
+  virtual double
+  unprotected_evaluate(DerivativeAccumulator *accum)
+     const IMP_OVERRIDE;
+  virtual ModelObjectsTemp do_get_inputs() const IMP_OVERRIDE;
+  IMP_OBJECT_METHODS(TorqueRestraint);
+};
+
+IMPPMI_END_NAMESPACE
+
+#endif  /* IMPPMI_TORQUE_RESTRAINT_H */
@@ -0,0 +1,249 @@
+/**
+ *  \file IMP/pmi/internal/gaussian_tree.h
+ *  \brief Tree of merged Gaussians for approximate overlap sums.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPPMI_INTERNAL_GAUSSIAN_TREE_H
+#define IMPPMI_INTERNAL_GAUSSIAN_TREE_H
+
+#include <IMP/pmi/pmi_config.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/algebra/Gaussian3D.h>
+#include <IMP/constants.h>
+#include <IMP/Vector.h>
+#include <algorithm>
+#include <cmath>
+#include <limits>
+
+IMPPMI_BEGIN_INTERNAL_NAMESPACE
+
+//! A weighted Gaussian, with its covariance stored as a symmetric matrix
+struct WeightedGaussian {
+  algebra::Vector3D mean;
+  // xx, xy, xz, yy, yz, zz
+  double cov[6];
+  double weight;
+};
+
+//! Get a WeightedGaussian from a Gaussian3D and a weight
+inline WeightedGaussian get_weighted_gaussian(const algebra::Gaussian3D &g,
+                                              double weight) {
+  WeightedGaussian ret;
+  ret.mean = g.get_center();
+  ret.weight = weight;
+  const algebra::Rotation3D &rot =
+      g.get_reference_frame().get_transformation_to().get_rotation();
+  const algebra::Vector3D &var = g.get_variances();
+  algebra::Vector3D axes[3];
+  for (unsigned int k = 0; k < 3; ++k) {
+    axes[k] = rot.get_rotated(algebra::get_basis_vector_3d(k));
+  }
+  int n = 0;
+  for (unsigned int a = 0; a < 3; ++a) {
+    for (unsigned int b = a; b < 3; ++b) {
+      double c = 0.0;
+      for (unsigned int k = 0; k < 3; ++k) {
+        c += axes[k][a] * var[k] * axes[k][b];
+      }
+      ret.cov[n++] = c;
+    }
+  }
+  return ret;
+}
+
+inline double get_determinant(const double *s) {
+  return s[0] * (s[3] * s[5] - s[4] * s[4]) -
+         s[1] * (s[1] * s[5] - s[4] * s[2]) +
+         s[2] * (s[1] * s[4] - s[3] * s[2]);
+}
+
+inline double get_trace(const double *s) { return s[0] + s[3] + s[5]; }
+
+//! Overlap integral of two weighted Gaussians
+/** If deriv is not null, the derivative of the overlap with respect to
+    the mean of a is stored in it. */
+inline double get_overlap(const WeightedGaussian &a,
+                          const WeightedGaussian &b,
+                          algebra::Vector3D *deriv = nullptr) {
+  double s[6];
+  for (unsigned int k = 0; k < 6; ++k) s[k] = a.cov[k] + b.cov[k];
+  double det = get_determinant(s);
+  // inverse of the symmetric matrix, via cofactors
+  double inv[6] = {s[3] * s[5] - s[4] * s[4], s[2] * s[4] - s[1] * s[5],
+                   s[1] * s[4] - s[2] * s[3], s[0] * s[5] - s[2] * s[2],
+                   s[1] * s[2] - s[0] * s[4], s[0] * s[3] - s[1] * s[1]};
+  algebra::Vector3D d = a.mean - b.mean;
+  algebra::Vector3D sd(inv[0] * d[0] + inv[1] * d[1] + inv[2] * d[2],
+                       inv[1] * d[0] + inv[3] * d[1] + inv[4] * d[2],
+                       inv[2] * d[0] + inv[4] * d[1] + inv[5] * d[2]);
+  sd /= det;
+  double ret = a.weight * b.weight * std::exp(-0.5 * (d * sd)) /
+               (std::pow(2.0 * PI, 1.5) * std::sqrt(det));
+  if (deriv) *deriv = -ret * sd;
+  return ret;
+}
+
+//! Binary tree of target Gaussians, merged by moment matching at each node.
+/** Overlap sums with a query Gaussian are computed by descending the
+    tree; a node is replaced by its merged Gaussian when an upper bound
+    on the overlap of the query with the Gaussians in the node is small
+    enough.
+ */
+class GaussianTree {
+  struct Node {
+    WeightedGaussian merged;
+    // largest distance from the merged mean to a mean in the node
+    double radius;
+    // smallest cube root of the determinant of a covariance in the node
+    double min_cbrt_det;
+    // largest trace of a covariance in the node (bounds the eigenvalues)
+    double max_trace;
+    // children (-1 for leaves) and range of Gaussians
+    int left, right;
+    int begin, end;
+  };
+  Vector<WeightedGaussian> gaussians_;
+  Vector<Node> nodes_;
+  unsigned int leaf_size_;
+
+  struct AxisLess {
+    unsigned int axis;
+    bool operator()(const WeightedGaussian &a,
+                    const WeightedGaussian &b) const {
+      return a.mean[axis] < b.mean[axis];
+    }
+  };
+
+  int build(int begin, int end) {
+    Node node;
+    node.begin = begin;
+    node.end = end;
+    node.left = node.right = -1;
+    // moment matching
+    double wsum = 0.0;
+    algebra::Vector3D mean(0.0, 0.0, 0.0);
+    algebra::Vector3D lb = gaussians_[begin].mean, ub = lb;
+    node.min_cbrt_det = std::numeric_limits<double>::max();
+    node.max_trace = 0.0;
+    for (int n = begin; n < end; ++n) {
+      const WeightedGaussian &g = gaussians_[n];
+      wsum += g.weight;
+      mean += g.weight * g.mean;
+      for (unsigned int d = 0; d < 3; ++d) {
+        lb[d] = std::min(lb[d], g.mean[d]);
+        ub[d] = std::max(ub[d], g.mean[d]);
+      }
+      node.min_cbrt_det = std::min(
+          node.min_cbrt_det, std::cbrt(std::max(get_determinant(g.cov), 0.0)));
+      node.max_trace = std::max(node.max_trace, get_trace(g.cov));
+    }
+    mean /= wsum;
+    node.merged.mean = mean;
+    node.merged.weight = wsum;
+    std::fill(node.merged.cov, node.merged.cov + 6, 0.0);
+    node.radius = 0.0;
+    for (int n = begin; n < end; ++n) {
+      const WeightedGaussian &g = gaussians_[n];
+      algebra::Vector3D d = g.mean - mean;
+      double outer[6] = {d[0] * d[0], d[0] * d[1], d[0] * d[2],
+                         d[1] * d[1], d[1] * d[2], d[2] * d[2]};
+      for (unsigned int k = 0; k < 6; ++k) {
+        node.merged.cov[k] += g.weight * (g.cov[k] + outer[k]) / wsum;
+      }
+      node.radius = std::max(node.radius, d.get_magnitude());
+    }
+    int index = nodes_.size();
+    nodes_.push_back(node);
+    if (end - begin > static_cast<int>(leaf_size_)) {
+      // split at the median along the longest side of the bounding box
+      AxisLess less;
+      less.axis = 0;
+      for (unsigned int d = 1; d < 3; ++d) {
+        if (ub[d] - lb[d] > ub[less.axis] - lb[less.axis]) less.axis = d;
+      }
+      int mid = (begin + end) / 2;
+      std::nth_element(gaussians_.begin() + begin, gaussians_.begin() + mid,
+                       gaussians_.begin() + end, less);
+      int left = build(begin, mid);
+      int right = build(mid, end);
+      nodes_[index].left = left;
+      nodes_[index].right = right;
+    }
+    return index;
+  }
+
+ public:
+  GaussianTree() : leaf_size_(4) {}
+
+  void set_gaussians(const Vector<WeightedGaussian> &gaussians,
+                     unsigned int leaf_size = 4) {
+    gaussians_ = gaussians;
+    leaf_size_ = std::max(leaf_size, 1U);
+    nodes_.clear();
+    if (!gaussians_.empty()) build(0, gaussians_.size());
+  }
+
+  unsigned int get_number_of_gaussians() const { return gaussians_.size(); }
+
+  unsigned int get_number_of_nodes() const { return nodes_.size(); }
+
+  //! Sum of the overlaps of q with all Gaussians in the tree
+  /** A node is approximated by its merged Gaussian if both its overlap
+      and an upper bound on the exact overlap are at most max_error; the
+      sum of the bounds of the approximated nodes is added to error.
+      The derivative of the sum with respect to the mean of q is added
+      to deriv, if not null.
+   */
+  double get_overlap(const WeightedGaussian &q, double max_error,
+                     double &error, algebra::Vector3D *deriv) const {
+    if (nodes_.empty()) return 0.0;
+    double ret = 0.0;
+    double q_cbrt_det = std::cbrt(std::max(get_determinant(q.cov), 0.0));
+    double q_trace = get_trace(q.cov);
+    double norm = q.weight / std::pow(2.0 * PI, 1.5);
+    algebra::Vector3D dv;
+    Ints stack(1, 0);
+    while (!stack.empty()) {
+      const Node &node = nodes_[stack.back()];
+      stack.pop_back();
+      if (max_error > 0.0) {
+        // det(A+B)^(1/3) >= det(A)^(1/3) + det(B)^(1/3) for positive
+        // semidefinite A, B, and the largest eigenvalue is bounded by
+        // the trace
+        double dist = std::max(
+            0.0, algebra::get_distance(q.mean, node.merged.mean) - node.radius);
+        double det = std::pow(q_cbrt_det + node.min_cbrt_det, 3);
+        double bound = norm * node.merged.weight *
+                       std::exp(-0.5 * dist * dist /
+                                (q_trace + node.max_trace)) /
+                       std::sqrt(det);
+        if (bound <= max_error) {
+          double approx =
+              internal::get_overlap(q, node.merged, deriv ? &dv : nullptr);
+          if (approx <= max_error) {
+            ret += approx;
+            error += std::max(bound, approx);
+            if (deriv) *deriv += dv;
+            continue;
+          }
+        }
+      }
+      if (node.left < 0) {
+        for (int n = node.begin; n < node.end; ++n) {
+          ret += internal::get_overlap(q, gaussians_[n], deriv ? &dv : nullptr);
+          if (deriv) *deriv += dv;
+        }
+      } else {
+        stack.push_back(node.left);
+        stack.push_back(node.right);
+      }
+    }
+    return ret;
+  }
+};
+
+IMPPMI_END_INTERNAL_NAMESPACE
+
+#endif /* IMPPMI_INTERNAL_GAUSSIAN_TREE_H */
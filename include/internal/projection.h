@@ -0,0 +1,177 @@
+/**
+ *  \file IMP/pmi/internal/projection.h
+ *  \brief Simple 2D images for projection-based EM2D scoring.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPPMI_INTERNAL_PROJECTION_H
+#define IMPPMI_INTERNAL_PROJECTION_H
+
+#include <IMP/pmi/pmi_config.h>
+#include <IMP/constants.h>
+#include <IMP/types.h>
+#include <algorithm>
+#include <cmath>
+
+IMPPMI_BEGIN_INTERNAL_NAMESPACE
+
+//! A 2D image with square pixels, stored row-major.
+/** Positions are in angstroms relative to the center of the image,
+    with x along the columns and y along the rows. */
+struct ProjectionImage {
+  unsigned int rows, cols;
+  double pixel_size;
+  Floats data;
+
+  ProjectionImage() : rows(0), cols(0), pixel_size(1.0) {}
+  ProjectionImage(unsigned int rows, unsigned int cols, double pixel_size)
+      : rows(rows), cols(cols), pixel_size(pixel_size),
+        data(rows * cols, 0.0) {}
+
+  double get_x(unsigned int col) const {
+    return (col - 0.5 * (cols - 1)) * pixel_size;
+  }
+  double get_y(unsigned int row) const {
+    return (row - 0.5 * (rows - 1)) * pixel_size;
+  }
+
+  //! Bilinear interpolation at (x, y); zero outside the image
+  double get_value(double x, double y) const {
+    double fc = x / pixel_size + 0.5 * (cols - 1);
+    double fr = y / pixel_size + 0.5 * (rows - 1);
+    if (fc < 0.0 || fr < 0.0 || fc > cols - 1 || fr > rows - 1) return 0.0;
+    unsigned int c0 = static_cast<unsigned int>(fc);
+    unsigned int r0 = static_cast<unsigned int>(fr);
+    unsigned int c1 = std::min(c0 + 1, cols - 1);
+    unsigned int r1 = std::min(r0 + 1, rows - 1);
+    double tc = fc - c0, tr = fr - r0;
+    return (1.0 - tr) * ((1.0 - tc) * data[r0 * cols + c0] +
+                         tc * data[r0 * cols + c1]) +
+           tr * ((1.0 - tc) * data[r1 * cols + c0] +
+                 tc * data[r1 * cols + c1]);
+  }
+
+  //! Add a 2D Gaussian of the given total weight, truncated at 3 sigma
+  void add_gaussian(double x, double y, double sigma, double weight) {
+    double s = sigma / pixel_size;
+    double fc = x / pixel_size + 0.5 * (cols - 1);
+    double fr = y / pixel_size + 0.5 * (rows - 1);
+    double cmin = std::max(0.0, std::ceil(fc - 3.0 * s));
+    double cmax = std::min(cols - 1.0, std::floor(fc + 3.0 * s));
+    double rmin = std::max(0.0, std::ceil(fr - 3.0 * s));
+    double rmax = std::min(rows - 1.0, std::floor(fr + 3.0 * s));
+    double norm = weight / (2.0 * PI * s * s);
+    for (double r = rmin; r <= rmax; r += 1.0) {
+      double dr = r - fr;
+      unsigned int row = static_cast<unsigned int>(r) * cols;
+      for (double c = cmin; c <= cmax; c += 1.0) {
+        double dc = c - fc;
+        data[row + static_cast<unsigned int>(c)] +=
+            norm * std::exp(-0.5 * (dc * dc + dr * dr) / (s * s));
+      }
+    }
+  }
+
+  //! Add another image, rotated by angle (radians) and moved to (x, y)
+  /** Only pixels within radius of (x, y) are updated. */
+  void add_image(const ProjectionImage &other, double x, double y,
+                 double angle, double radius) {
+    double cosa = std::cos(angle), sina = std::sin(angle);
+    double fc = x / pixel_size + 0.5 * (cols - 1);
+    double fr = y / pixel_size + 0.5 * (rows - 1);
+    double s = radius / pixel_size;
+    double cmin = std::max(0.0, std::ceil(fc - s));
+    double cmax = std::min(cols - 1.0, std::floor(fc + s));
+    double rmin = std::max(0.0, std::ceil(fr - s));
+    double rmax = std::min(rows - 1.0, std::floor(fr + s));
+    for (double r = rmin; r <= rmax; r += 1.0) {
+      double uy = (r - fr) * pixel_size;
+      unsigned int row = static_cast<unsigned int>(r) * cols;
+      for (double c = cmin; c <= cmax; c += 1.0) {
+        double ux = (c - fc) * pixel_size;
+        data[row + static_cast<unsigned int>(c)] +=
+            other.get_value(cosa * ux + sina * uy, -sina * ux + cosa * uy);
+      }
+    }
+  }
+};
+
+//! Centroid and principal axis of the positive part of an image
+struct ImageMoments {
+  double mass, x, y, angle;
+};
+
+//! Get the moments of max(value - threshold, 0) over the image
+inline ImageMoments get_moments(const ProjectionImage &img,
+                                double threshold = 0.0) {
+  ImageMoments ret;
+  double m = 0.0, sx = 0.0, sy = 0.0, sxx = 0.0, syy = 0.0, sxy = 0.0;
+  for (unsigned int r = 0; r < img.rows; ++r) {
+    double y = img.get_y(r);
+    for (unsigned int c = 0; c < img.cols; ++c) {
+      double v = img.data[r * img.cols + c] - threshold;
+      if (v <= 0.0) continue;
+      double x = img.get_x(c);
+      m += v;
+      sx += v * x;
+      sy += v * y;
+      sxx += v * x * x;
+      syy += v * y * y;
+      sxy += v * x * y;
+    }
+  }
+  ret.mass = m;
+  if (m > 0.0) {
+    ret.x = sx / m;
+    ret.y = sy / m;
+    double cxx = sxx / m - ret.x * ret.x, cyy = syy / m - ret.y * ret.y;
+    double cxy = sxy / m - ret.x * ret.y;
+    ret.angle = 0.5 * std::atan2(2.0 * cxy, cxx - cyy);
+  } else {
+    ret.x = ret.y = ret.angle = 0.0;
+  }
+  return ret;
+}
+
+//! Cross correlation of an image with a projection, aligned by moments
+/** The projection is moved so that its centroid and principal axis
+    match those of the image; both orientations of the axis are tried
+    and the best correlation is returned. The image values must have
+    zero mean, and image_sd is their standard deviation.
+ */
+inline double get_aligned_cross_correlation(const ProjectionImage &image,
+                                            const ImageMoments &image_moments,
+                                            double image_sd,
+                                            const ProjectionImage &proj,
+                                            const ImageMoments &proj_moments) {
+  if (proj_moments.mass <= 0.0 || image_sd <= 0.0) return 0.0;
+  double best = -1.0;
+  unsigned int npix = image.rows * image.cols;
+  for (unsigned int flip = 0; flip < 2; ++flip) {
+    double angle = image_moments.angle - proj_moments.angle + flip * PI;
+    double cosa = std::cos(angle), sina = std::sin(angle);
+    double sp = 0.0, spp = 0.0, sip = 0.0;
+    for (unsigned int r = 0; r < image.rows; ++r) {
+      double uy = image.get_y(r) - image_moments.y;
+      for (unsigned int c = 0; c < image.cols; ++c) {
+        double ux = image.get_x(c) - image_moments.x;
+        double p = proj.get_value(cosa * ux + sina * uy + proj_moments.x,
+                                  -sina * ux + cosa * uy + proj_moments.y);
+        sp += p;
+        spp += p * p;
+        sip += image.data[r * image.cols + c] * p;
+      }
+    }
+    double mean = sp / npix;
+    double var = spp / npix - mean * mean;
+    if (var > 0.0) {
+      best = std::max(best, sip / (npix * image_sd * std::sqrt(var)));
+    }
+  }
+  return best;
+}
+
+IMPPMI_END_INTERNAL_NAMESPACE
+
+#endif /* IMPPMI_INTERNAL_PROJECTION_H */
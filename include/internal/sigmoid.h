@@ -0,0 +1,70 @@
+/**
+ *  \file IMP/pmi/internal/sigmoid.h
+ *  \brief Sigmoid scores shared by the PMI geometric restraints.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPPMI_INTERNAL_SIGMOID_H
+#define IMPPMI_INTERNAL_SIGMOID_H
+
+#include <IMP/pmi/pmi_config.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/constants.h>
+#include <cmath>
+
+IMPPMI_BEGIN_INTERNAL_NAMESPACE
+
+//! Score -log(1-(1-plateau)/(1+exp(-argvalue))) and its derivative
+inline double get_sigmoid_score(double argvalue, double plateau,
+                                double &dscore) {
+  double sigmoid = 1.0 / (1.0 + std::exp(-argvalue));
+  double prob = (1.0 - plateau) * sigmoid;
+  dscore = prob * (1.0 - sigmoid) / (1.0 - prob);
+  return -std::log(1.0 - prob);
+}
+
+//! Difference a-b between two angles in degrees, wrapped to [-180, 180)
+inline double get_angle_difference(double a, double b) {
+  double diff = std::fmod(a - b + 180.0 + 360.0, 360.0);
+  if (diff < 0.0) diff += 360.0;
+  return diff - 180.0;
+}
+
+//! Cylindrical angle (in degrees) of v around the z axis
+/** The derivatives of the angle with respect to x and y are returned
+    in dx and dy (zero on the axis). */
+inline double get_cylindrical_angle(const algebra::Vector3D &v, double &dx,
+                                    double &dy) {
+  double r2 = v[0] * v[0] + v[1] * v[1];
+  double todeg = 180.0 / PI;
+  if (r2 > 0.0) {
+    dx = -v[1] / r2 * todeg;
+    dy = v[0] / r2 * todeg;
+  } else {
+    dx = dy = 0.0;
+  }
+  return std::atan2(v[1], v[0]) * todeg;
+}
+
+//! Score keeping an angle (in degrees) within [mintheta, maxtheta]
+/** The derivative with respect to the angle is returned in dscore. */
+inline double get_angle_range_score(double angle, double mintheta,
+                                    double maxtheta, double softness,
+                                    double plateau, double &dscore) {
+  double argvalue1 = get_angle_difference(angle, maxtheta) / softness;
+  double argvalue2 = -get_angle_difference(angle, mintheta) / softness;
+  double score;
+  if (argvalue1 >= argvalue2) {
+    score = get_sigmoid_score(argvalue1, plateau, dscore);
+    dscore /= softness;
+  } else {
+    score = get_sigmoid_score(argvalue2, plateau, dscore);
+    dscore /= -softness;
+  }
+  return score;
+}
+
+IMPPMI_END_INTERNAL_NAMESPACE
+
+#endif /* IMPPMI_INTERNAL_SIGMOID_H */
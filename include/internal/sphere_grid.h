@@ -0,0 +1,260 @@
+/**
+ *  \file IMP/pmi/internal/sphere_grid.h
+ *  \brief Grid of spheres for fast closest-pair searches between blocks.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ */
+
+#ifndef IMPPMI_INTERNAL_SPHERE_GRID_H
+#define IMPPMI_INTERNAL_SPHERE_GRID_H
+
+#include <IMP/pmi/pmi_config.h>
+#include <IMP/algebra/Sphere3D.h>
+#include <IMP/algebra/Vector3D.h>
+#include <IMP/thread_macros.h>
+#include <IMP/Vector.h>
+#include <algorithm>
+#include <cmath>
+#include <limits>
+
+IMPPMI_BEGIN_INTERNAL_NAMESPACE
+
+//! Spheres binned on a uniform grid.
+/** Supports finding the sphere whose surface is closest to a query
+    sphere by searching shells of cells of increasing size around the
+    query, stopping as soon as no unvisited cell can hold a closer sphere.
+ */
+class SphereGrid {
+  algebra::Sphere3Ds spheres_;
+  double cell_;
+  double max_radius_;
+  algebra::Vector3D origin_;
+  int dims_[3];
+  // sphere indexes sorted by cell; cell c holds
+  // indexes_[cell_start_[c]] .. indexes_[cell_start_[c+1]-1]
+  Ints cell_start_;
+  Ints indexes_;
+
+  int get_cell_index(int i, int j, int k) const {
+    return (i * dims_[1] + j) * dims_[2] + k;
+  }
+
+  void get_cell(const algebra::Vector3D &v, int *c) const {
+    for (unsigned int d = 0; d < 3; ++d) {
+      int cd = static_cast<int>(std::floor((v[d] - origin_[d]) / cell_));
+      c[d] = std::max(0, std::min(dims_[d] - 1, cd));
+    }
+  }
+
+  // visit cell (i,j,k) if inside the grid, updating best and index
+  void search_cell(int i, int j, int k, const algebra::Sphere3D &q,
+                   double &best, int &index) const {
+    if (i < 0 || j < 0 || k < 0 || i >= dims_[0] || j >= dims_[1] ||
+        k >= dims_[2]) {
+      return;
+    }
+    int c = get_cell_index(i, j, k);
+    for (int n = cell_start_[c]; n < cell_start_[c + 1]; ++n) {
+      double d = algebra::get_distance(q, spheres_[indexes_[n]]);
+      if (d < best) {
+        best = d;
+        index = indexes_[n];
+      }
+    }
+  }
+
+ public:
+  SphereGrid() : cell_(1.0), max_radius_(0.0) {
+    dims_[0] = dims_[1] = dims_[2] = 0;
+  }
+
+  //! Bin the spheres; a non-positive cell size picks one automatically
+  void set_spheres(const algebra::Sphere3Ds &spheres, double cell = 0.0) {
+    spheres_ = spheres;
+    max_radius_ = 0.0;
+    if (spheres_.empty()) {
+      dims_[0] = dims_[1] = dims_[2] = 0;
+      cell_start_.clear();
+      indexes_.clear();
+      return;
+    }
+    algebra::Vector3D lb = spheres_[0].get_center();
+    algebra::Vector3D ub = lb;
+    for (unsigned int n = 0; n < spheres_.size(); ++n) {
+      const algebra::Vector3D &v = spheres_[n].get_center();
+      for (unsigned int d = 0; d < 3; ++d) {
+        lb[d] = std::min(lb[d], v[d]);
+        ub[d] = std::max(ub[d], v[d]);
+      }
+      max_radius_ = std::max(max_radius_, spheres_[n].get_radius());
+    }
+    if (cell <= 0.0) {
+      // aim for a few spheres per cell
+      double volume = 1.0;
+      for (unsigned int d = 0; d < 3; ++d) {
+        volume *= std::max(ub[d] - lb[d], 1.0);
+      }
+      cell = std::max(std::pow(4.0 * volume / spheres_.size(), 1.0 / 3.0),
+                      std::max(2.0 * max_radius_, 1.0));
+    }
+    cell_ = cell;
+    origin_ = lb;
+    int ncells = 1;
+    for (unsigned int d = 0; d < 3; ++d) {
+      dims_[d] = static_cast<int>(std::floor((ub[d] - lb[d]) / cell_)) + 1;
+      ncells *= dims_[d];
+    }
+    // counting sort of the spheres by cell
+    Ints cells(spheres_.size());
+    cell_start_.assign(ncells + 1, 0);
+    for (unsigned int n = 0; n < spheres_.size(); ++n) {
+      int c[3];
+      get_cell(spheres_[n].get_center(), c);
+      cells[n] = get_cell_index(c[0], c[1], c[2]);
+      ++cell_start_[cells[n] + 1];
+    }
+    for (int c = 0; c < ncells; ++c) {
+      cell_start_[c + 1] += cell_start_[c];
+    }
+    indexes_.resize(spheres_.size());
+    Ints fill(cell_start_.begin(), cell_start_.end() - 1);
+    for (unsigned int n = 0; n < spheres_.size(); ++n) {
+      indexes_[fill[cells[n]]++] = n;
+    }
+  }
+
+  const algebra::Sphere3Ds &get_spheres() const { return spheres_; }
+
+  unsigned int get_number_of_spheres() const { return spheres_.size(); }
+
+  //! Get the indexes of the spheres whose centers are closer than distance
+  /** Only the cells overlapping the bounding box of the query ball are
+      visited. */
+  void get_in_ball(const algebra::Vector3D &center, double distance,
+                   Ints &ret) const {
+    ret.clear();
+    if (spheres_.empty()) return;
+    int lb[3], ub[3];
+    for (unsigned int d = 0; d < 3; ++d) {
+      lb[d] = static_cast<int>(
+          std::floor((center[d] - distance - origin_[d]) / cell_));
+      ub[d] = static_cast<int>(
+          std::floor((center[d] + distance - origin_[d]) / cell_));
+      lb[d] = std::max(lb[d], 0);
+      ub[d] = std::min(ub[d], dims_[d] - 1);
+      if (lb[d] > ub[d]) return;
+    }
+    double distance2 = distance * distance;
+    for (int i = lb[0]; i <= ub[0]; ++i) {
+      for (int j = lb[1]; j <= ub[1]; ++j) {
+        for (int k = lb[2]; k <= ub[2]; ++k) {
+          int c = get_cell_index(i, j, k);
+          for (int n = cell_start_[c]; n < cell_start_[c + 1]; ++n) {
+            double d2 = algebra::get_squared_distance(
+                center, spheres_[indexes_[n]].get_center());
+            if (d2 < distance2) ret.push_back(indexes_[n]);
+          }
+        }
+      }
+    }
+  }
+
+  //! Get the sphere closest to q, if it is closer than best.
+  /** On return, best is the surface distance to the closest sphere and
+      index is its index, or both are unchanged if no sphere is closer
+      than the initial value of best.
+   */
+  void get_closest(const algebra::Sphere3D &q, double &best,
+                   int &index) const {
+    if (spheres_.empty()) return;
+    int c[3];
+    get_cell(q.get_center(), c);
+    int maxr = std::max(dims_[0], std::max(dims_[1], dims_[2]));
+    for (int r = 0; r <= maxr; ++r) {
+      // every cell in shell r or beyond is at least (r-1) cells away
+      if (r > 0 &&
+          (r - 1) * cell_ - q.get_radius() - max_radius_ >= best) {
+        return;
+      }
+      for (int i = -r; i <= r; ++i) {
+        for (int j = -r; j <= r; ++j) {
+          if (std::abs(i) == r || std::abs(j) == r) {
+            for (int k = -r; k <= r; ++k) {
+              search_cell(c[0] + i, c[1] + j, c[2] + k, q, best, index);
+            }
+          } else {
+            search_cell(c[0] + i, c[1] + j, c[2] - r, q, best, index);
+            if (r > 0) {
+              search_cell(c[0] + i, c[1] + j, c[2] + r, q, best, index);
+            }
+          }
+        }
+      }
+    }
+  }
+};
+
+//! Minimum distance between the surfaces of the spheres of two grids.
+/** The search stops early once a distance not larger than lower_bound
+    is found. The indexes of the closest pair are returned in i1 and i2
+    (or -1 if either grid is empty, in which case the distance is
+    infinite).
+ */
+inline double get_bipartite_minimum_sphere_distance(
+    const SphereGrid &g1, const SphereGrid &g2, double lower_bound, int &i1,
+    int &i2) {
+  double best = std::numeric_limits<double>::infinity();
+  i1 = -1;
+  i2 = -1;
+  // query the larger grid with the spheres of the smaller one
+  bool swap = g1.get_number_of_spheres() > g2.get_number_of_spheres();
+  const SphereGrid &small = swap ? g2 : g1;
+  const SphereGrid &large = swap ? g1 : g2;
+  const algebra::Sphere3Ds &spheres = small.get_spheres();
+  for (unsigned int n = 0; n < spheres.size() && best > lower_bound; ++n) {
+    int index = -1;
+    large.get_closest(spheres[n], best, index);
+    if (index >= 0) {
+      i1 = n;
+      i2 = index;
+    }
+  }
+  if (swap) std::swap(i1, i2);
+  return best;
+}
+
+//! Minimum sphere surface distances between all pairs of grids.
+/** Fills the dense, row-major matrix dist (zero diagonal, infinity for
+    pairs involving an empty grid) and, for each pair, the indexes of the
+    closest spheres in closest1 and closest2 (-1 for empty grids).
+    Searches stop early at distances not larger than lower_bound; if
+    OpenMP is available, block pairs are split over nthreads threads.
+ */
+inline void get_bipartite_minimum_sphere_distances(
+    const Vector<SphereGrid> &grids, double lower_bound, Floats &dist,
+    Ints &closest1, Ints &closest2, unsigned int nthreads = 1) {
+  int nb = grids.size();
+  dist.assign(nb * nb, std::numeric_limits<double>::infinity());
+  closest1.assign(nb * nb, -1);
+  closest2.assign(nb * nb, -1);
+  for (int i = 0; i < nb; ++i) dist[i * nb + i] = 0.0;
+  nthreads = std::max(nthreads, 1U);
+  IMP_OMP_PRAGMA(parallel for schedule(dynamic) num_threads(nthreads))
+  for (int i = 0; i < nb; ++i) {
+    for (int j = i + 1; j < nb; ++j) {
+      int i1, i2;
+      double d = get_bipartite_minimum_sphere_distance(grids[i], grids[j],
+                                                       lower_bound, i1, i2);
+      dist[i * nb + j] = d;
+      dist[j * nb + i] = d;
+      closest1[i * nb + j] = i1;
+      closest2[i * nb + j] = i2;
+      closest1[j * nb + i] = i2;
+      closest2[j * nb + i] = i1;
+    }
+  }
+}
+
+IMPPMI_END_INTERNAL_NAMESPACE
+
+#endif /* IMPPMI_INTERNAL_SPHERE_GRID_H */
@@ -17,30 +17,46 @@
 #include <IMP/atom/Copy.h>
 #include <IMP/atom/Selection.h>
 #include <IMP/core/internal/dihedral_helpers.h>
+#include <IMP/pmi/ElasticNetworkRestraint.h>
+#include <IMP/pmi/internal/sphere_grid.h>
 #include <IMP/Vector.h>
 #include <boost/lexical_cast.hpp>
+#include <algorithm>
 
 IMPPMI_BEGIN_NAMESPACE
 
 //! Create an elastic network restraint set
-RestraintSet * create_elastic_network(const Particles &ps,
-                                      Float dist_cutoff,
-                                      Float strength){
-  IMP_NEW(RestraintSet,rs,(ps[0]->get_model(),"ElasticNetwork"));
+/** Every pair of particles closer than dist_cutoff is restrained
+    harmonically at its current distance, with the given strength.
+    Close pairs are found by binning the particles on a grid, and all
+    pairs are held by a single ElasticNetworkRestraint in the returned set.
+ */
+inline RestraintSet * create_elastic_network(const Particles &ps,
+                                             Float dist_cutoff,
+                                             Float strength){
+  Model *m = ps[0]->get_model();
+  IMP_NEW(RestraintSet,rs,(m,"ElasticNetwork"));
+  IMP_NEW(ElasticNetworkRestraint,enr,(m,strength,"ElasticNetwork%1%"));
   int nps=ps.size();
+  algebra::Sphere3Ds spheres(nps);
+  for (int n=0;n<nps;n++){
+    spheres[n]=algebra::Sphere3D(core::XYZ(ps[n]).get_coordinates(),0.0);
+  }
+  internal::SphereGrid grid;
+  grid.set_spheres(spheres);
+  Ints close;
   for (int n1=0;n1<nps;n1++){
-    for (int n2=n1+1;n2<nps;n2++){
-      Float dist = core::get_distance(core::XYZ(ps[n1]),
-                                      core::XYZ(ps[n2]));
-      if (dist<dist_cutoff){
-        IMP_NEW(core::HarmonicDistancePairScore,hdist,
-                (dist,strength));
-        Pointer<Restraint> rx = IMP::create_restraint(hdist.get(),
-                                           ParticlePair(ps[n1],ps[n2]));
-        rs->add_restraint(rx);
-      }
+    grid.get_in_ball(spheres[n1].get_center(),dist_cutoff,close);
+    std::sort(close.begin(),close.end());
+    for (unsigned int k=0;k<close.size();k++){
+      int n2=close[k];
+      if (n2<=n1) continue;
+      Float dist = algebra::get_distance(spheres[n1].get_center(),
+                                         spheres[n2].get_center());
+      enr->add_pair(ps[n1]->get_index(),ps[n2]->get_index(),dist);
     }
   }
+  rs->add_restraint(enr);
   return rs.release();
 }
 
@@ -51,31 +67,69 @@ Float get_dihedral_angle(const atom::Atom &p1,
   return core::internal::dihedral(p1,p2,p3,p4,nullptr,nullptr,nullptr,nullptr);
 }
 
+//! Get the minimum distance between the surfaces of two sets of spheres
+/** Overlapping spheres and empty sets give a distance of zero.
+    The spheres are binned on a grid, so that only nearby pairs are
+    checked, and the search stops at the first overlapping pair.
+ */
 inline Float get_bipartite_minimum_sphere_distance(const IMP::core::XYZRs& m1,
                                                    const IMP::core::XYZRs& m2) {
-
-  double mindist = -1.0 ;
-
-  for (unsigned int k1 = 0; k1 < m1.size(); ++k1) {
-    for (unsigned int k2 = 0; k2 < m2.size(); ++k2) {
-       double dist = IMP::core::get_distance(m1[k1],m2[k2]);
-       if (mindist < 0.0){mindist=dist;}
-       if (mindist > dist){mindist=dist;}
-      }
-   }
-  if (mindist < 0 ){mindist = 0;}
-  return mindist;
+  if (m1.empty() || m2.empty()) return 0.0;
+  algebra::Sphere3Ds s1(m1.size()), s2(m2.size());
+  for (unsigned int k = 0; k < m1.size(); ++k) s1[k] = m1[k].get_sphere();
+  for (unsigned int k = 0; k < m2.size(); ++k) s2[k] = m2[k].get_sphere();
+  internal::SphereGrid g1, g2;
+  g1.set_spheres(s1);
+  g2.set_spheres(s2);
+  int i1, i2;
+  double mindist = internal::get_bipartite_minimum_sphere_distance(
+                                                     g1, g2, 0.0, i1, i2);
+  return std::max(mindist, 0.0);
 }
 
+//! Get the matrix of minimum sphere distances between sets of particles
+/** Returns the dense nxn matrix, flattened in row-major order, for n
+    sets of particles (use numpy.array(...).reshape(n, n) in Python).
+    Distances are computed as in get_bipartite_minimum_sphere_distance().
+    If IMP was built with OpenMP, the set pairs are split over nthreads
+    threads.
+ */
+inline Floats get_bipartite_minimum_sphere_distance_matrix(
+                                  const ParticlesTemps & pss,
+                                  unsigned int nthreads = 1) {
+  Vector<internal::SphereGrid> grids(pss.size());
+  for (unsigned int k = 0; k < pss.size(); ++k) {
+    algebra::Sphere3Ds spheres(pss[k].size());
+    for (unsigned int n = 0; n < pss[k].size(); ++n) {
+      spheres[n] = core::XYZR(pss[k][n]).get_sphere();
+    }
+    grids[k].set_spheres(spheres);
+  }
+  Floats mindistances;
+  Ints closest1, closest2;
+  internal::get_bipartite_minimum_sphere_distances(grids, 0.0, mindistances,
+                                                   closest1, closest2,
+                                                   nthreads);
+  for (unsigned int k = 0; k < mindistances.size(); ++k) {
+    // empty sets give infinity, overlapping spheres a negative distance
+    if (mindistances[k] < 0.0 || closest1[k] < 0) mindistances[k] = 0.0;
+  }
+  return mindistances;
+}
 
-inline Floats get_list_of_bipartite_minimum_sphere_distance(const ParticlesTemps & pss) {
+//! Get the minimum sphere distances between each pair of sets of particles
+/** The distances are listed in the order (0,1), (0,2), ..., (1,2), ...,
+    as in a condensed distance matrix.
+ */
+inline Floats get_list_of_bipartite_minimum_sphere_distance(
+                                  const ParticlesTemps & pss,
+                                  unsigned int nthreads = 1) {
+  Floats matrix = get_bipartite_minimum_sphere_distance_matrix(pss, nthreads);
   Floats mindistances;
-  for (unsigned int k1 = 0; k1 < pss.size()-1; ++k1) {
-    for (unsigned int k2 = k1+1; k2 < pss.size(); ++k2) {
-       IMP::core::XYZRs xyzrs1=IMP::core::XYZRs(pss[k1]);
-       IMP::core::XYZRs xyzrs2=IMP::core::XYZRs(pss[k2]);
-       double dist = IMP::pmi::get_bipartite_minimum_sphere_distance(xyzrs1,xyzrs2);
-       mindistances.push_back(dist);
+  unsigned int n = pss.size();
+  for (unsigned int k1 = 0; k1 < n; ++k1) {
+    for (unsigned int k2 = k1+1; k2 < n; ++k2) {
+       mindistances.push_back(matrix[k1 * n + k2]);
       }
    }
   return mindistances;
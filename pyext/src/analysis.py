@@ -1400,6 +1400,138 @@ class GetContactMap(object):
         plt.show()
 
 
+# ------------------------------------------------------------------
+# batched SAXS profiles
+
+def get_saxs_form_factors(particles, ff_type=None):
+    """Get the zero-angle SAXS form factors of particles, for use with
+       get_saxs_profiles().
+    @param particles The particles (atoms, or CA atoms for residue
+           form factors)
+    @param ff_type The IMP.saxs form factor type (default HEAVY_ATOMS)
+    @return a NumPy array of form factors
+    """
+    import IMP.saxs
+    if ff_type is None:
+        ff_type = IMP.saxs.HEAVY_ATOMS
+    table = IMP.saxs.get_default_form_factor_table()
+    return np.array([table.get_form_factor(p, ff_type) for p in particles])
+
+
+def get_saxs_profiles(coordinates, form_factors, q, bin_size=0.5,
+                      modulation=0.23, max_block_size=10000000):
+    """Compute the SAXS profiles of many frames at once.
+    Each profile is computed with the Debye formula from a histogram of
+    the pair distances, weighted by the products of the (zero-angle)
+    form factors, and multiplied by exp(-modulation q^2) to approximate
+    the decay of the form factors with q, as in IMP.saxs.
+    All frames are histogrammed together; pairs are processed in blocks
+    of at most max_block_size distances to bound memory use.
+    @param coordinates Array of shape (N_frames, N_particles, 3)
+    @param form_factors Array of N_particles form factors
+           (see get_saxs_form_factors())
+    @param q Scattering vector values at which to compute the profiles
+    @param bin_size Width of the distance histogram bins, in angstroms
+    @param modulation Form factor modulation parameter
+    @param max_block_size Largest number of distances in memory at once
+    @return an array of shape (N_frames, len(q))
+    """
+    coords = np.asarray(coordinates, dtype=float)
+    if coords.ndim == 2:
+        coords = coords[np.newaxis]
+    ff = np.asarray(form_factors, dtype=float)
+    q = np.asarray(q, dtype=float)
+    nframes, nparticles = coords.shape[:2]
+    if ff.shape != (nparticles,):
+        raise ValueError("Expected %d form factors, got %d"
+                         % (nparticles, ff.shape[0]))
+    extent = np.sqrt((np.ptp(coords, axis=1) ** 2).sum(axis=1)).max() \
+        if nparticles > 0 else 0.
+    nbins = int(extent / bin_size) + 2
+    hist = np.zeros(nframes * nbins)
+    # block over frames and rows of the upper triangle of the distances
+    frames_per_block = max(1, min(nframes,
+                                  max_block_size // max(1, nparticles ** 2)))
+    rows_per_block = max(1, max_block_size // max(1, frames_per_block
+                                                  * nparticles))
+    for f0 in range(0, nframes, frames_per_block):
+        f1 = min(nframes, f0 + frames_per_block)
+        offsets = (np.arange(f0, f1) * nbins)[:, np.newaxis, np.newaxis]
+        for i0 in range(0, nparticles - 1, rows_per_block):
+            i1 = min(nparticles - 1, i0 + rows_per_block)
+            # only pairs i < j, starting after the first row of the block
+            cols = slice(i0 + 1, nparticles)
+            dist = np.sqrt(((coords[f0:f1, i0:i1, np.newaxis, :]
+                             - coords[f0:f1, np.newaxis, cols, :]) ** 2)
+                           .sum(axis=3))
+            mask = (np.arange(i0 + 1, nparticles)[np.newaxis, :]
+                    > np.arange(i0, i1)[:, np.newaxis])
+            weights = 2. * ff[i0:i1, np.newaxis] * ff[np.newaxis, cols]
+            bins = (dist / bin_size).astype(int) + offsets
+            hist += np.bincount(
+                bins[:, mask].ravel(),
+                weights=np.broadcast_to(weights[mask],
+                                        (f1 - f0, int(mask.sum()))).ravel(),
+                minlength=nframes * nbins)
+    hist = hist.reshape((nframes, nbins))
+    r = (np.arange(nbins) + 0.5) * bin_size
+    sinc = np.sinc(np.outer(r, q) / np.pi)
+    profiles = hist.dot(sinc) + (ff ** 2).sum()
+    return profiles * np.exp(-modulation * q ** 2)
+
+
+def get_saxs_chi_squares(profiles, exp_intensities, exp_errors=None):
+    """Fit SAXS profiles to an experimental profile.
+    Each profile is scaled by the factor c that minimizes its chi^2,
+    sum(((I_exp - c I)/sigma)^2)/N.
+    @param profiles Array of shape (N_frames, N_q), as returned by
+           get_saxs_profiles() at the experimental q values
+    @param exp_intensities The N_q experimental intensities
+    @param exp_errors The N_q experimental errors (if not given, all
+           points are weighted equally)
+    @return a tuple of arrays of the N_frames chi^2 values and scale
+            factors
+    """
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=float))
+    iexp = np.asarray(exp_intensities, dtype=float)
+    if exp_errors is None:
+        weights = np.ones_like(iexp)
+    else:
+        weights = 1. / np.asarray(exp_errors, dtype=float) ** 2
+    scales = (profiles.dot(weights * iexp)
+              / (profiles ** 2).dot(weights))
+    resid = iexp[np.newaxis, :] - scales[:, np.newaxis] * profiles
+    chi2 = (resid ** 2).dot(weights) / iexp.shape[0]
+    return chi2, scales
+
+
+def read_saxs_profile(filename):
+    """Read an experimental SAXS profile, as columns of q, intensity and
+       (optionally) error.
+    @return a tuple of arrays of q, intensities and errors (None if the
+            file has no error column)
+    """
+    data = np.atleast_2d(np.loadtxt(filename, comments='#'))
+    errors = data[:, 2] if data.shape[1] > 2 else None
+    return data[:, 0], data[:, 1], errors
+
+
+def get_saxs_fits(coordinates, form_factors, exp_profile, **kwargs):
+    """Compute the SAXS profiles of many frames and fit them to an
+       experimental profile.
+    @param coordinates Array of shape (N_frames, N_particles, 3)
+    @param form_factors Array of N_particles form factors
+    @param exp_profile The experimental profile file name
+    @param kwargs Other arguments for get_saxs_profiles()
+    @return a tuple of the (N_frames, N_q) profiles and the N_frames
+            chi^2 values
+    """
+    q, iexp, errors = read_saxs_profile(exp_profile)
+    profiles = get_saxs_profiles(coordinates, form_factors, q, **kwargs)
+    chi2, scales = get_saxs_chi_squares(profiles, iexp, errors)
+    return profiles, chi2
+
+
 # ------------------------------------------------------------------
 # a few random tools
 
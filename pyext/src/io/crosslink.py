@@ -8,6 +8,8 @@
 import IMP
 import IMP.pmi
 import operator
+import gc
+import numpy as np
 
 class _CrossLinkDataBaseStandardKeys(object):
     '''
@@ -88,11 +90,12 @@ class _ProteinsResiduesArray(tuple):
     residue1 and residue2.
     '''
 
+    cldbsk=_CrossLinkDataBaseStandardKeys()
+
     def __new__(self,input_data):
         '''
         @input_data can be a dict or a tuple
         '''
-        self.cldbsk=_CrossLinkDataBaseStandardKeys()
         if type(input_data) is dict:
             p1=input_data[self.cldbsk.protein1_key]
             p2=input_data[self.cldbsk.protein2_key]
@@ -172,6 +175,115 @@ class FilterOperator(object):
 
         return op(FilterOperator1.evaluate(xl_item), FilterOperator2.evaluate(xl_item))
 
+    def _get_mask(self, columns):
+        '''
+        Evaluate the filter on all cross-links at once
+        @param columns a _CrossLinkColumns view of the database
+        @return a boolean NumPy array, one element per cross-link
+        '''
+        if len(self.operations) == 0:
+            keyword, op, value = self.values
+            return columns.get_column(keyword).get_mask(op, value)
+        FilterOperator1, op, FilterOperator2 = self.operations
+        return op(FilterOperator1._get_mask(columns),
+                  FilterOperator2._get_mask(columns))
+
+
+class _Column(object):
+    '''
+    A single key of all cross-links of a database. Numeric values are kept
+    in a NumPy array; other values (e.g. protein names) are kept as
+    categorical data, an array of integer codes into the distinct values,
+    so that an operator is evaluated only once per distinct value.
+    '''
+
+    _vector_operators = (operator.eq, operator.ne, operator.lt,
+                         operator.le, operator.gt, operator.ge)
+    _numeric_types = (int, float)
+
+    def __init__(self, values):
+        self.values = values
+        self.array = None
+        self.codes = None
+        self.categories = None
+        if all(type(v) in self._numeric_types for v in values):
+            self.array = np.array(values)
+        else:
+            categories = {}
+            try:
+                codes = [categories.setdefault(v, len(categories))
+                         for v in values]
+            except TypeError:
+                # unhashable values, such as the redundancy lists
+                return
+            self.codes = np.array(codes, dtype=np.intp)
+            self.categories = sorted(categories, key=categories.get)
+
+    def get_mask(self, op, value):
+        if (self.array is not None and op in self._vector_operators
+                and type(value) in self._numeric_types):
+            return np.asarray(op(self.array, value), dtype=bool)
+        elif self.codes is not None:
+            mask = np.array([bool(op(c, value)) for c in self.categories],
+                            dtype=bool)
+            return mask[self.codes]
+        else:
+            return np.array([bool(op(v, value)) for v in self.values],
+                            dtype=bool)
+
+
+class _CrossLinkChanges(object):
+    '''
+    Counters of the operations that may have changed cross-links.
+    Cross-link records, and the lists holding them, are shared between
+    databases (e.g. by filter(), jackknife() and append_database()) and
+    may be changed in place by callers, so all databases share one set
+    of counters.
+    '''
+    # cross-link records may have been changed
+    records=0
+    # lists of cross-links may have been changed
+    lists=0
+
+    @classmethod
+    def change_records(cls):
+        cls.records+=1
+
+    @classmethod
+    def change_lists(cls):
+        cls.records+=1
+        cls.lists+=1
+
+
+class _CrossLinkColumns(object):
+    '''
+    Column-wise view of the cross-links of a CrossLinkDataBase,
+    used to evaluate a FilterOperator on all cross-links at once.
+    Columns are built on first use.
+    '''
+
+    def __init__(self, data_base, derived_keys, update):
+        '''
+        @param data_base the dictionary of lists of cross-links
+        @param derived_keys the keys computed from the other keys
+        @param update function to call to compute the derived keys
+        '''
+        self.xlids = []
+        self.cross_links = []
+        for xlid, xls in data_base.items():
+            self.xlids += [xlid] * len(xls)
+            self.cross_links += xls
+        self.derived_keys = derived_keys
+        self.update = update
+        self.columns = {}
+
+    def get_column(self, key):
+        if key not in self.columns:
+            if key in self.derived_keys:
+                self.update()
+            self.columns[key] = _Column([xl[key] for xl in self.cross_links])
+        return self.columns[key]
+
 '''
 def filter_factory(xl_):
 
@@ -346,9 +458,19 @@ class ResiduePairListParser(_CrossLinkDataBaseStandardKeys):
                     residue2=spi[1]
                     residue_pair_indexes.append((residue1,residue2))
                     chain_pair_indexes.append((chain1,chain2))
-            print(residue_pair_indexes,chain_pair_indexes)
             return residue_pair_indexes,chain_pair_indexes
 
+    def get_lists(self,input_strings):
+        '''
+        This function returns the result of get_list() for each of a
+        list of strings. Each distinct string is parsed only once.
+        '''
+        parsed={}
+        for input_string in input_strings:
+            if input_string not in parsed:
+                parsed[input_string]=self.get_list(input_string)
+        return [parsed[input_string] for input_string in input_strings]
+
 
 class FixedFormatParser(_CrossLinkDataBaseStandardKeys):
     '''
@@ -377,6 +499,35 @@ class FixedFormatParser(_CrossLinkDataBaseStandardKeys):
                 xl[self.residue2_key]=int(tockens[5])
                 return xl
 
+def _read_csv_chunks(file_name,chunk_size=None):
+    '''
+    Read a comma-separated-values file with a header line
+    @param file_name the file to read
+    @param chunk_size the number of rows to read at a time, or None
+           to read all rows at once
+    @return a generator of (field names, list of rows) tuples. Empty rows
+            are skipped, and short rows are padded with None, as done
+            by csv.DictReader.
+    '''
+    import csv
+    import itertools
+    with open(file_name) as fh:
+        reader=csv.reader(fh)
+        fieldnames=next(reader,None)
+        if fieldnames is None:
+            return
+        nfields=len(fieldnames)
+        while True:
+            rows=list(itertools.islice(reader,chunk_size))
+            if not rows:
+                break
+            if any(len(row)!=nfields for row in rows):
+                rows=[row+[None]*(nfields-len(row)) for row in rows if row]
+            yield fieldnames,rows
+            if chunk_size is None:
+                break
+
+
 class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
     import operator
     '''
@@ -391,9 +542,13 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         @param data_base an instance of CrossLinkDataBase to build the new database on
         '''
         if data_base is None:
-            self.data_base = {}
+            self._data_base = {}
         else:
-            self.data_base=data_base
+            self._data_base=data_base
+        self.__length=None
+        self.__columns=None
+        self.__sub_index_changed=True
+        self.__redundancy_changed=True
 
         _CrossLinkDataBaseStandardKeys.__init__(self)
         if converter is not None:
@@ -406,168 +561,284 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             self.list_parser=None
             self.converter = None
 
-        self.__update()
+    def __update(self,sub_index=True,redundancy=True):
+        '''
+        Mark the dataset as changed. The unique sub-indexes and the
+        redundancy are recomputed lazily, when the cross-links are next
+        accessed, so that a series of changes pays for only one update.
+        @param sub_index whether the unique sub-indexes must be recomputed
+        @param redundancy whether the redundancy must be recomputed
+        '''
+        _CrossLinkChanges.change_lists()
+        if sub_index:
+            self.__sub_index_changed=True
+        if redundancy:
+            self.__redundancy_changed=True
+
+    def __update_for_key(self,key):
+        '''
+        Mark the dataset as changed after the values of a key were changed
+        '''
+        self.__update(sub_index=key in (self.unique_sub_index_key,
+                                        self.unique_sub_id_key),
+                      redundancy=key in (self.protein1_key,self.protein2_key,
+                                         self.residue1_key,self.residue2_key,
+                                         self.unique_sub_id_key,
+                                         self.redundancy_key,
+                                         self.redundancy_list_key))
+
+    def __check_updated(self):
+        if self.__sub_index_changed:
+            self.update_cross_link_unique_sub_index()
+        if self.__redundancy_changed:
+            self.update_cross_link_redundancy()
+
+    def __get_data_base(self,lists=True):
+        '''
+        Return the cross-links to a caller that may modify them,
+        bringing the dataset up to date first
+        @param lists whether the caller may also change the lists of
+               cross-links, rather than only the cross-links
+        '''
+        self.__check_updated()
+        if lists:
+            _CrossLinkChanges.change_lists()
+        else:
+            _CrossLinkChanges.change_records()
+        return self._data_base
 
-    def __update(self):
+    def __get_columns(self):
+        '''
+        Return the column-wise view of the cross-links. The view is kept
+        until any database hands out cross-links that may be changed.
         '''
-        Update the whole dataset after changes
+        version=(_CrossLinkChanges.records,_CrossLinkChanges.lists)
+        if self.__columns is None or self.__columns[0]!=version:
+            self.__columns=(version,_CrossLinkColumns(self._data_base,
+                      (self.unique_sub_index_key,self.unique_sub_id_key,
+                       self.redundancy_key,self.redundancy_list_key),
+                      self.__check_updated))
+        return self.__columns[1]
+
+    def __get_filtered_data_base(self,FilterOperator):
         '''
-        self.update_cross_link_unique_sub_index()
-        self.update_cross_link_redundancy()
+        Return a dictionary of the cross-links that pass the filter,
+        evaluated on all cross-links at once
+        '''
+        columns=self.__get_columns()
+        mask=FilterOperator._get_mask(columns)
+        xlids=columns.xlids
+        cross_links=columns.cross_links
+        new_xl_dict={}
+        for i in np.flatnonzero(mask).tolist():
+            xlid=xlids[i]
+            if xlid not in new_xl_dict:
+                new_xl_dict[xlid]=[cross_links[i]]
+            else:
+                new_xl_dict[xlid].append(cross_links[i])
+        return new_xl_dict
+
+    def __iter_cross_links(self):
+        for k in sorted(self._data_base.keys()):
+            for xl in self._data_base[k]:
+                yield xl
+
+    @property
+    def data_base(self):
+        '''The dictionary of lists of cross-links, keyed by unique id'''
+        return self.__get_data_base()
+
+    @data_base.setter
+    def data_base(self,data_base):
+        self._data_base=data_base
+        self.__update()
 
     def __iter__(self):
-        sorted_ids=sorted(self.data_base.keys())
+        data_base=self.__get_data_base(lists=False)
+        sorted_ids=sorted(data_base.keys())
         for k in sorted_ids:
-            for xl in self.data_base[k]:
+            for xl in data_base[k]:
                 yield xl
 
     def xlid_iterator(self):
-        sorted_ids=sorted(self.data_base.keys())
+        sorted_ids=sorted(self._data_base.keys())
         for xlid in sorted_ids:
             yield xlid
 
     def __getitem__(self,xlid):
-        return self.data_base[xlid]
+        return self.__get_data_base()[xlid]
 
     def __len__(self):
-        return len([xl for xl in self])
+        if self.__length is None or self.__length[0]!=_CrossLinkChanges.lists:
+            self.__length=(_CrossLinkChanges.lists,
+                           sum(len(xls) for xls in self._data_base.values()))
+        return self.__length[1]
 
     def get_name(self):
         return self.name
 
     def set_name(self,name):
         new_data_base={}
-        for k in self.data_base:
-            new_data_base[k+"."+name]=self.data_base[k]
-        self.data_base=new_data_base
+        for k in self._data_base:
+            new_data_base[k+"."+name]=self._data_base[k]
+        self._data_base=new_data_base
         self.name=name
         self.__update()
 
     def get_number_of_xlid(self):
-        return len(self.data_base)
+        return len(self._data_base)
 
 
-    def create_set_from_file(self,file_name,converter=None,FixedFormatParser=None):
+    def create_set_from_file(self,file_name,converter=None,FixedFormatParser=None,
+                             chunk_size=None):
         '''
         if FixedFormatParser is not specified, the file is comma-separated-values
         @param file_name a txt file to be parsed
         @param converter an instance of CrossLinkDataBaseKeywordsConverter
         @param FixedFormatParser a parser for a fixed format
+        @param chunk_size if given, read the comma-separated-values file
+               this many rows at a time, so that the raw rows of a large
+               file are never all held in memory
         '''
         if not FixedFormatParser:
-            xl_list=IMP.pmi.tools.get_db_from_csv(file_name)
-
             if converter is not None:
                 self.cldbkc = converter
                 self.list_parser=self.cldbkc.rplp
                 self.converter = converter.get_converter()
 
+            setup_keys=self.cldbkc.get_setup_keys()
+            has_unique_id=self.unique_id_key in setup_keys
+            if self.list_parser and self.site_pairs_key not in setup_keys:
+                raise Error("CrossLinkDataBase: expecting a site_pairs_key for the site pair list parser")
+
+            # the cross-links are all long-lived, so garbage collection
+            # while creating them only wastes time
+            gc_enabled=gc.isenabled()
+            gc.disable()
+            try:
+                new_xl_dict=self.__read_csv(file_name,chunk_size,has_unique_id)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+
+        else:
+            '''
+            if FixedFormatParser  is defined
+            '''
 
+            new_xl_dict={}
+            nxl=0
+            with open(file_name,"r") as f:
+                for line in f:
+                    xl=FixedFormatParser.get_data(line)
+                    if xl:
+                        xl[self.unique_id_key]=str(nxl+1)
+                        new_xl_dict[str(nxl)]=[xl]
+                        nxl+=1
+
+        self._data_base=new_xl_dict
+        self.name=file_name
+        self.__update()
+
+    def __read_csv(self,file_name,chunk_size,has_unique_id):
+        '''
+        Read the cross-links of a comma-separated-values file
+        @return a dictionary of lists of cross-links
+        '''
+        new_xl_dict={}
+        nxl=0
+        for fieldnames,rows in _read_csv_chunks(file_name,chunk_size):
+            entries=self.__convert_csv_rows(fieldnames,rows)
             if not self.list_parser:
                 # normal procedure without a list_parser
                 # each line is a cross-link
-                new_xl_dict={}
-                for nxl,xl in enumerate(xl_list):
-                    new_xl={}
-                    for k in xl:
-                        if k in self.converter:
-                            new_xl[self.converter[k]]=self.type[self.converter[k]](xl[k])
-                        else:
-                            new_xl[k]=xl[k]
-                    if self.unique_id_key in self.cldbkc.get_setup_keys():
-                        if new_xl[self.unique_id_key] not in new_xl_dict:
-                            new_xl_dict[new_xl[self.unique_id_key]]=[new_xl]
-                        else:
-                            new_xl_dict[new_xl[self.unique_id_key]].append(new_xl)
+                if has_unique_id:
+                    xlids=[new_xl[self.unique_id_key] for new_xl in entries]
+                else:
+                    xlids=[str(n) for n in range(nxl,nxl+len(entries))]
+                for xlid,new_xl in zip(xlids,entries):
+                    xls=new_xl_dict.get(xlid)
+                    if xls is None:
+                        new_xl_dict[xlid]=[new_xl]
                     else:
-                        if str(nxl) not in new_xl_dict:
-                            new_xl_dict[str(nxl)]=[new_xl]
-                        else:
-                            new_xl_dict[str(nxl)].append(new_xl)
-
+                        xls.append(new_xl)
+                nxl+=len(entries)
             else:
                 # with a list_parser, a line can be a list of ambiguous crosslinks
-                new_xl_dict={}
-                for nxl,entry in enumerate(xl_list):
-
-                    # first get the translated keywords
-                    new_dict={}
-                    if self.site_pairs_key not in self.cldbkc.get_setup_keys():
-                        raise Error("CrossLinkDataBase: expecting a site_pairs_key for the site pair list parser")
-                    for k in entry:
-                        if k in self.converter:
-                            new_dict[self.converter[k]]=self.type[self.converter[k]](entry[k])
-                        else:
-                            new_dict[k]=entry[k]
-
-                    residue_pair_list,chain_pair_list=self.list_parser.get_list(new_dict[self.site_pairs_key])
-
-                    # then create the crosslinks
+                lists=self.list_parser.get_lists(
+                            [e[self.site_pairs_key] for e in entries])
+                for new_dict,(residue_pair_list,chain_pair_list) in zip(entries,lists):
+                    has_chains=len(chain_pair_list)==len(residue_pair_list)
                     for n,p in enumerate(residue_pair_list):
-                        new_xl={}
-                        for k in new_dict:
-                            new_xl[k]=new_dict[k]
+                        new_xl=dict(new_dict)
                         new_xl[self.residue1_key]=self.type[self.residue1_key](p[0])
                         new_xl[self.residue2_key]=self.type[self.residue2_key](p[1])
-
-                        if len(chain_pair_list)==len(residue_pair_list):
+                        if has_chains:
                             new_xl[self.protein1_key]=self.type[self.protein1_key](chain_pair_list[n][0])
                             new_xl[self.protein2_key]=self.type[self.protein2_key](chain_pair_list[n][1])
-
-                        if self.unique_id_key in self.cldbkc.get_setup_keys():
-                            if new_xl[self.unique_id_key] not in new_xl_dict:
-                                new_xl_dict[new_xl[self.unique_id_key]]=[new_xl]
-                            else:
-                                new_xl_dict[new_xl[self.unique_id_key]].append(new_xl)
+                        if has_unique_id:
+                            xlid=new_xl[self.unique_id_key]
                         else:
-                            if str(nxl) not in new_xl_dict:
-                                new_xl[self.unique_id_key]=str(nxl+1)
-                                new_xl_dict[str(nxl)]=[new_xl]
-                            else:
-                                new_xl[self.unique_id_key]=str(nxl+1)
-                                new_xl_dict[str(nxl)].append(new_xl)
-
-
-        else:
-            '''
-            if FixedFormatParser  is defined
-            '''
-
-            new_xl_dict={}
-            f=open(file_name,"r")
-            nxl=0
-            for line in f:
-                xl=FixedFormatParser.get_data(line)
-                if xl:
-                    xl[self.unique_id_key]=str(nxl+1)
-                    new_xl_dict[str(nxl)]=[xl]
+                            xlid=str(nxl)
+                            new_xl[self.unique_id_key]=str(nxl+1)
+                        if xlid not in new_xl_dict:
+                            new_xl_dict[xlid]=[new_xl]
+                        else:
+                            new_xl_dict[xlid].append(new_xl)
                     nxl+=1
+        return new_xl_dict
 
-
-        self.data_base=new_xl_dict
-        self.name=file_name
-        self.__update()
+    def __convert_csv_rows(self,fieldnames,rows):
+        '''
+        Convert rows of a comma-separated-values file to cross-link
+        dictionaries. Each column is renamed and converted to the type
+        of its standard key once, rather than once per row.
+        '''
+        keys=[]
+        columns=[]
+        for fieldname,column in zip(fieldnames,zip(*rows)):
+            if fieldname in self.converter:
+                key=self.converter[fieldname]
+                column=list(map(self.type[key],column))
+            else:
+                key=fieldname
+            keys.append(key)
+            columns.append(column)
+        if not columns:
+            return [{} for row in rows]
+        return [dict(zip(keys,values)) for values in zip(*columns)]
 
     def update_cross_link_unique_sub_index(self):
-        for k in self.data_base:
-            for n,xl in enumerate(self.data_base[k]):
+        self.__sub_index_changed=False
+        # the redundancy lists refer to the unique sub ids
+        self.__redundancy_changed=True
+        for k in self._data_base:
+            for n,xl in enumerate(self._data_base[k]):
                 xl[self.unique_sub_index_key]=n+1
                 xl[self.unique_sub_id_key]=k+"."+str(n+1)
+        _CrossLinkChanges.change_records()
 
     def update_cross_link_redundancy(self):
-        redundancy_data_base={}
-        for xl in self:
-            pra=_ProteinsResiduesArray(xl)
-            if pra not in redundancy_data_base:
-                redundancy_data_base[pra]=[xl[self.unique_sub_id_key]]
-                redundancy_data_base[pra.get_inverted()]=[xl[self.unique_sub_id_key]]
-            else:
-                redundancy_data_base[pra].append(xl[self.unique_sub_id_key])
-                redundancy_data_base[pra.get_inverted()].append(xl[self.unique_sub_id_key])
-        for xl in self:
-            pra=_ProteinsResiduesArray(xl)
-            xl[self.redundancy_key]=len(redundancy_data_base[pra])
-            xl[self.redundancy_list_key]=redundancy_data_base[pra]
+        if self.__sub_index_changed:
+            self.update_cross_link_unique_sub_index()
+        self.__redundancy_changed=False
+        xls=list(self.__iter_cross_links())
+        # number each (protein, residue) end, and key each cross-link by
+        # its unordered pair of ends, so that inverted cross-links match
+        ends={}
+        end1=np.array([ends.setdefault((xl[self.protein1_key],xl[self.residue1_key]),len(ends))
+                       for xl in xls],dtype=np.int64)
+        end2=np.array([ends.setdefault((xl[self.protein2_key],xl[self.residue2_key]),len(ends))
+                       for xl in xls],dtype=np.int64)
+        keys=np.minimum(end1,end2)*len(ends)+np.maximum(end1,end2)
+        unique_keys,groups=np.unique(keys,return_inverse=True)
+        redundancy_lists=[[] for k in unique_keys]
+        for xl,group in zip(xls,groups):
+            redundancy_lists[group].append(xl[self.unique_sub_id_key])
+        for xl,group in zip(xls,groups):
+            xl[self.redundancy_key]=len(redundancy_lists[group])
+            xl[self.redundancy_list_key]=redundancy_lists[group]
+        _CrossLinkChanges.change_records()
 
     def get_cross_link_string(self,xl):
         string='|'
@@ -604,15 +875,12 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         return string
 
     def filter(self,FilterOperator):
-        new_xl_dict={}
-        for id in self.data_base.keys():
-            for xl in self.data_base[id]:
-                if FilterOperator.evaluate(xl):
-                    if id not in new_xl_dict:
-                        new_xl_dict[id]=[xl]
-                    else:
-                        new_xl_dict[id].append(xl)
-        return CrossLinkDataBase(self.cldbkc,new_xl_dict)
+        '''
+        Return a new CrossLinkDataBase with the cross-links that pass
+        the filter. The filter is evaluated on all cross-links at once.
+        '''
+        return CrossLinkDataBase(self.cldbkc,
+                                 self.__get_filtered_data_base(FilterOperator))
 
 
     def merge(self,CrossLinkDataBase1,CrossLinkDataBase2):
@@ -636,11 +904,11 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
 
         #rename first database:
         new_data_base={}
-        for k in self.data_base:
-            new_data_base[k]=self.data_base[k]
+        for k in self._data_base:
+            new_data_base[k]=self._data_base[k]
         for k in CrossLinkDataBase2.data_base:
             new_data_base[k]=CrossLinkDataBase2.data_base[k]
-        self.data_base=new_data_base
+        self._data_base=new_data_base
         self.__update()
 
     def set_value(self,key,new_value,FilterOperator=None):
@@ -655,21 +923,23 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         example: `cldb1.set_value(cldb1.protein1_key,'FFF',FO(cldb.protein1_key,operator.eq,"AAA"))`
         '''
 
-        for xl in self:
-            if FilterOperator is not None:
-                if FilterOperator.evaluate(xl):
-                    xl[key]=new_value
-            else:
+        if FilterOperator is not None:
+            columns=self.__get_columns()
+            for i in np.flatnonzero(FilterOperator._get_mask(columns)):
+                columns.cross_links[i][key]=new_value
+        else:
+            for xl in self.__iter_cross_links():
                 xl[key]=new_value
-        self.__update()
+        self.__update_for_key(key)
 
     def get_values(self,key):
         '''
         this function returns the list of values for a given key in the database
         alphanumerically sorted
         '''
+        self.__check_updated()
         values=set()
-        for xl in self:
+        for xl in self.__iter_cross_links():
             values.add(xl[key])
         return sorted(list(values))
 
@@ -680,12 +950,12 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         @param offset: the offset value
         '''
 
-        for xl in self:
+        for xl in self.__iter_cross_links():
             if xl[self.protein1_key] == protein_name:
                 xl[self.residue1_key]=xl[self.residue1_key]+offset
             if xl[self.protein2_key] == protein_name:
                 xl[self.residue2_key]=xl[self.residue2_key]+offset
-        self.__update()
+        self.__update(sub_index=False)
 
     def create_new_keyword(self,keyword,values_from_keyword=None):
         '''
@@ -694,12 +964,12 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         @param keyword the new keyword name:
         @param values_from_keyword the keyword from which we are copying the values:
         '''
-        for xl in self:
+        for xl in self.__iter_cross_links():
             if values_from_keyword is not None:
                 xl[keyword] = xl[values_from_keyword]
             else:
                 xl[keyword] = None
-        self.__update()
+        self.__update_for_key(keyword)
 
     def rename_proteins(self,old_to_new_names_dictionary):
         '''
@@ -716,9 +986,9 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
 
     def clone_protein(self,protein_name,new_protein_name):
         new_xl_dict={}
-        for id in self.data_base.keys():
+        for id in self._data_base.keys():
             new_data_base=[]
-            for xl in self.data_base[id]:
+            for xl in self._data_base[id]:
                 new_data_base.append(xl)
                 if xl[self.protein1_key]==protein_name and xl[self.protein2_key]!=protein_name:
                     new_xl=dict(xl)
@@ -739,7 +1009,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
                     new_xl[self.protein1_key]=new_protein_name
                     new_xl[self.protein2_key]=new_protein_name
                     new_data_base.append(new_xl)
-            self.data_base[id]=new_data_base
+            self._data_base[id]=new_data_base
         self.__update()
 
     def filter_out_same_residues(self):
@@ -748,17 +1018,111 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
         (ie, same chain name and residue number)
         '''
         new_xl_dict={}
-        for id in self.data_base.keys():
+        for id in self._data_base.keys():
             new_data_base=[]
-            for xl in self.data_base[id]:
+            for xl in self._data_base[id]:
                 if xl[self.protein1_key]==xl[self.protein2_key] and xl[self.residue1_key]==xl[self.residue2_key]:
                     continue
                 else:
                     new_data_base.append(xl)
-            self.data_base[id]=new_data_base
+            self._data_base[id]=new_data_base
         self.__update()
 
 
+    def set_distances_from_structure(self,hier,resolution=1,state_index=0,
+                                     particle_index=None):
+        '''
+        This function sets the distance of every cross-link in a structure.
+        The two residues of each cross-link are mapped to particles once,
+        and all distances are computed in a single NumPy operation.
+        The protein names can be of the form "name.copy" to select a
+        given copy of a molecule; otherwise the shortest distance over all
+        copies is used. The distance key is set to the distance, or to None
+        if a residue is not in the structure, and the minimum ambiguous
+        distance key to the shortest distance of the cross-links with the
+        same unique id.
+        @param hier the root IMP.atom.Hierarchy of the structure
+        @param resolution the resolution of the particles to use
+        @param state_index the state of the structure to use
+        @param particle_index an IMP.pmi.tools.ResidueParticleIndex of hier,
+               if one is already available
+        '''
+        import IMP.core
+        import IMP.pmi.tools
+        if particle_index is None:
+            particle_index=IMP.pmi.tools.ResidueParticleIndex(hier)
+
+        # number the particles of each cross-link end
+        pis=[]
+        pi_index={}
+        end_particles={}
+        def get_end_particles(protein,residue):
+            end=(protein,residue)
+            if end not in end_particles:
+                name,copy=protein,None
+                if '.' in protein and protein.rsplit('.',1)[1].isdigit():
+                    name,copy=protein.rsplit('.',1)
+                    copy=int(copy)
+                ps=particle_index.get_particles(state_index,name,residue,
+                                                copy_index=copy,
+                                                resolution=resolution)
+                for p in ps:
+                    if p.get_index() not in pi_index:
+                        pi_index[p.get_index()]=len(pis)
+                        pis.append(p.get_index())
+                end_particles[end]=[pi_index[p.get_index()] for p in ps]
+            return end_particles[end]
+
+        columns=self.__get_columns()
+        xls=columns.cross_links
+        pairs=[]
+        pair_xls=[]
+        for n,xl in enumerate(xls):
+            ps1=get_end_particles(xl[self.protein1_key],xl[self.residue1_key])
+            ps2=get_end_particles(xl[self.protein2_key],xl[self.residue2_key])
+            for p1 in ps1:
+                for p2 in ps2:
+                    pairs.append((p1,p2))
+                    pair_xls.append(n)
+
+        mdl=hier.get_model()
+        coords=np.array([IMP.core.XYZ(mdl,pi).get_coordinates()
+                         for pi in pis]).reshape(-1,3)
+        pairs=np.array(pairs,dtype=int).reshape(-1,2)
+        pair_distances=np.sqrt(((coords[pairs[:,0]]
+                                 -coords[pairs[:,1]])**2).sum(axis=1))
+        distances=np.full(len(xls),np.inf)
+        np.minimum.at(distances,np.array(pair_xls,dtype=int),pair_distances)
+
+        group_distances={}
+        for xlid,xl,distance in zip(columns.xlids,xls,distances):
+            distance=float(distance) if np.isfinite(distance) else None
+            xl[self.distance_key]=distance
+            if distance is not None:
+                if xlid not in group_distances or distance<group_distances[xlid]:
+                    group_distances[xlid]=distance
+        for xlid,xl in zip(columns.xlids,xls):
+            xl[self.min_ambiguous_distance_key]=group_distances.get(xlid)
+        self.__update_for_key(self.distance_key)
+
+    def set_distances_from_rmf(self,rmf_file_name,frame_index=0,resolution=1,
+                               state_index=0):
+        '''
+        This function sets the distance of every cross-link in a frame of
+        an RMF file. See set_distances_from_structure().
+        @param rmf_file_name the RMF file
+        @param frame_index the frame to read
+        @param resolution the resolution of the particles to use
+        @param state_index the state of the structure to use
+        '''
+        import RMF
+        import IMP.rmf
+        mdl=IMP.Model()
+        rh=RMF.open_rmf_file_read_only(rmf_file_name)
+        hier=IMP.rmf.create_hierarchies(rh,mdl)[0]
+        IMP.rmf.load_frame(rh,RMF.FrameID(frame_index))
+        self.set_distances_from_structure(hier,resolution,state_index)
+
     def jackknife(self,percentage):
         '''
         this method returns a CrossLinkDataBase class containing
@@ -771,10 +1135,10 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
             raise ValueError('the percentage of random cross-link spectra should be between 0 and 1')
         nspectra=self.get_number_of_xlid()
         nrandom_spectra=int(nspectra*percentage)
-        random_keys=random.sample(self.data_base.keys(),nrandom_spectra)
+        random_keys=random.sample(list(self._data_base.keys()),nrandom_spectra)
         new_data_base={}
         for k in random_keys:
-            new_data_base[k]=self.data_base[k]
+            new_data_base[k]=self._data_base[k]
         return CrossLinkDataBase(self.cldbkc,new_data_base)
 
     def __str__(self):
@@ -847,7 +1211,7 @@ class CrossLinkDataBase(_CrossLinkDataBaseStandardKeys):
     def load(self,json_filename):
         import json
         with open(json_filename, 'r') as fp:
-            self.data_base = json.load(fp)
+            self._data_base = json.load(fp)
         self.__update()
 
     def save_csv(self,filename):
@@ -979,7 +1343,8 @@ class CrossLinkDataBaseFromStructure(object):
                 new_xl["InterRigidBody"] = None
 
             self.cldb.data_base[str(number_of_spectra)].append(new_xl)
-        self.cldb.__update()
+        self.cldb.update_cross_link_unique_sub_index()
+        self.cldb.update_cross_link_redundancy()
         return self.cldb
 
 
@@ -990,8 +1355,8 @@ class CrossLinkDataBaseFromStructure(object):
         if distance is None:
         # get a random pair
             while True:
-                protein1=choice(self.representation.sequence_dict.keys())
-                protein2=choice(self.representation.sequence_dict.keys())
+                protein1=choice(list(self.representation.sequence_dict.keys()))
+                protein2=choice(list(self.representation.sequence_dict.keys()))
                 seq1=self.representation.sequence_dict[protein1]
                 seq2=self.representation.sequence_dict[protein2]
                 residue1=choice([i for i in range(1,len(seq1)+1) if seq1[i-1] in self.residue_types_1])
@@ -1004,54 +1369,72 @@ class CrossLinkDataBaseFromStructure(object):
         else:
             # get a pair of residues whose distance is below the threshold
             if not xwalk_bin_path:
-                gcpf = IMP.core.GridClosePairsFinder()
-                gcpf.set_distance(distance)
-                if not self.euclidean_interacting_pairs:
-                    self.euclidean_interacting_pairs=gcpf.get_close_pairs(self.representation.m,
-                                self.indexes_dict1.keys(),
-                                self.indexes_dict2.keys())
-                interacting_pairs_weighted=[]
-                for pair in self.euclidean_interacting_pairs:
-                    weight1=math.exp(-self.reactivity_dictionary[self.indexes_dict1[pair[0]]]/self.kt)
-                    weight2=math.exp(-self.reactivity_dictionary[self.indexes_dict2[pair[1]]]/self.kt)
-                    interacting_pairs_weighted.append((pair,weight1*weight2))
-
-                while True:
-                    pair=self.weighted_choice(interacting_pairs_weighted)
-                    protein1,residue1=self.indexes_dict1[pair[0]]
-                    protein2,residue2=self.indexes_dict2[pair[1]]
-                    particle_pair=IMP.kernel.get_particles(self.representation.m,pair)
-                    particle_distance=IMP.core.get_distance(IMP.core.XYZ(particle_pair[0]),IMP.core.XYZ(particle_pair[1]))
-                    if particle_distance<distance and (protein1,residue1) != (protein2,residue2):
-                        break
+                if self.euclidean_interacting_pairs is None:
+                    self.euclidean_interacting_pairs=self.get_euclidean_interacting_pairs(distance)
+                pis1,pis2,distances,weights=self.euclidean_interacting_pairs
+                n=self.weighted_choice_index(np.where(distances<distance,weights,0.0))
+                protein1,residue1=self.indexes_dict1[pis1[n]]
+                protein2,residue2=self.indexes_dict2[pis2[n]]
+                particle_distance=float(distances[n])
 
             else:
                 if not self.xwalk_interacting_pairs:
                     self.xwalk_interacting_pairs=self.get_xwalk_distances(xwalk_bin_path,distance)
-                interacting_pairs_weighted=[]
-
-                print(self.reactivity_dictionary)
-
-                for pair in self.xwalk_interacting_pairs:
-                    protein1=pair[0]
-                    protein2=pair[1]
-                    residue1=pair[2]
-                    residue2=pair[3]
-                    weight1=math.exp(-self.reactivity_dictionary[(protein1,residue1)]/self.kt)
-                    weight2=math.exp(-self.reactivity_dictionary[(protein2,residue2)]/self.kt)
-                    interacting_pairs_weighted.append((pair,weight1*weight2))
-
-                pair=self.weighted_choice(interacting_pairs_weighted)
+                weights=np.array([math.exp(-(self.reactivity_dictionary[(pair[0],pair[2])]
+                                             +self.reactivity_dictionary[(pair[1],pair[3])])/self.kt)
+                                  for pair in self.xwalk_interacting_pairs])
+                pair=self.xwalk_interacting_pairs[self.weighted_choice_index(weights)]
                 protein1=pair[0]
                 protein2=pair[1]
                 residue1=pair[2]
                 residue2=pair[3]
                 particle_distance=float(pair[4])
 
-
-
         return _ProteinsResiduesArray((protein1,protein2,residue1,residue2)),particle_distance
 
+    def get_euclidean_interacting_pairs(self,distance):
+        '''
+        Get all pairs of reactive residues closer than a given distance.
+        The distances are computed with NumPy, in blocks of rows of the
+        distance matrix to bound the memory used.
+        @return arrays of the particle indexes of the first and second
+                residues of each pair, of their distances, and of the
+                reactivity weights of the pairs. Pairs of a residue with
+                itself have a weight of zero.
+        '''
+        import IMP.core
+        m=self.representation.m
+        def get_arrays(indexes_dict):
+            pis=list(indexes_dict.keys())
+            coords=np.array([IMP.core.XYZ(m,pi).get_coordinates()
+                             for pi in pis]).reshape(-1,3)
+            weights=np.exp(-np.array([self.reactivity_dictionary[indexes_dict[pi]]
+                                      for pi in pis])/self.kt)
+            residues=[indexes_dict[pi] for pi in pis]
+            return pis,coords,weights,residues
+        pis1,coords1,weights1,residues1=get_arrays(self.indexes_dict1)
+        pis2,coords2,weights2,residues2=get_arrays(self.indexes_dict2)
+        residue_ids={}
+        ids1=np.array([residue_ids.setdefault(r,len(residue_ids)) for r in residues1],dtype=int)
+        ids2=np.array([residue_ids.setdefault(r,len(residue_ids)) for r in residues2],dtype=int)
+
+        rows1=[]
+        rows2=[]
+        block=max(1,1000000//max(1,len(pis2)))
+        for start in range(0,len(pis1),block):
+            d2=((coords1[start:start+block,np.newaxis,:]
+                 -coords2[np.newaxis,:,:])**2).sum(axis=2)
+            i,j=np.nonzero(d2<distance*distance)
+            rows1.append(i+start)
+            rows2.append(j)
+        rows1=np.concatenate(rows1) if rows1 else np.zeros(0,dtype=int)
+        rows2=np.concatenate(rows2) if rows2 else np.zeros(0,dtype=int)
+        distances=np.sqrt(((coords1[rows1]-coords2[rows2])**2).sum(axis=1))
+        weights=np.where(ids1[rows1]==ids2[rows2],0.0,
+                         weights1[rows1]*weights2[rows2])
+        return ([pis1[i] for i in rows1],[pis2[j] for j in rows2],
+                distances,weights)
+
     def get_xwalk_distances(self,xwalk_bin_path,distance):
         import IMP.pmi.output
         import os
@@ -1083,6 +1466,19 @@ class CrossLinkDataBaseFromStructure(object):
         return output_list_of_distance
 
 
+    def weighted_choice_index(self,weights):
+        '''
+        Choose an index at random with probability proportional to its weight
+        @param weights a NumPy array of non-negative weights
+        '''
+        import random
+        nonzero=np.flatnonzero(weights)
+        if len(nonzero)==0:
+            raise ValueError("No residue pairs with non-zero weight to choose from")
+        cumulative=np.cumsum(weights)
+        r=random.uniform(0,cumulative[-1])
+        return min(int(np.searchsorted(cumulative,r,side='right')),nonzero[-1])
+
     def weighted_choice(self,choices):
 
         import random
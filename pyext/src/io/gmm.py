@@ -0,0 +1,352 @@
+"""@namespace IMP.pmi.io.gmm
+   Reading of Gaussian mixture models (GMMs), with a binary cache.
+
+   GMM text files (as written by IMP.isd.gmm_tools.write_gmm_to_text) are
+   slow to parse and decorate for large maps. The first time a file is
+   read, a binary cache of its Gaussians is written next to it (with the
+   extra suffix `.cache`); later reads load the cache in bulk, provided
+   the checksum of the text file stored in it still matches.
+
+   Fitted GMMs can also be kept in a content-addressed store: a directory
+   of GMM text files named by a hash of everything the fit depends on
+   (the coordinates of the points, the number of components and the fit
+   parameters). fit_gmms() looks up each fit in the store, and fits only
+   the missing ones, in parallel if requested.
+"""
+
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.atom
+import IMP.core
+import hashlib
+import multiprocessing
+import os
+import struct
+import numpy as np
+
+_MAGIC = b'PMIGMMv1'
+# magic, sha1 hex digest of the text file, number of Gaussians
+_HEADER = struct.Struct('<8s40sQ')
+_HEADER_SIZE = 64
+# weight, mean (3), covariance (9), variances (3), rotation quaternion (4)
+_NCOLUMNS = 20
+
+
+class GMMArrays(object):
+    """The Gaussians of a GMM, as NumPy arrays.
+       Rows of each array correspond to Gaussians."""
+    def __init__(self, data):
+        ## The underlying (n, 20) array (possibly memory-mapped)
+        self.data = data
+        ## Weights, shape (n,)
+        self.weights = data[:, 0]
+        ## Means, shape (n, 3)
+        self.means = data[:, 1:4]
+        ## Covariance matrices, shape (n, 3, 3)
+        self.covariances = data[:, 4:13].reshape((-1, 3, 3))
+        ## Variances along the principal axes, shape (n, 3)
+        self.variances = data[:, 13:16]
+        ## Principal axes as rotation quaternions, shape (n, 4)
+        self.rotations = data[:, 16:20]
+
+    def __len__(self):
+        return self.data.shape[0]
+
+
+def get_cache_file_name(fn):
+    """Get the name of the binary cache for a GMM text file"""
+    return fn + '.cache'
+
+
+def _get_checksum(fn):
+    with open(fn, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def _parse_gmm_text(fn):
+    """Parse a GMM text file into an (n, 20) array"""
+    values = []
+    with open(fn) as fh:
+        for line in fh:
+            if line.startswith('#') or not line.strip():
+                continue
+            values.append(line.replace('|', ' '))
+    # each line is: index, weight, mean (3), covariance (9)
+    parsed = np.array(' '.join(values).split(), dtype=float).reshape((-1, 14))
+    data = np.zeros((parsed.shape[0], _NCOLUMNS))
+    data[:, 0:13] = parsed[:, 1:14]
+    for n in range(data.shape[0]):
+        shape = IMP.algebra.get_gaussian_from_covariance(
+            data[n, 4:13].reshape((3, 3)).tolist(),
+            IMP.algebra.Vector3D(data[n, 1:4].tolist()))
+        data[n, 13:16] = list(shape.get_variances())
+        data[n, 16:20] = list(shape.get_reference_frame().
+                              get_transformation_to().get_rotation().
+                              get_quaternion())
+    return data
+
+
+def _write_cache(cache_fn, checksum, data):
+    """Write the cache atomically, so concurrent readers (e.g. other
+       replicas) never see a partial file"""
+    tmp_fn = '%s.%d.tmp' % (cache_fn, os.getpid())
+    with open(tmp_fn, 'wb') as fh:
+        header = _HEADER.pack(_MAGIC, checksum.encode('ascii'),
+                              data.shape[0])
+        fh.write(header.ljust(_HEADER_SIZE, b'\0'))
+        fh.write(np.ascontiguousarray(data, dtype='<f8').tobytes())
+    try:
+        os.rename(tmp_fn, cache_fn)
+    except OSError:
+        # another process got there first (on Windows, rename does
+        # not replace an existing file)
+        os.unlink(tmp_fn)
+
+
+def _read_cache(cache_fn, checksum, mmap):
+    """Return the cached (n, 20) array, or None if it is missing or stale"""
+    try:
+        with open(cache_fn, 'rb') as fh:
+            header = fh.read(_HEADER_SIZE)
+            if len(header) != _HEADER_SIZE:
+                return None
+            magic, cached_checksum, ngaussians = _HEADER.unpack_from(header)
+            if magic != _MAGIC \
+                    or cached_checksum != checksum.encode('ascii'):
+                return None
+            if not mmap:
+                data = np.fromfile(fh, dtype='<f8',
+                                   count=ngaussians * _NCOLUMNS)
+                if data.shape[0] != ngaussians * _NCOLUMNS:
+                    return None
+                return data.reshape((ngaussians, _NCOLUMNS))
+    except IOError:
+        return None
+    if os.path.getsize(cache_fn) < _HEADER_SIZE + ngaussians * _NCOLUMNS * 8:
+        return None
+    return np.memmap(cache_fn, dtype='<f8', mode='r', offset=_HEADER_SIZE,
+                     shape=(ngaussians, _NCOLUMNS))
+
+
+def read_gmm(fn, use_cache=True, mmap=False):
+    """Read the Gaussians of a GMM text file.
+    @param fn The GMM text file
+    @param use_cache If True, read the binary cache of the file if it
+           is up to date, or create it otherwise
+    @param mmap If True, memory-map the cache read-only rather than
+           reading it, so that processes on the same node (e.g. replicas)
+           share a single copy
+    @return a GMMArrays object
+    """
+    if not use_cache:
+        return GMMArrays(_parse_gmm_text(fn))
+    checksum = _get_checksum(fn)
+    cache_fn = get_cache_file_name(fn)
+    data = _read_cache(cache_fn, checksum, mmap)
+    if data is None:
+        data = _parse_gmm_text(fn)
+        try:
+            _write_cache(cache_fn, checksum, data)
+        except (IOError, OSError) as err:
+            print("GMM: could not write cache %s: %s" % (cache_fn, err))
+        else:
+            if mmap:
+                data = _read_cache(cache_fn, checksum, mmap)
+    return GMMArrays(data)
+
+
+def decorate_gmm_from_text(in_fn, ps, mdl, radius_scale=1.0, mass_scale=1.0,
+                           use_cache=True, mmap=False):
+    """Read a GMM text file and decorate particles as Gaussian and Mass.
+    This is equivalent to IMP.isd.gmm_tools.decorate_gmm_from_text, but
+    uses the binary cache of the file (see read_gmm()).
+    @param in_fn The GMM text file
+    @param ps List of particles to decorate; new particles are appended
+           if there are more Gaussians than particles
+    @param mdl The IMP Model
+    @param radius_scale Scale the particle radii (the square root of the
+           largest variance) by this factor
+    @param mass_scale Scale the Gaussian weights by this factor
+    @param use_cache Use the binary cache
+    @param mmap Memory-map the cache (see read_gmm())
+    """
+    gmm = read_gmm(in_fn, use_cache=use_cache, mmap=mmap)
+    # convert each column in bulk, rather than indexing the arrays
+    # (which makes a NumPy scalar per value) for every particle
+    masses = (gmm.weights * mass_scale).tolist()
+    radii = (np.sqrt(gmm.variances.max(axis=1)) * radius_scale).tolist()
+    means = gmm.means.tolist()
+    variances = gmm.variances.tolist()
+    rotations = gmm.rotations.tolist()
+    nexisting = min(len(ps), len(gmm))
+    for n in range(len(ps), len(gmm)):
+        ps.append(IMP.Particle(mdl, "GMM%d" % n))
+
+    Vector3D = IMP.algebra.Vector3D
+    Rotation3D = IMP.algebra.Rotation3D
+    Transformation3D = IMP.algebra.Transformation3D
+    ReferenceFrame3D = IMP.algebra.ReferenceFrame3D
+    Gaussian3D = IMP.algebra.Gaussian3D
+    shapes = [Gaussian3D(ReferenceFrame3D(Transformation3D(
+                  Rotation3D(*rot), Vector3D(*mean))), Vector3D(*var))
+              for rot, mean, var in zip(rotations, means, variances)]
+
+    # particles passed in may already be decorated
+    for n in range(nexisting):
+        p = ps[n]
+        if IMP.core.Gaussian.get_is_setup(p):
+            IMP.core.Gaussian(p).set_gaussian(shapes[n])
+        else:
+            IMP.core.Gaussian.setup_particle(p, shapes[n])
+        if IMP.atom.Mass.get_is_setup(p):
+            IMP.atom.Mass(p).set_mass(masses[n])
+        else:
+            IMP.atom.Mass.setup_particle(p, masses[n])
+        if IMP.core.XYZR.get_is_setup(p):
+            IMP.core.XYZR(p).set_radius(radii[n])
+        else:
+            IMP.core.XYZR.setup_particle(p, radii[n])
+
+    # new particles need no checks
+    setup_gaussian = IMP.core.Gaussian.setup_particle
+    setup_mass = IMP.atom.Mass.setup_particle
+    setup_xyzr = IMP.core.XYZR.setup_particle
+    for n in range(nexisting, len(gmm)):
+        p = ps[n]
+        setup_gaussian(p, shapes[n])
+        setup_mass(p, masses[n])
+        setup_xyzr(p, radii[n])
+
+def get_fit_key(points, num_components, **params):
+    """Get the key of a GMM fit in the store.
+    @param points The points (or particle coordinates) to fit, as an
+           (n, 3) array; coordinates are rounded to 0.001 angstroms
+    @param num_components The number of Gaussians
+    @param params Any other parameters the fit depends on
+    @return a hex digest
+    """
+    h = hashlib.sha1()
+    points = np.round(np.asarray(points, dtype=float), 3) + 0.
+    h.update(np.ascontiguousarray(points, dtype='<f8').tobytes())
+    h.update(repr((int(num_components), sorted(params.items()))).encode('utf8'))
+    return h.hexdigest()
+
+
+def get_store_file_name(store, key):
+    """Get the name of the GMM text file for a key in a store"""
+    return os.path.join(store, key + '.txt')
+
+
+def _fit_points(args):
+    """Fit a GMM to points and write it to the store
+       (run in a worker process, so it uses its own Model)"""
+    import IMP.isd.gmm_tools
+    fn, points, num_components, mass_multiplier = args
+    mdl = IMP.Model()
+    ps = []
+    IMP.isd.gmm_tools.fit_gmm_to_points(
+        [IMP.algebra.Vector3D(*p) for p in points], num_components, mdl, ps,
+        mass_multiplier=mass_multiplier)
+    tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+    IMP.isd.gmm_tools.write_gmm_to_text(ps, tmp_fn)
+    try:
+        os.rename(tmp_fn, fn)
+    except OSError:
+        # another process stored the same fit first
+        os.unlink(tmp_fn)
+    return fn
+
+
+def _create_store(store):
+    if not os.path.exists(store):
+        try:
+            os.makedirs(store)
+        except OSError:
+            # created meanwhile by another process
+            if not os.path.isdir(store):
+                raise
+
+
+def fit_gmms(fits, store, processes=1):
+    """Fit GMMs to sets of points, using a content-addressed store.
+    Fits already in the store are not redone; the others are done in
+    a pool of worker processes and added to the store.
+    @param fits List of (points, num_components, mass_multiplier) tuples,
+           where points is an (n, 3) array and the weights of the fitted
+           Gaussians are multiplied by mass_multiplier
+    @param store The directory holding the fitted GMMs
+    @param processes The number of worker processes
+    @return the list of GMM text files in the store, one per fit
+    """
+    _create_store(store)
+    ret = []
+    missing = []
+    missing_fns = set()
+    for points, num_components, mass_multiplier in fits:
+        points = np.asarray(points, dtype=float)
+        key = get_fit_key(points, num_components,
+                          mass_multiplier=round(mass_multiplier, 6))
+        fn = get_store_file_name(store, key)
+        if not os.path.exists(fn) and fn not in missing_fns:
+            missing.append((fn, points.tolist(), num_components,
+                            mass_multiplier))
+            missing_fns.add(fn)
+        ret.append(fn)
+    if processes > 1 and len(missing) > 1:
+        pool = multiprocessing.Pool(min(processes, len(missing)))
+        try:
+            pool.map(_fit_points, missing)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for m in missing:
+            _fit_points(m)
+    return ret
+
+
+def sample_and_fit_to_particles(mdl, particles, num_components, store,
+                                sampled_points=1000000, simulation_res=0.5,
+                                voxel_size=1.0, num_iter=100,
+                                covariance_type='full',
+                                multiply_by_total_mass=True):
+    """Fit a GMM to the density of particles, using a content-addressed store.
+    This is equivalent to IMP.isd.gmm_tools.sample_and_fit_to_particles,
+    but the fit is only done if the store has no fit for particles with
+    the same coordinates, radii and masses and the same parameters.
+    @param mdl The IMP Model
+    @param particles The particles to fit
+    @param num_components The number of Gaussians
+    @param store The directory holding the fitted GMMs
+    @return the list of Gaussian particles
+    """
+    import IMP.isd.gmm_tools
+    data = []
+    for p in particles:
+        radius = mass = 0.
+        if IMP.core.XYZR.get_is_setup(p):
+            radius = IMP.core.XYZR(p).get_radius()
+        if IMP.atom.Mass.get_is_setup(p):
+            mass = IMP.atom.Mass(p).get_mass()
+        data.append(list(IMP.core.XYZ(p).get_coordinates()) + [radius, mass])
+    key = get_fit_key(data, num_components, sampled_points=sampled_points,
+                      simulation_res=simulation_res, voxel_size=voxel_size,
+                      num_iter=num_iter, covariance_type=covariance_type,
+                      multiply_by_total_mass=multiply_by_total_mass)
+    _create_store(store)
+    fn = get_store_file_name(store, key)
+    if os.path.exists(fn):
+        ps = []
+        decorate_gmm_from_text(fn, ps, mdl)
+        return ps
+    tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+    ps = IMP.isd.gmm_tools.sample_and_fit_to_particles(
+        mdl, particles, num_components, sampled_points, simulation_res,
+        voxel_size, num_iter, covariance_type, multiply_by_total_mass,
+        None, tmp_fn)
+    try:
+        os.rename(tmp_fn, fn)
+    except OSError:
+        os.unlink(tmp_fn)
+    return ps
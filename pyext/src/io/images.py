@@ -0,0 +1,154 @@
+"""@namespace IMP.pmi.io.images
+   Reading of EM class averages, with a binary cache.
+
+   Class averages in PGM text format are slow to parse. The first time an
+   image is read it is filtered to the given resolution and normalized,
+   and the result is stored next to it (with the extra suffix `.cache`);
+   later reads load the cache directly, provided the checksum of the
+   image file and the pixel size and resolution stored in it still match.
+"""
+
+from __future__ import print_function
+import hashlib
+import os
+import struct
+import numpy as np
+
+_MAGIC = b'PMIIMGv1'
+# magic, sha1 hex digest of the image file, pixel size, resolution,
+# rows, columns
+_HEADER = struct.Struct('<8s40sddQQ')
+_HEADER_SIZE = 96
+
+
+def get_cache_file_name(fn):
+    """Get the name of the binary cache for an image file"""
+    return fn + '.cache'
+
+
+def _get_checksum(fn):
+    with open(fn, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def _read_pgm_tokens(data, ntokens, pos):
+    """Read whitespace-separated header tokens, skipping comments"""
+    tokens = []
+    while len(tokens) < ntokens:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos)
+            continue
+        end = pos
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        tokens.append(data[pos:end])
+        pos = end
+    return tokens, pos
+
+
+def read_pgm(fn):
+    """Read a PGM image, in either text (P2) or binary (P5) format.
+    @return the image as a 2D NumPy array of floats
+    """
+    with open(fn, 'rb') as fh:
+        data = fh.read()
+    (magic, cols, rows, maxval), pos = _read_pgm_tokens(data, 4, 0)
+    cols, rows, maxval = int(cols), int(rows), int(maxval)
+    if magic == b'P2':
+        values = np.array(data[pos:].split()[:rows * cols], dtype=float)
+    elif magic == b'P5':
+        # a single whitespace character separates the header from the data
+        dtype = '>u2' if maxval > 255 else 'u1'
+        values = np.frombuffer(data, dtype=dtype, count=rows * cols,
+                               offset=pos + 1).astype(float)
+    else:
+        raise ValueError("%s is not a PGM file" % fn)
+    if values.shape[0] != rows * cols:
+        raise ValueError("%s: expected %d values, got %d"
+                         % (fn, rows * cols, values.shape[0]))
+    return values.reshape((rows, cols))
+
+
+def _preprocess(image, pixel_size, resolution):
+    """Remove frequencies beyond the resolution and normalize the image
+       to zero mean and unit standard deviation"""
+    rows, cols = image.shape
+    freq = np.sqrt(np.fft.fftfreq(rows)[:, np.newaxis] ** 2
+                   + np.fft.fftfreq(cols)[np.newaxis, :] ** 2) / pixel_size
+    # raised cosine edge from 80% to 100% of the resolution frequency
+    cutoff = 1. / resolution
+    x = np.clip((freq - 0.8 * cutoff) / (0.2 * cutoff), 0., 1.)
+    filtered = np.real(np.fft.ifft2(np.fft.fft2(image)
+                                    * 0.5 * (1. + np.cos(np.pi * x))))
+    filtered -= filtered.mean()
+    sd = filtered.std()
+    if sd > 0.:
+        filtered /= sd
+    return filtered
+
+
+def _write_cache(cache_fn, checksum, pixel_size, resolution, image):
+    """Write the cache atomically, so concurrent readers (e.g. other
+       replicas) never see a partial file"""
+    tmp_fn = '%s.%d.tmp' % (cache_fn, os.getpid())
+    with open(tmp_fn, 'wb') as fh:
+        header = _HEADER.pack(_MAGIC, checksum.encode('ascii'), pixel_size,
+                              resolution, image.shape[0], image.shape[1])
+        fh.write(header.ljust(_HEADER_SIZE, b'\0'))
+        fh.write(np.ascontiguousarray(image, dtype='<f8').tobytes())
+    try:
+        os.rename(tmp_fn, cache_fn)
+    except OSError:
+        # another process got there first (on Windows, rename does
+        # not replace an existing file)
+        os.unlink(tmp_fn)
+
+
+def _read_cache(cache_fn, checksum, pixel_size, resolution):
+    """Return the cached image, or None if it is missing or stale"""
+    try:
+        with open(cache_fn, 'rb') as fh:
+            header = fh.read(_HEADER_SIZE)
+            if len(header) != _HEADER_SIZE:
+                return None
+            (magic, cached_checksum, cached_pixel_size, cached_resolution,
+             rows, cols) = _HEADER.unpack_from(header)
+            if magic != _MAGIC \
+                    or cached_checksum != checksum.encode('ascii') \
+                    or cached_pixel_size != pixel_size \
+                    or cached_resolution != resolution:
+                return None
+            data = np.fromfile(fh, dtype='<f8', count=rows * cols)
+    except IOError:
+        return None
+    if data.shape[0] != rows * cols:
+        return None
+    return data.reshape((rows, cols))
+
+
+def read_image(fn, pixel_size, resolution, use_cache=True):
+    """Read a class average in PGM format, filtered to the given
+       resolution and normalized to zero mean and unit standard deviation.
+    @param fn The PGM image file
+    @param pixel_size Pixel size in angstroms
+    @param resolution Resolution of the image in angstroms
+    @param use_cache If True, read the binary cache of the file if it
+           is up to date, or create it otherwise
+    @return the image as a 2D NumPy array
+    """
+    pixel_size = float(pixel_size)
+    resolution = float(resolution)
+    if not use_cache:
+        return _preprocess(read_pgm(fn), pixel_size, resolution)
+    checksum = _get_checksum(fn)
+    cache_fn = get_cache_file_name(fn)
+    image = _read_cache(cache_fn, checksum, pixel_size, resolution)
+    if image is None:
+        image = _preprocess(read_pgm(fn), pixel_size, resolution)
+        try:
+            _write_cache(cache_fn, checksum, pixel_size, resolution, image)
+        except (IOError, OSError) as err:
+            print("EM2D: could not write cache %s: %s" % (cache_fn, err))
+    return image
@@ -10,16 +10,23 @@ import IMP.pmi.samplers
 import IMP.pmi.output
 import IMP.pmi.analysis
 import IMP.pmi.io
+import IMP.pmi.restraints.stereochemistry
 import IMP.rmf
 import IMP.isd
 import IMP.pmi.dof
 import RMF
 import os
 import glob
+import shutil
 from operator import itemgetter
 from collections import defaultdict
 import numpy as np
 import string
+import random
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 class ReplicaExchange0(object):
     """A macro to help setup and run replica exchange.
@@ -43,6 +50,8 @@ class ReplicaExchange0(object):
                  simulated_annealing_maximum_temperature_nframes=100,
                  replica_exchange_minimum_temperature=1.0,
                  replica_exchange_maximum_temperature=2.5,
+                 replica_exchange_ladder_optimization=None,
+                 replica_exchange_ladder_nframes=1000,
                  num_sample_rounds=1,
                  number_of_best_scoring_models=500,
                  monte_carlo_steps=10,
@@ -63,6 +72,9 @@ class ReplicaExchange0(object):
                  em_object_for_rmf=None,
                  atomistic=False,
                  replica_exchange_object=None,
+                 score_moved=False,
+                 checkpoint_interval=None,
+                 checkpoint_dir="checkpoints/",
                  test_mode=False):
         """Constructor.
            @param model                    The IMP model
@@ -94,6 +106,12 @@ class ReplicaExchange0(object):
            @param replica_exchange_minimum_temperature Low temp for REX; should
                   generally be the same as monte_carlo_temperature.
            @param replica_exchange_maximum_temperature High temp for REX
+           @param replica_exchange_ladder_optimization If "uniform" or
+                  "round_trip", optimize the intermediate REX temperatures
+                  during the first frames
+                  (see IMP.pmi.samplers.ReplicaExchange.set_ladder_optimization)
+           @param replica_exchange_ladder_nframes Number of warm-up frames
+                  during which the temperature ladder is optimized
            @param num_sample_rounds        Number of rounds of MC/MD per cycle
            @param number_of_best_scoring_models Number of top-scoring PDB models
                   to keep around for analysis
@@ -106,6 +124,22 @@ class ReplicaExchange0(object):
            @param write_initial_rmf        Write the initial configuration
            @param global_output_directory Folder that will be created to house
                   output.
+           @param score_moved If True, Monte Carlo only re-evaluates the
+                  restraints that depend on the particles moved at each
+                  step (see IMP.pmi.samplers.MonteCarlo)
+           @param checkpoint_interval If set, write a checkpoint every this
+                  many frames. If a complete checkpoint is found in
+                  checkpoint_dir when the macro is run, sampling resumes
+                  from it, appending to the existing stat and RMF files.
+                  Checkpoints are written at the same frame by all
+                  replicas, so pick the interval to give one every few
+                  minutes. Since the state of the IMP random number
+                  generator cannot be saved, it is reseeded (from the
+                  Python random number generator) at each checkpoint, so
+                  runs with checkpoints follow a different random stream
+                  from runs without, even if they are never restarted.
+           @param checkpoint_dir Folder (inside global_output_directory)
+                  that holds the checkpoint files
         @param test_mode Set to True to avoid writing any files, just test one frame.
         """
         self.model = model
@@ -152,6 +186,10 @@ class ReplicaExchange0(object):
             "replica_exchange_minimum_temperature"] = replica_exchange_minimum_temperature
         self.vars[
             "replica_exchange_maximum_temperature"] = replica_exchange_maximum_temperature
+        self.vars["replica_exchange_ladder_optimization"] = \
+                                   replica_exchange_ladder_optimization
+        self.vars["replica_exchange_ladder_nframes"] = \
+                                   replica_exchange_ladder_nframes
 
         self.vars["simulated_annealing"]=\
                                    simulated_annealing
@@ -183,6 +221,9 @@ class ReplicaExchange0(object):
         self.vars["atomistic"] = atomistic
         self.vars["replica_stat_file_suffix"] = replica_stat_file_suffix
         self.vars["geometries"] = None
+        self.vars["score_moved"] = score_moved
+        self.vars["checkpoint_interval"] = checkpoint_interval
+        self.vars["checkpoint_dir"] = checkpoint_dir
         self.test_mode = test_mode
 
     def add_geometries(self, geometries):
@@ -204,22 +245,147 @@ class ReplicaExchange0(object):
     def get_replica_exchange_object(self):
         return self.replica_exchange_object
 
+    def _get_checkpoint_name(self, checkpoint_dir, frame, index):
+        return os.path.join(checkpoint_dir, "%d.%d.pkl" % (frame, index))
+
+    def _find_checkpoint(self, checkpoint_dir, nreplicas):
+        """Get the last frame for which all replicas wrote a checkpoint,
+           or None"""
+        frames = defaultdict(int)
+        for fn in glob.glob(os.path.join(checkpoint_dir, "*.pkl")):
+            fields = os.path.basename(fn).split(".")
+            if len(fields) == 3 and fields[0].isdigit():
+                frames[int(fields[0])] += 1
+        complete = [f for f, n in frames.items() if n == nreplicas]
+        if complete:
+            return max(complete)
+
+    def _write_checkpoint(self, checkpoint_dir, frame, myindex, data):
+        """Atomically write this replica's checkpoint, then remove all
+           but the previous one (which other replicas may still need)"""
+        fname = self._get_checkpoint_name(checkpoint_dir, frame, myindex)
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as fh:
+            pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmpname, fname)
+        old = sorted(int(os.path.basename(fn).split(".")[0]) for fn
+                     in glob.glob(os.path.join(checkpoint_dir,
+                                               "*.%d.pkl" % myindex)))
+        for oldframe in old[:-2]:
+            os.unlink(self._get_checkpoint_name(checkpoint_dir, oldframe,
+                                                myindex))
+
+    def _get_best_pdb_suffixes(self, pdb_dir):
+        """Get the file name prefixes of all best scoring PDB files"""
+        suffix = self.vars["best_pdb_name_suffix"]
+        if not self.is_multi_state:
+            return [pdb_dir + "/" + suffix]
+        return [pdb_dir + "/" + str(n) + "/" + suffix
+                for n in range(self.vars["number_of_states"])]
+
+    def _save_best_pdbs(self, checkpoint_dir, frame, output, pdb_dir):
+        """Keep a copy of the current best scoring PDB files alongside
+           the checkpoint, and remove all but the previous copy.
+           Return the list of scores that matches the saved files."""
+        best_score_list = list(output._update_best_score_list())
+        dirname = os.path.join(checkpoint_dir, "best_pdbs.%d" % frame)
+        tmpname = dirname + ".tmp"
+        if os.path.exists(tmpname):
+            shutil.rmtree(tmpname)
+        os.makedirs(tmpname)
+        for n, suffix in enumerate(self._get_best_pdb_suffixes(pdb_dir)):
+            for i in range(len(best_score_list)):
+                src = suffix + "." + str(i) + ".pdb"
+                dst = os.path.join(tmpname, "%d.%d.pdb" % (n, i))
+                # best scoring PDBs are only ever replaced by rename, never
+                # rewritten in place, so a hard link is a safe snapshot
+                try:
+                    os.link(src, dst)
+                except (OSError, AttributeError):
+                    shutil.copyfile(src, dst)
+        os.rename(tmpname, dirname)
+        old = sorted(int(os.path.basename(fn).split(".")[1]) for fn
+                     in glob.glob(os.path.join(checkpoint_dir, "best_pdbs.*"))
+                     if os.path.basename(fn).split(".")[1].isdigit()
+                     and not fn.endswith(".tmp"))
+        for oldframe in old[:-2]:
+            shutil.rmtree(os.path.join(checkpoint_dir,
+                                       "best_pdbs.%d" % oldframe))
+        return best_score_list
+
+    def _restore_best_pdbs(self, checkpoint_dir, frame, best_score_list,
+                           pdb_dir):
+        """Replace the best scoring PDB files with those saved at the
+           checkpoint, so that they match the restored list of scores"""
+        dirname = os.path.join(checkpoint_dir, "best_pdbs.%d" % frame)
+        nbest = self.vars["number_of_best_scoring_models"]
+        for n, suffix in enumerate(self._get_best_pdb_suffixes(pdb_dir)):
+            for i in range(nbest + 1):
+                name = suffix + "." + str(i) + ".pdb"
+                if os.path.exists(name):
+                    os.unlink(name)
+            for i in range(len(best_score_list)):
+                shutil.copyfile(os.path.join(dirname, "%d.%d.pdb" % (n, i)),
+                                suffix + "." + str(i) + ".pdb")
+
+    def _read_checkpoint(self, checkpoint_dir, frame, myindex, temp_index,
+                         nreplicas):
+        """Read the checkpoints for a restart.
+           Return this replica's own checkpoint and that of the
+           configuration which was at temperature index temp_index; since
+           replicas exchange temperatures, these are usually different."""
+        def read(index):
+            with open(self._get_checkpoint_name(checkpoint_dir, frame,
+                                                index), "rb") as fh:
+                return pickle.load(fh)
+        mine = read(myindex)
+        # the best scoring PDBs are shared, and only the first replica
+        # saves them, so every replica must restart from its list of scores
+        if myindex != 0:
+            mine["best_score_list"] = read(0)["best_score_list"]
+        if mine["temperature_index"] == temp_index:
+            return mine, mine
+        for index in range(nreplicas):
+            data = read(index)
+            if data["temperature_index"] == temp_index:
+                return mine, data
+        raise ValueError("No checkpoint found at frame %d for "
+                         "temperature index %d" % (frame, temp_index))
+
     def execute_macro(self):
         temp_index_factor = 100000.0
         samplers=[]
         sampler_mc=None
         sampler_md=None
+        # excluded volume restraints need not score the pairs held
+        # together by the connectivity restraints
+        connectivity_restraints = [
+            ob for ob in self.output_objects if isinstance(
+                ob, IMP.pmi.restraints.stereochemistry.ConnectivityRestraint)]
+        if connectivity_restraints:
+            for ob in self.output_objects:
+                add_cr = getattr(ob, "add_connectivity_restraints", None)
+                if add_cr is not None:
+                    add_cr(connectivity_restraints)
         if self.monte_carlo_sample_objects is not None:
             print("Setting up MonteCarlo")
             sampler_mc = IMP.pmi.samplers.MonteCarlo(self.model,
                                                      self.monte_carlo_sample_objects,
-                                                     self.vars["monte_carlo_temperature"])
+                                                     self.vars["monte_carlo_temperature"],
+                                                     score_moved=self.vars["score_moved"])
             if self.vars["simulated_annealing"]:
                 tmin=self.vars["simulated_annealing_minimum_temperature"]
                 tmax=self.vars["simulated_annealing_maximum_temperature"]
                 nfmin=self.vars["simulated_annealing_minimum_temperature_nframes"]
                 nfmax=self.vars["simulated_annealing_maximum_temperature_nframes"]
                 sampler_mc.set_simulated_annealing(tmin,tmax,nfmin,nfmax)
+            # let excluded volume restraints tune their pair list slack
+            for ob in self.output_objects:
+                set_slack = getattr(ob, "set_slack_from_sampler", None)
+                if set_slack is not None:
+                    set_slack(sampler_mc)
             self.output_objects.append(sampler_mc)
             samplers.append(sampler_mc)
 
@@ -249,6 +415,10 @@ class ReplicaExchange0(object):
                                                samplers,
                                                replica_exchange_object=self.replica_exchange_object)
         self.replica_exchange_object = rex.rem
+        if self.vars["replica_exchange_ladder_optimization"]:
+            rex.set_ladder_optimization(
+                     self.vars["replica_exchange_ladder_optimization"],
+                     self.vars["replica_exchange_ladder_nframes"])
 
         myindex = rex.get_my_index()
         self.output_objects.append(rex)
@@ -258,9 +428,20 @@ class ReplicaExchange0(object):
         # float
         min_temp_index = int(min(rex.get_temperatures()) * temp_index_factor)
 
+        globaldir = self.vars["global_output_directory"] + "/"
+        checkpoint_dir = globaldir + self.vars["checkpoint_dir"]
+        nreplicas = rex.rem.get_number_of_replicas()
+        restart_frame = None
+        if self.vars["checkpoint_interval"] and not self.test_mode:
+            restart_frame = self._find_checkpoint(checkpoint_dir, nreplicas)
+        if restart_frame is not None:
+            print("Restarting from checkpoint at frame %d" % restart_frame)
+            my_checkpoint, replica_checkpoint = self._read_checkpoint(
+                    checkpoint_dir, restart_frame, myindex,
+                    rex.get_my_temperature_index(), nreplicas)
+
 # -------------------------------------------------------------------------
 
-        globaldir = self.vars["global_output_directory"] + "/"
         rmf_dir = globaldir + self.vars["rmf_dir"]
         pdb_dir = globaldir + self.vars["best_pdb_dir"]
 
@@ -291,6 +472,12 @@ class ReplicaExchange0(object):
                         except:
                             pass
 
+                if self.vars["checkpoint_interval"]:
+                    try:
+                        os.makedirs(checkpoint_dir)
+                    except:
+                        pass
+
 # -------------------------------------------------------------------------
 
         sw = IMP.pmi.tools.Stopwatch()
@@ -300,19 +487,37 @@ class ReplicaExchange0(object):
         output = IMP.pmi.output.Output(atomistic=self.vars["atomistic"])
         low_temp_stat_file = globaldir + \
             self.vars["stat_file_name_suffix"] + "." + str(myindex) + ".out"
+        if restart_frame is not None:
+            # drop anything written after the checkpoint
+            for fname, size in my_checkpoint["stat_file_sizes"].items():
+                with open(fname, "r+") as fh:
+                    fh.truncate(size)
         if not self.test_mode:
             output.init_stat2(low_temp_stat_file,
                               self.output_objects,
-                              extralabels=["rmf_file", "rmf_frame_index"])
+                              extralabels=["rmf_file", "rmf_frame_index"],
+                              append=restart_frame is not None)
 
         print("Setting up replica stat file")
         replica_stat_file = globaldir + \
             self.vars["replica_stat_file_suffix"] + "." + str(myindex) + ".out"
         if not self.test_mode:
-            output.init_stat2(replica_stat_file, [rex], extralabels=["score"])
+            output.init_stat2(replica_stat_file, [rex], extralabels=["score"],
+                              append=restart_frame is not None)
 
         if not self.test_mode:
             print("Setting up best pdb files")
+            best_score_list = None
+            if restart_frame is not None:
+                best_score_list = my_checkpoint["best_score_list"]
+                # drop any best scoring models written after the checkpoint
+                if (myindex == 0
+                        and self.vars["number_of_best_scoring_models"] > 0):
+                    self._restore_best_pdbs(checkpoint_dir, restart_frame,
+                                            best_score_list, pdb_dir)
+                if nreplicas > 1:
+                    from mpi4py import MPI
+                    MPI.COMM_WORLD.Barrier()
             if not self.is_multi_state:
                 if self.vars["number_of_best_scoring_models"] > 0:
                     output.init_pdb_best_scoring(pdb_dir + "/" +
@@ -320,7 +525,8 @@ class ReplicaExchange0(object):
                                                  self.root_hier,
                                                  self.vars[
                                                      "number_of_best_scoring_models"],
-                                                 replica_exchange=True)
+                                                 replica_exchange=True,
+                                                 best_score_list=best_score_list)
                     output.write_psf(pdb_dir + "/" +"model.psf",pdb_dir + "/" +
                                                  self.vars["best_pdb_name_suffix"]+".0.pdb")
             else:
@@ -331,7 +537,8 @@ class ReplicaExchange0(object):
                                                    self.root_hiers[n],
                                                    self.vars[
                                                        "number_of_best_scoring_models"],
-                                                   replica_exchange=True)
+                                                   replica_exchange=True,
+                                                   best_score_list=best_score_list)
                         output.write_psf(pdb_dir + "/" + str(n) + "/" +"model.psf",pdb_dir + "/" + str(n) + "/" +
                                                  self.vars["best_pdb_name_suffix"]+".0.pdb")
 # ---------------------------------------------
@@ -353,7 +560,7 @@ class ReplicaExchange0(object):
                 output_hierarchies = self.root_hiers
 
 #----------------------------------------------
-        if not self.test_mode:
+        if not self.test_mode and restart_frame is None:
             print("Setting up and writing initial rmf coordinate file")
             init_suffix = globaldir + self.vars["initial_rmf_name_suffix"]
             output.init_rmf(init_suffix + "." + str(myindex) + ".rmf3",
@@ -370,12 +577,39 @@ class ReplicaExchange0(object):
         if not self.test_mode:
             print("Setting up production rmf files")
             rmfname = rmf_dir + "/" + str(myindex) + ".rmf3"
+            if restart_frame is not None \
+                    and not os.path.exists(rmfname + ".old"):
+                # if an earlier restart was interrupted while copying
+                # frames, the old file is the only complete trajectory
+                # and the new one is partial, so keep the old one
+                os.rename(rmfname, rmfname + ".old")
             output.init_rmf(rmfname, output_hierarchies, geometries=self.vars["geometries"])
 
             if self.crosslink_restraints:
                 output.add_restraints_to_rmf(rmfname, self.crosslink_restraints)
 
         ntimes_at_low_temp = 0
+        nrmf_frames = 0
+        first_frame = 0
+        if restart_frame is not None:
+            print("Copying %d frames to the restarted rmf file"
+                  % my_checkpoint["nrmf_frames"])
+            output.copy_rmf_frames(rmfname, rmfname + ".old",
+                                   output_hierarchies,
+                                   my_checkpoint["nrmf_frames"])
+            output.dictionary_rmfs[rmfname].flush()
+            os.unlink(rmfname + ".old")
+            ntimes_at_low_temp = my_checkpoint["ntimes_at_low_temp"]
+            nrmf_frames = my_checkpoint["nrmf_frames"]
+            first_frame = restart_frame + 1
+            random.setstate(my_checkpoint["python_random_state"])
+            np.random.set_state(my_checkpoint["numpy_random_state"])
+            IMP.random_number_generator.seed(my_checkpoint["imp_random_seed"])
+            IMP.pmi.tools.set_optimized_attributes(
+                    self.model, replica_checkpoint["model"])
+            for so, data in zip(samplers, replica_checkpoint["samplers"]):
+                so.restore_checkpoint(data)
+            rex.restore_checkpoint(replica_checkpoint["replica_exchange"])
 
         if myindex == 0:
             self.show_info()
@@ -383,7 +617,7 @@ class ReplicaExchange0(object):
         nframes = self.vars["number_of_frames"]
         if self.test_mode:
             nframes = 1
-        for i in range(nframes):
+        for i in range(first_frame, nframes):
             if self.test_mode:
                 score = 0.
             else:
@@ -408,6 +642,7 @@ class ReplicaExchange0(object):
                         if self.vars["number_of_best_scoring_models"] > 0:
                             output.write_pdb_best_scoring(score)
                         output.write_rmf(rmfname)
+                        nrmf_frames += 1
                         output.set_output_entry("rmf_file", rmfname)
                         output.set_output_entry("rmf_frame_index", ntimes_at_low_temp)
                     else:
@@ -419,6 +654,32 @@ class ReplicaExchange0(object):
             if not self.test_mode:
                 output.write_stat2(replica_stat_file)
             rex.swap_temp(i, score)
+            if (not self.test_mode and self.vars["checkpoint_interval"]
+                    and (i + 1) % self.vars["checkpoint_interval"] == 0):
+                # reseed IMP so that the random stream after a restart is
+                # the same as if the run had not been interrupted
+                imp_random_seed = random.randint(0, 2**31 - 1)
+                IMP.random_number_generator.seed(imp_random_seed)
+                best_score_list = output.best_score_list
+                if (myindex == 0
+                        and self.vars["number_of_best_scoring_models"] > 0):
+                    best_score_list = self._save_best_pdbs(
+                                   checkpoint_dir, i, output, pdb_dir)
+                self._write_checkpoint(checkpoint_dir, i, myindex, {
+                    "temperature_index": rex.get_my_temperature_index(),
+                    "ntimes_at_low_temp": ntimes_at_low_temp,
+                    "nrmf_frames": nrmf_frames,
+                    "stat_file_sizes": dict(
+                        (f, os.path.getsize(f))
+                        for f in (low_temp_stat_file, replica_stat_file)),
+                    "best_score_list": best_score_list,
+                    "python_random_state": random.getstate(),
+                    "numpy_random_state": np.random.get_state(),
+                    "imp_random_seed": imp_random_seed,
+                    "model": IMP.pmi.tools.get_optimized_attributes(
+                                                              self.model),
+                    "samplers": [so.get_checkpoint() for so in samplers],
+                    "replica_exchange": rex.get_checkpoint()})
         if self.representation:
             for p in self.representation._protocol_output:
                 p.add_replica_exchange(self)
@@ -13,6 +13,7 @@ import sys
 import RMF
 import numpy as np
 import operator
+import ast
 try:
     import cPickle as pickle
 except ImportError:
@@ -303,22 +304,28 @@ class Output(object):
                               suffix,
                               prot,
                               nbestscoring,
-                              replica_exchange=False):
+                              replica_exchange=False,
+                              best_score_list=None):
         # save only the nbestscoring conformations
         # create as many pdbs as needed
+        # if best_score_list is given (e.g. when restarting from a
+        # checkpoint) continue from those scores and keep existing pdbs
 
         self.suffixes.append(suffix)
         self.replica_exchange = replica_exchange
+        restart = best_score_list is not None
+        if best_score_list is None:
+            best_score_list = []
         if not self.replica_exchange:
             # common usage
             # if you are not in replica exchange mode
             # initialize the array of scores internally
-            self.best_score_list = []
+            self.best_score_list = list(best_score_list)
         else:
             # otherwise the replicas must cominucate
             # through a common file to know what are the best scores
             self.best_score_file_name = "best.scores.rex.py"
-            self.best_score_list = []
+            self.best_score_list = list(best_score_list)
             best_score_file = open(self.best_score_file_name, "w")
             best_score_file.write(
                 "self.best_score_list=" + str(self.best_score_list))
@@ -327,19 +334,25 @@ class Output(object):
         self.nbestscoring = nbestscoring
         for i in range(self.nbestscoring):
             name = suffix + "." + str(i) + ".pdb"
-            flpdb = open(name, 'w')
-            flpdb.close()
+            if not restart or not os.path.exists(name):
+                flpdb = open(name, 'w')
+                flpdb.close()
             self.dictionary_pdbs[name] = prot
             self._init_dictchain(name, prot)
 
+    def _update_best_score_list(self):
+        """In replica exchange mode, read the scores of all replicas
+           from the common file"""
+        if self.replica_exchange:
+            exec(open(self.best_score_file_name).read())
+        return self.best_score_list
+
     def write_pdb_best_scoring(self, score):
         if self.nbestscoring is None:
             print("Output.write_pdb_best_scoring: init_pdb_best_scoring not run")
 
         # update the score list
-        if self.replica_exchange:
-            # read the self.best_score_list from the file
-            exec(open(self.best_score_file_name).read())
+        self._update_best_score_list()
 
         if len(self.best_score_list) < self.nbestscoring:
             self.best_score_list.append(score)
@@ -418,6 +431,23 @@ class Output(object):
         IMP.rmf.save_frame(self.dictionary_rmfs[name])
         self.dictionary_rmfs[name].flush()
 
+    def copy_rmf_frames(self, name, oldname, hierarchies, nframes):
+        """Append the first nframes frames of RMF file oldname to name.
+        Since existing RMF files cannot be reopened for writing, this is
+        how a restarted run continues an RMF trajectory. The coordinates
+        of the hierarchies are overwritten.
+        @param name An RMF file set up with init_rmf()
+        @param oldname The RMF file to copy frames from
+        @param hierarchies The hierarchies written to both files
+        @param nframes The number of frames to copy
+        """
+        rh = RMF.open_rmf_file_read_only(oldname)
+        IMP.rmf.link_hierarchies(rh, hierarchies)
+        for frame in range(nframes):
+            IMP.rmf.load_frame(rh, RMF.FrameID(frame))
+            self.write_rmf(name)
+        del rh
+
     def close_rmf(self, name):
         del self.dictionary_rmfs[name]
 
@@ -587,16 +617,30 @@ class Output(object):
         name,
         listofobjects,
         extralabels=None,
-            listofsummedobjects=None):
+            listofsummedobjects=None,
+            append=False):
         # this is a new stat file that should be less
         # space greedy!
         # listofsummedobjects must be in the form [([obj1,obj2,obj3,obj4...],label)]
         # extralabels
+        # if append is True and the file exists, keep its header and
+        # contents, and write new frames at the end
 
         if listofsummedobjects is None:
             listofsummedobjects = []
         if extralabels is None:
             extralabels = []
+        if append and os.path.exists(name):
+            with open(name) as fh:
+                header = ast.literal_eval(fh.readline())
+            stat2_inverse = dict((v, k) for k, v in header.items()
+                                 if isinstance(k, int))
+            self.dictionary_stats2[name] = (
+                listofobjects,
+                stat2_inverse,
+                listofsummedobjects,
+                extralabels)
+            return
         flstat = open(name, 'w')
         output = {}
         stat2_keywords = {"STAT2HEADER": "STAT2HEADER"}
@@ -630,6 +674,15 @@ class Output(object):
         for k in extralabels:
             output.update({k: 0.0})
 
+        # entries whose values are lists; the header records which key
+        # each list element stands for, so that readers can expand them
+        vectors = {}
+        for l in listofobjects:
+            if "get_output_vector_labels" in dir(l):
+                vectors.update(l.get_output_vector_labels())
+        if vectors:
+            stat2_keywords.update({"STAT2HEADER_VECTORS": vectors})
+
         for n, k in enumerate(output):
             stat2_keywords.update({n: k})
             stat2_inverse.update({k: n})
@@ -684,11 +737,14 @@ class Output(object):
 
 
 class ProcessOutput(object):
-    """A class for reading stat files"""
+    """A class for reading stat files.
+    List-valued stat2 entries described in the STAT2HEADER_VECTORS header
+    (see Output.init_stat2) are expanded into one key per element."""
     def __init__(self, filename):
         self.filename = filename
         self.isstat1 = False
         self.isstat2 = False
+        self.vector_keys = {}
 
         # open the file
         if not self.filename is None:
@@ -703,6 +759,7 @@ class ProcessOutput(object):
             # check if it is a stat2 file
             if "STAT2HEADER" in self.klist:
                 self.isstat2 = True
+                vectors = d.get("STAT2HEADER_VECTORS", {})
                 for k in self.klist:
                     if "STAT2HEADER" in str(k):
                         # if print_header: print k, d[k]
@@ -716,6 +773,14 @@ class ProcessOutput(object):
                 self.invstat2_dict = {}
                 for k in kkeys:
                     self.invstat2_dict.update({stat2_dict[k]: k})
+                for vkey in vectors:
+                    if vkey not in self.invstat2_dict:
+                        continue
+                    prefix, labels = vectors[vkey]
+                    self.klist.remove(vkey)
+                    for i, label in enumerate(labels):
+                        self.vector_keys[prefix + label] = (vkey, i)
+                        self.klist.append(prefix + label)
             else:
                 self.isstat1 = True
                 self.klist.sort()
@@ -726,6 +791,12 @@ class ProcessOutput(object):
     def get_keys(self):
         return self.klist
 
+    def _get_stat2_value(self, d, key):
+        if key in self.vector_keys:
+            vkey, i = self.vector_keys[key]
+            return str(d[self.invstat2_dict[vkey]][i])
+        return d[self.invstat2_dict[key]]
+
     def show_keys(self, ncolumns=2, truncate=65):
         IMP.pmi.tools.print_multicolumn(self.get_keys(), ncolumns, truncate)
 
@@ -792,16 +863,16 @@ class ProcessOutput(object):
                     relationship = filtertuple[1]
                     value = filtertuple[2]
                     if relationship == "<":
-                        if float(d[self.invstat2_dict[keytobefiltered]]) >= value:
+                        if float(self._get_stat2_value(d, keytobefiltered)) >= value:
                             continue
                     if relationship == ">":
-                        if float(d[self.invstat2_dict[keytobefiltered]]) <= value:
+                        if float(self._get_stat2_value(d, keytobefiltered)) <= value:
                             continue
                     if relationship == "==":
-                        if float(d[self.invstat2_dict[keytobefiltered]]) != value:
+                        if float(self._get_stat2_value(d, keytobefiltered)) != value:
                             continue
 
-                [outdict[field].append(d[self.invstat2_dict[field]])
+                [outdict[field].append(self._get_stat2_value(d, field))
                  for field in fields]
         f.close()
         return outdict
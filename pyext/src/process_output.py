@@ -168,6 +168,7 @@ for line in f.readlines():
     if "STAT2HEADER" in klist:
         import operator
         isstat2 = True
+        vectors = d.get("STAT2HEADER_VECTORS", {})
         for k in klist:
             if "STAT2HEADER" in str(k):
                 if result.print_header:
@@ -182,6 +183,17 @@ for line in f.readlines():
         invstat2_dict = {}
         for k in kkeys:
             invstat2_dict.update({stat2_dict[k]: k})
+        # expand list-valued entries into one key per element,
+        # as done by IMP.pmi.output.ProcessOutput
+        vector_keys = {}
+        for vkey in vectors:
+            if vkey not in invstat2_dict:
+                continue
+            prefix, labels = vectors[vkey]
+            klist.remove(vkey)
+            for i, label in enumerate(labels):
+                vector_keys[prefix + label] = (vkey, i)
+                klist.append(prefix + label)
     else:
         isstat1 = True
         klist.sort()
@@ -189,6 +201,13 @@ for line in f.readlines():
     break
 f.close()
 
+
+def get_stat2_value(d, key):
+    if key in vector_keys:
+        vkey, i = vector_keys[key]
+        return d[invstat2_dict[vkey]][i]
+    return d[invstat2_dict[key]]
+
 # print the keys
 if result.print_fields:
     for key in klist:
@@ -239,7 +258,7 @@ if not result.fields is None:
         elif isstat2:
             if line_number == 1:
                 continue
-            s0 = ' '.join(["%20s" % (str(d[invstat2_dict[field]]))
+            s0 = ' '.join(["%20s" % (str(get_stat2_value(d, field)))
                           for field in field_list])
         if not result.nframe:
             print("> " + s0)
@@ -270,7 +289,7 @@ if not result.single_column_field is None:
             if line_number == 1:
                 continue
             for key in field_list:
-                print(key, d[invstat2_dict[key]])
+                print(key, get_stat2_value(d, key))
         print(" ")
     f.close()
 
@@ -304,9 +323,9 @@ if (not result.search_field is None) and (not result.search_value is None):
         elif isstat2:
             if line_number == 1:
                 continue
-            if (str(d[invstat2_dict[corrected_field]]) == result.search_value):
+            if (str(get_stat2_value(d, corrected_field)) == result.search_value):
                 for key in klist:
-                    print(key, d[invstat2_dict[key]])
+                    print(key, get_stat2_value(d, key))
     f.close()
 
 if not result.print_raw_number is None:
@@ -334,5 +353,5 @@ if not result.print_raw_number is None:
                     print("# Warning: skipped line number " + str(line_number) + " not a valid line")
                     break
                 for key in klist:
-                    print(key, d[invstat2_dict[key]])
+                    print(key, get_stat2_value(d, key))
     f.close()
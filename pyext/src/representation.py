@@ -674,7 +674,8 @@ class Representation(object):
         transform=None,
         intermediate_map_fn=None,
         density_ps_to_copy=None,
-        use_precomputed_gaussians=False):
+        use_precomputed_gaussians=False,
+        gmm_store=None):
         '''
         Sets up a Gaussian Mixture Model for this component.
         Can specify input GMM file or it will be computed.
@@ -698,6 +699,9 @@ class Representation(object):
         @param intermediate_map_fn for debugging, this will write the intermediate (simulated) map
         @param density_ps_to_copy in case you already created the appropriate GMM (eg, for beads)
         @param use_precomputed_gaussians Set this flag and pass fragments - will use roughly spherical Gaussian setup
+        @param gmm_store If given, a directory used as a content-addressed store of fitted GMMs:
+                                  the GMM is only computed if the store has no fit for the same particles
+                                  and parameters (see IMP::pmi::io::gmm)
         '''
         import numpy as np
         import sys
@@ -768,18 +772,38 @@ class Representation(object):
                 print("add_component_density: no particle was selected")
                 return out_hier
 
-            density_particles = IMP.isd.gmm_tools.sample_and_fit_to_particles(
-                self.m,
-                fragment_particles,
-                num_components,
-                sampled_points,
-                simulation_res,
-                voxel_size,
-                num_iter,
-                covariance_type,
-                multiply_by_total_mass,
-                outputmap,
-                outputfile)
+            if gmm_store is not None:
+                import IMP.pmi.io.gmm
+                density_particles = IMP.pmi.io.gmm.sample_and_fit_to_particles(
+                    self.m,
+                    fragment_particles,
+                    num_components,
+                    gmm_store,
+                    sampled_points,
+                    simulation_res,
+                    voxel_size,
+                    num_iter,
+                    covariance_type,
+                    multiply_by_total_mass)
+                if outputfile:
+                    IMP.isd.gmm_tools.write_gmm_to_text(density_particles,
+                                                        outputfile)
+                if outputmap:
+                    IMP.isd.gmm_tools.write_gmm_to_map(density_particles,
+                                                       outputmap, voxel_size)
+            else:
+                density_particles = IMP.isd.gmm_tools.sample_and_fit_to_particles(
+                    self.m,
+                    fragment_particles,
+                    num_components,
+                    sampled_points,
+                    simulation_res,
+                    voxel_size,
+                    num_iter,
+                    covariance_type,
+                    multiply_by_total_mass,
+                    outputmap,
+                    outputfile)
 
         # prepare output hierarchy
         s0 = IMP.atom.Fragment.setup_particle(IMP.Particle(self.m))
@@ -164,10 +164,18 @@ class DistanceRestraint(IMP.pmi.restraints.RestraintBase):
                                        particles2[0]))
 
 
-class TorqueRestraint(IMP.Restraint):
-    import math
+class TorqueRestraint(IMP.pmi.TorqueRestraint):
+    """Keep particles within an angular range (around the z axis)
+       of their centroid. Implemented in C++, with derivatives."""
     def __init__(self, m, objects, resolution, angular_tolerance,label='None'):
-        IMP.Restraint.__init__(self, m, "TorqueRestraint %1%")
+        """Constructor
+        @param m the IMP Model
+        @param objects PMI2 objects
+        @param resolution the resolution you want the restraint to be applied
+        @param angular_tolerance the maximum angle (in degrees) from the
+               centroid
+        @param label the output label
+        """
         self.softness_angle = 0.5
         self.plateau = 1e-10
         self.weight = 1.0
@@ -179,28 +187,10 @@ class TorqueRestraint(IMP.Restraint):
         self.ds=[IMP.core.XYZ(p) for p in self.particles]
         self.label=label
         self.at=angular_tolerance
-
-    def get_angle_probability(self,xyz,angle_center):
-        maxtheta=angle_center+self.at
-        mintheta=angle_center-self.at
-        angle=self.math.atan2(xyz.get_y(),xyz.get_x() )*180.0/self.math.pi
-        anglediff = (angle - maxtheta + 180 + 360) % 360 - 180
-        argvalue1=anglediff / self.softness_angle
-        anglediff = (angle - mintheta + 180 + 360) % 360 - 180
-        argvalue2=-anglediff / self.softness_angle
-        prob = (1.0-self.plateau) / (1.0 + self.math.exp(-max(argvalue1,argvalue2)))
-        return prob
-
-    def unprotected_evaluate(self, da):
-        s=0.0
-        center=IMP.core.get_centroid(self.ds)
-        angle_center=self.math.atan2(center[1],center[0])*180.0/self.math.pi
-        for xyz in self.ds:
-            s+=-self.math.log(1.0-self.get_angle_probability(xyz,angle_center))
-        return s
-
-    def do_get_inputs(self):
-        return self.particles
+        IMP.pmi.TorqueRestraint.__init__(self, m, self.particles,
+                                         angular_tolerance,
+                                         self.softness_angle, self.plateau,
+                                         "TorqueRestraint %1%")
 
     def add_to_model(self):
         IMP.pmi.tools.add_restraint_to_model(self.m, self)
@@ -216,14 +206,13 @@ class TorqueRestraint(IMP.Restraint):
 
 
 
-class CylinderRestraint(IMP.Restraint):
+class CylinderRestraint(IMP.pmi.CylinderRestraint):
     '''
-    PMI2 python restraint. Restrains particles within a
-    Cylinder aligned along the z-axis and
+    PMI2 restraint, implemented in C++ with derivatives. Restrains
+    particles within a Cylinder aligned along the z-axis and
     centered in x,y=0,0
     Optionally, one can restrain the cylindrical angle
     '''
-    import math
     def __init__(self, m, objects, resolution, radius,mintheta=None,
                  maxtheta=None,repulsive=False,label='None'):
         '''
@@ -233,7 +222,6 @@ class CylinderRestraint(IMP.Restraint):
         @param mintheta minimum cylindrical angle in degrees
         @param maxtheta maximum cylindrical angle in degrees
         '''
-        IMP.Restraint.__init__(self, m, "CylinderRestraint %1%")
         self.radius=radius
         self.softness = 3.0
         self.softness_angle = 0.5
@@ -248,35 +236,15 @@ class CylinderRestraint(IMP.Restraint):
                                             flatten=True)
         self.particles = [h.get_particle() for h in hierarchies]
         self.label=label
-
-    def get_probability(self,p):
-        xyz=IMP.core.XYZ(p)
-        r=self.math.sqrt(xyz.get_x()**2+xyz.get_y()**2)
-        argvalue=(r-self.radius) / self.softness
-        if self.repulsive: argvalue=-argvalue
-        prob = (1.0 - self.plateau) / (1.0 + self.math.exp(-argvalue))
-        return prob
-
-    def get_angle_probability(self,p):
-        xyz=IMP.core.XYZ(p)
-        angle=self.math.atan2(xyz.get_y(),xyz.get_x() )*180.0/self.math.pi
-        anglediff = (angle - self.maxtheta + 180 + 360) % 360 - 180
-        argvalue1=anglediff / self.softness_angle
-        anglediff = (angle - self.mintheta + 180 + 360) % 360 - 180
-        argvalue2=-anglediff / self.softness_angle
-        prob = (1.0-self.plateau) / (1.0 + self.math.exp(-max(argvalue1,argvalue2)))
-        return prob
-
-    def unprotected_evaluate(self, da):
-        s=0.0
-        for p in self.particles:
-            s+=-self.math.log(1.0-self.get_probability(p))
-            if self.mintheta is not None and self.maxtheta is not None:
-                s+=-self.math.log(1.0-self.get_angle_probability(p))
-        return s
-
-    def do_get_inputs(self):
-        return self.particles
+        if self.mintheta is not None and self.maxtheta is not None:
+            IMP.pmi.CylinderRestraint.__init__(self, m, self.particles,
+                                               radius, mintheta, maxtheta,
+                                               repulsive,
+                                               "CylinderRestraint %1%")
+        else:
+            IMP.pmi.CylinderRestraint.__init__(self, m, self.particles,
+                                               radius, repulsive,
+                                               "CylinderRestraint %1%")
 
     def add_to_model(self):
         IMP.pmi.tools.add_restraint_to_model(self.m, self)
@@ -291,19 +259,16 @@ class CylinderRestraint(IMP.Restraint):
 
 
 
-class BiStableDistanceRestraint(IMP.Restraint):
+class BiStableDistanceRestraint(IMP.pmi.BiStableDistanceRestraint):
     '''
-    a python restraint with bistable potential
+    a restraint with bistable potential, implemented in C++ with derivatives
     Authors: G. Bouvier, R. Pellarin. Pasteur Institute.
     '''
-    import numpy as np
-    import math
 
     def __init__(self,m,p1,p2,dist1,dist2,sigma1,sigma2,weight1,weight2):
         '''
         input twp particles, the two equilibrium distances, their amplitudes, and their weights (populations)
         '''
-        IMP.Restraint.__init__(self, m, "BiStableDistanceRestraint %1%")
         self.dist1=dist1
         self.dist2=dist2
 
@@ -319,18 +284,9 @@ class BiStableDistanceRestraint(IMP.Restraint):
         self.d1=IMP.core.XYZ(p1)
         self.d2=IMP.core.XYZ(p2)
         self.particle_list=[p1,p2]
-
-    def gaussian(self,x, mu, sig, w):
-        return w*self.np.exp(-self.np.power(x - mu, 2.) / (2 * self.np.power(sig, 2.)))
-
-    def unprotected_evaluate(self,da):
-        dist=IMP.core.get_distance(self.d1,self.d2)
-        prob=self.gaussian(dist,self.dist1,self.sigma1,self.weight1)+\
-             self.gaussian(dist,self.dist2,self.sigma2,self.weight2)
-        return -self.math.log(prob)
-
-    def do_get_inputs(self):
-        return self.particle_list
+        IMP.pmi.BiStableDistanceRestraint.__init__(
+            self, m, p1, p2, dist1, dist2, sigma1, sigma2, weight1, weight2,
+            "BiStableDistanceRestraint %1%")
 
 
 class DistanceToPointRestraint(IMP.pmi.restraints.RestraintBase):
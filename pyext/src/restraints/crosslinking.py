@@ -16,6 +16,7 @@ import IMP.pmi.io.crosslink
 import IMP.pmi.restraints
 from math import log
 from collections import defaultdict
+import numpy as np
 import itertools
 import operator
 import os
@@ -35,7 +36,8 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                  label=None,
                  filelabel="None",
                  attributes_for_label=None,
-                 weight=1.):
+                 weight=1.,
+                 particle_index=None):
         """Constructor.
         @param representation DEPRECATED The IMP.pmi.representation.Representation
                 object that contain the molecular system
@@ -54,6 +56,9 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                 cross-links will be labeled using this text
         @param attributes_for_label
         @param weight Weight of restraint
+        @param particle_index An IMP.pmi.tools.ResidueParticleIndex used to
+               look up the cross-linked residues. Pass the same object to
+               several restraints to share it; if not given, one is built.
         """
 
         use_pmi2 = True
@@ -101,9 +106,18 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
         self.sigma_dictionary={}
         self.xl_list=[]
         self.outputlevel = "low"
+        self.vectorized_output = False
+        self._vector_data = None
 
         restraints = []
 
+        if particle_index is None:
+            if use_pmi2:
+                particle_index = IMP.pmi.tools.ResidueParticleIndex(root_hier)
+            else:
+                particle_index = IMP.pmi.tools.ResidueParticleIndex(
+                    representations=representations)
+
         # if PMI2, first add all the molecule copies as clones to the database
         if use_pmi2:
             copies_to_add = defaultdict(int)
@@ -117,11 +131,8 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                     for c,r in ((c1,r1),(c2,r2)):
                         if c in copies_to_add:
                             continue
-                        sel = IMP.atom.Selection(root_hier,
-                                                 state_index=0,
-                                                 molecule=c,
-                                                 residue_index=r,
-                                                 resolution=resolution).get_selected_particles()
+                        sel = particle_index.get_particles(
+                            0, c, r, resolution=resolution)
                         if len(sel)>0:
                             copies_to_add[c] = len(sel)-1
             print(copies_to_add)
@@ -136,6 +147,10 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                     self.CrossLinkDataBase.clone_protein('%s.0'%molname,'%s.%i'%(molname,ncopy+1))
             print('done pmi2 prelims')
 
+        if use_pmi2:
+            iterlist = range(len(IMP.atom.get_by_type(root_hier,IMP.atom.STATE_TYPE)))
+        else:
+            iterlist = representations
         for xlid in self.CrossLinkDataBase.xlid_iterator():
             new_contribution=True
             for xl in self.CrossLinkDataBase[xlid]:
@@ -145,10 +160,6 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                 r2 = xl[self.CrossLinkDataBase.residue2_key]
                 c2 = xl[self.CrossLinkDataBase.protein2_key]
 
-                if use_pmi2:
-                    iterlist = range(len(IMP.atom.get_by_type(root_hier,IMP.atom.STATE_TYPE)))
-                else:
-                    iterlist = representations
                 for nstate, r in enumerate(iterlist):
                     # loop over every state
                     xl[self.CrossLinkDataBase.state_key]=nstate
@@ -163,34 +174,20 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
                             name1,copy1 = c1.split('.')
                         if '.' in c2:
                             name2,copy2 = c2.split('.')
-                        ps1 = IMP.atom.Selection(root_hier,
-                                                 state_index=nstate,
-                                                 molecule=name1,
-                                                 copy_index=int(copy1),
-                                                 residue_index=r1,
-                                                 resolution=resolution).get_selected_particles()
-                        ps2 = IMP.atom.Selection(root_hier,
-                                                 state_index=nstate,
-                                                 molecule=name2,
-                                                 copy_index=int(copy2),
-                                                 residue_index=r2,
-                                                 resolution=resolution).get_selected_particles()
-
-                        ps1 = [IMP.atom.Hierarchy(p) for p in ps1]
-                        ps2 = [IMP.atom.Hierarchy(p) for p in ps2]
+                        ps1 = particle_index.get_particles(
+                            nstate, name1, r1, copy_index=int(copy1),
+                            resolution=resolution)
+                        ps2 = particle_index.get_particles(
+                            nstate, name2, r2, copy_index=int(copy2),
+                            resolution=resolution)
                     else:
-                        ps1 = IMP.pmi.tools.select(
-                             r,
-                             resolution=resolution,
-                             name=c1,
-                             name_is_ambiguous=False,
-                             residue=r1)
-                        ps2 = IMP.pmi.tools.select(
-                             r,
-                             resolution=resolution,
-                             name=c2,
-                             name_is_ambiguous=False,
-                             residue=r2)
+                        ps1 = particle_index.get_particles(
+                            nstate, c1, r1, resolution=resolution)
+                        ps2 = particle_index.get_particles(
+                            nstate, c2, r2, resolution=resolution)
+
+                    ps1 = [IMP.atom.Hierarchy(p) for p in ps1]
+                    ps2 = [IMP.atom.Hierarchy(p) for p in ps2]
 
                     if len(ps1) > 1:
                         raise ValueError("residue %d of chain %s selects multiple particles %s" % (r1, c1, str(ps1)))
@@ -335,6 +332,67 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
         """ Switch on/off the sampling of sigma particles """
         self.sigma_is_sampled = is_sampled
 
+    def set_vectorized_output(self, is_vectorized=True):
+        """ Output all cross-link scores and distances as two lists per frame.
+        The cross-link labels are written once in the stat file header, and
+        IMP.pmi.output.ProcessOutput expands the lists back into the
+        per-cross-link Score and Distance keys. Must be called before
+        the stat file is initialized."""
+        self.vectorized_output = is_vectorized
+
+    def get_output_vector_labels(self):
+        """ Get the labels of the list-valued output entries,
+        used by IMP.pmi.output.Output to write the stat file header """
+        if not self.vectorized_output:
+            return {}
+        labels = [xl["ShortLabel"] for xl in self.xl_list]
+        return {"CrossLinkingMassSpectrometryRestraint_Scores" +
+                self._label_suffix:
+                    ("CrossLinkingMassSpectrometryRestraint_Score_", labels),
+                "CrossLinkingMassSpectrometryRestraint_Distances" +
+                self._label_suffix:
+                    ("CrossLinkingMassSpectrometryRestraint_Distance_", labels)}
+
+    def _get_vector_data(self):
+        """ Get the particles, particle pair indexes, restraints and
+        restraint index of each cross-link, for vectorized output """
+        if self._vector_data is None:
+            pis = []
+            pi_index = {}
+            rsrs = []
+            rsr_index = {}
+            pairs = []
+            xl_rsrs = []
+            for xl in self.xl_list:
+                pair = []
+                for p in (xl["Particle1"], xl["Particle2"]):
+                    pi = p.get_particle_index()
+                    if pi not in pi_index:
+                        pi_index[pi] = len(pis)
+                        pis.append(pi)
+                    pair.append(pi_index[pi])
+                pairs.append(pair)
+                r = xl["Restraint"]
+                if id(r) not in rsr_index:
+                    rsr_index[id(r)] = len(rsrs)
+                    rsrs.append(r)
+                xl_rsrs.append(rsr_index[id(r)])
+            self._vector_data = (pis, np.array(pairs, dtype=int).reshape(-1, 2),
+                                 rsrs, np.array(xl_rsrs, dtype=int))
+        return self._vector_data
+
+    def _get_scores_and_distances(self):
+        """ Compute the scores and distances of all cross-links,
+        evaluating each restraint and reading each coordinate once """
+        pis, pairs, rsrs, xl_rsrs = self._get_vector_data()
+        coords = np.array([IMP.core.XYZ(self.m, pi).get_coordinates()
+                           for pi in pis]).reshape(-1, 3)
+        distances = np.sqrt(((coords[pairs[:, 0]]
+                              - coords[pairs[:, 1]]) ** 2).sum(axis=1))
+        rsr_scores = np.array([-log(r.unprotected_evaluate(None))
+                               for r in rsrs])
+        scores = rsr_scores[xl_rsrs] if len(rsrs) > 0 else np.zeros(0)
+        return scores.tolist(), distances.tolist()
 
     def create_sigma(self, name):
         """ This is called internally. Creates a nuisance
@@ -398,19 +456,26 @@ class CrossLinkingMassSpectrometryRestraint(IMP.pmi.restraints.RestraintBase):
         """ Get the output of the restraint to be used by the IMP.pmi.output object"""
         output = super(CrossLinkingMassSpectrometryRestraint, self).get_output()
 
-        for xl in self.xl_list:
+        if self.vectorized_output:
+            scores, distances = self._get_scores_and_distances()
+            output["CrossLinkingMassSpectrometryRestraint_Scores" +
+                   self._label_suffix] = scores
+            output["CrossLinkingMassSpectrometryRestraint_Distances" +
+                   self._label_suffix] = distances
+        else:
+            for xl in self.xl_list:
 
-            xl_label=xl["ShortLabel"]
-            ln = xl["Restraint"]
-            p0 = xl["Particle1"]
-            p1 = xl["Particle2"]
-            output["CrossLinkingMassSpectrometryRestraint_Score_" +
-                   xl_label] = str(-log(ln.unprotected_evaluate(None)))
+                xl_label=xl["ShortLabel"]
+                ln = xl["Restraint"]
+                p0 = xl["Particle1"]
+                p1 = xl["Particle2"]
+                output["CrossLinkingMassSpectrometryRestraint_Score_" +
+                       xl_label] = str(-log(ln.unprotected_evaluate(None)))
 
-            d0 = IMP.core.XYZ(p0)
-            d1 = IMP.core.XYZ(p1)
-            output["CrossLinkingMassSpectrometryRestraint_Distance_" +
-                   xl_label] = str(IMP.core.get_distance(d0, d1))
+                d0 = IMP.core.XYZ(p0)
+                d1 = IMP.core.XYZ(p1)
+                output["CrossLinkingMassSpectrometryRestraint_Distance_" +
+                       xl_label] = str(IMP.core.get_distance(d0, d1))
 
 
         for psiname in self.psi_dictionary:
@@ -465,7 +530,8 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
                  psi_init = 0.01,
                  one_psi=True,
                  filelabel=None,
-                 weight=1.):
+                 weight=1.,
+                 particle_index=None):
         """Constructor.
         Automatically creates one "sigma" per crosslinked residue and one "psis" per pair.
         Other nuisance options are available.
@@ -484,6 +550,9 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
         @param filelabel automatically generated file containing missing/included/excluded
                 cross-links will be labeled using this text
         @param weight Weight of restraint
+        @param particle_index An IMP.pmi.tools.ResidueParticleIndex used to
+               look up the cross-linked atoms. Pass the same object to
+               several restraints to share it; if not given, one is built.
 
         """
 
@@ -554,6 +623,9 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
             for xlid in self.xldb.xlid_iterator():
                 self._create_psi(xlid,psi_init)
 
+        if particle_index is None:
+            particle_index = IMP.pmi.tools.ResidueParticleIndex(self.root)
+
         ### create all the XLs
         xlrs=[]
         for xlid in self.xldb.xlid_iterator():
@@ -570,7 +642,7 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
             num_contributions=0
 
             # add a contribution for each XL ambiguity option within each state
-            for nstate in self.nstates:
+            for nstate in range(self.nstates):
                 for xl in self.xldb[xlid]:
                     r1 = xl[self.xldb.residue1_key]
                     c1 = xl[self.xldb.protein1_key].strip()
@@ -578,16 +650,10 @@ class AtomicCrossLinkMSRestraint(IMP.pmi.restraints.RestraintBase):
                     c2 = xl[self.xldb.protein2_key].strip()
 
                     # perform selection. these may contain multiples if Copies are used
-                    ps1 = IMP.atom.Selection(self.root,
-                                             state_index=nstate,
-                                             atom_type = IMP.atom.AtomType(self.atom_type),
-                                             molecule=c1,
-                                             residue_index=r1).get_selected_particles()
-                    ps2 = IMP.atom.Selection(self.root,
-                                             state_index=nstate,
-                                             atom_type = IMP.atom.AtomType(self.atom_type),
-                                             molecule=c2,
-                                             residue_index=r2).get_selected_particles()
+                    ps1 = particle_index.get_particles(
+                        nstate, c1, r1, atom_type=self.atom_type)
+                    ps2 = particle_index.get_particles(
+                        nstate, c2, r2, atom_type=self.atom_type)
                     if len(ps1) == 0:
                         print("AtomicXLRestraint: WARNING> residue %d of chain %s is not there" % (r1, c1))
                         if filelabel is not None:
@@ -1631,7 +1697,8 @@ class ISDCrossLinkMS(IMP.pmi.restraints._NuisancesBase):
                  label="None",
                  filelabel="None",
                  automatic_sigma_classification=False,
-                 attributes_for_label=None):
+                 attributes_for_label=None,
+                 particle_index=None):
 
         # columnindexes is a list of column indexes for protein1, protein2, residue1, residue2,idscore, XL unique id
         # by default column 0 = protein1; column 1 = protein2; column 2 = residue1; column 3 = residue2;
@@ -1640,12 +1707,18 @@ class ISDCrossLinkMS(IMP.pmi.restraints._NuisancesBase):
         # slope is the slope defined on the linear function
         # inner_slope is the slope defined on the restraint directly
         # suggestion: do not use both!
+        # particle_index: an IMP.pmi.tools.ResidueParticleIndex that can be
+        # shared between restraints; built from the representations if None
 
         if type(representation) != list:
             representations = [representation]
         else:
             representations = representation
 
+        if particle_index is None:
+            particle_index = IMP.pmi.tools.ResidueParticleIndex(
+                representations=representations)
+
         if columnmapping is None:
             columnmapping = {}
             columnmapping["Protein1"] = 0
@@ -1834,18 +1907,12 @@ class ISDCrossLinkMS(IMP.pmi.restraints._NuisancesBase):
             for nstate, r in enumerate(representations):
                 # loop over every state
 
-                ps1 = IMP.pmi.tools.select(
-                    r,
-                    resolution=resolution,
-                    name=c1,
-                    name_is_ambiguous=False,
-                    residue=r1)
-                ps2 = IMP.pmi.tools.select(
-                    r,
-                    resolution=resolution,
-                    name=c2,
-                    name_is_ambiguous=False,
-                    residue=r2)
+                ps1 = [IMP.atom.Hierarchy(p) for p in
+                       particle_index.get_particles(nstate, c1, r1,
+                                                    resolution=resolution)]
+                ps2 = [IMP.atom.Hierarchy(p) for p in
+                       particle_index.get_particles(nstate, c2, r2,
+                                                    resolution=resolution)]
 
                 if len(ps1) > 1:
                     raise ValueError("residue %d of chain %s selects multiple particles %s" % (r1, c1, str(ps1)))
@@ -12,6 +12,7 @@ import IMP.isd
 import IMP.pmi.tools
 import IMP.pmi.metadata
 import IMP.isd.gmm_tools
+import IMP.pmi.io.gmm
 import sys
 import re
 import os
@@ -38,7 +39,10 @@ class GaussianEMRestraint(object):
                  weight=1.0,
                  target_is_rigid_body=False,
                  local=False,
-                 representation=None):
+                 representation=None,
+                 target_cache=True,
+                 target_cache_mmap=False,
+                 target_tolerance=None):
         """Constructor.
         @param densities The Gaussian-decorated particles to be restrained
         @param target_fn GMM file of the target density map
@@ -76,6 +80,19 @@ class GaussianEMRestraint(object):
                against another one). Default is False.
         @param local Only consider density particles that are within the
                 specified model-density cutoff (experimental)
+        @param target_cache If True, read the target GMM from a binary
+               cache next to target_fn, creating it if it is missing or
+               out of date (see IMP.pmi.io.gmm.read_gmm())
+        @param target_cache_mmap If True, memory-map the target GMM cache
+               read-only, so that replicas on the same node share it
+        @param target_tolerance If set, use an
+               IMP.pmi.HierarchicalGaussianEMRestraint, which stores the
+               target Gaussians in a tree of merged Gaussians so that
+               distant model-target overlaps are approximated cheaply;
+               the score then differs from the exact one by at most
+               (approximately) this tolerance. The cutoffs, local and
+               close_pair_container are not used, and slope and
+               target_is_rigid_body are not supported.
         """
 
         # some parameters
@@ -89,6 +106,11 @@ class GaussianEMRestraint(object):
         self.densities = densities
         self.em_root_hier = None
 
+        if target_tolerance is not None and (slope != 0.0
+                                             or target_is_rigid_body):
+            raise ValueError("target_tolerance cannot be used with slope "
+                             "or target_is_rigid_body")
+
         # setup target GMM
         self.m = self.densities[0].get_model()
         if scale_target_to_mass:
@@ -101,12 +123,14 @@ class GaussianEMRestraint(object):
         if target_fn != '':
             self._set_dataset(target_fn, representation)
             self.target_ps = []
-            IMP.isd.gmm_tools.decorate_gmm_from_text(
+            IMP.pmi.io.gmm.decorate_gmm_from_text(
                 target_fn,
                 self.target_ps,
                 self.m,
                 radius_scale=target_radii_scale,
-                mass_scale=target_mass_scale)
+                mass_scale=target_mass_scale,
+                use_cache=target_cache,
+                mmap=target_cache_mmap)
         elif target_ps != []:
             self.target_ps = target_ps
         else:
@@ -152,15 +176,23 @@ class GaussianEMRestraint(object):
 
         update_model=not spherical_gaussians
         log_score=False
-        self.gaussianEM_restraint = IMP.isd.GaussianEMRestraint(
-            self.m,
-            IMP.get_indexes(self.model_ps),
-            IMP.get_indexes(self.target_ps),
-            self.sigmaglobal.get_particle().get_index(),
-            cutoff_dist_model_model,
-            cutoff_dist_model_data,
-            slope,
-            update_model, backbone_slope, local)
+        if target_tolerance is not None:
+            self.gaussianEM_restraint = \
+                IMP.pmi.HierarchicalGaussianEMRestraint(
+                    self.m,
+                    IMP.get_indexes(self.model_ps),
+                    IMP.get_indexes(self.target_ps),
+                    target_tolerance)
+        else:
+            self.gaussianEM_restraint = IMP.isd.GaussianEMRestraint(
+                self.m,
+                IMP.get_indexes(self.model_ps),
+                IMP.get_indexes(self.target_ps),
+                self.sigmaglobal.get_particle().get_index(),
+                cutoff_dist_model_model,
+                cutoff_dist_model_data,
+                slope,
+                update_model, backbone_slope, local)
 
         print('done EM setup')
         self.rs = IMP.RestraintSet(self.m, 'GaussianEMRestraint')
@@ -207,8 +239,14 @@ class GaussianEMRestraint(object):
         transformation = IMP.algebra.Transformation3D(IMP.algebra.Vector3D(-v))
         for p in self.target_ps:
             IMP.core.transform(IMP.core.RigidBody(p), transformation)
+        self._update_target()
         # IMP.pmi.tools.translate_hierarchies(self.densities,v)
 
+    def _update_target(self):
+        """Tell the restraint that the target Gaussians have moved"""
+        if hasattr(self.gaussianEM_restraint, 'update_target'):
+            self.gaussianEM_restraint.update_target()
+
     def get_center_of_mass(self, target=True):
         '''Returns the geometric center of the GMM particles
         @param target = True - returns target map gmm COM
@@ -237,6 +275,7 @@ class GaussianEMRestraint(object):
         transformation = IMP.algebra.Transformation3D(IMP.algebra.Vector3D(-v))
         for p in self.target_ps:
             IMP.core.transform(IMP.core.RigidBody(p), transformation)
+        self._update_target()
         # IMP.pmi.tools.translate_hierarchies(self.densities,v)
 
     def center_model_on_target_density(self, input_object):
@@ -23,7 +23,10 @@ class ElectronMicroscopy2D(object):
                  projection_number=None,
                  resolution=None,
                  n_components=1,
-                 hier=None):
+                 hier=None,
+                 use_projection_library=False,
+                 library_size=1000,
+                 image_cache=True):
         """Constructor.
         @param representation DEPRECATED, pass 'hier' instead
         @param images 2D class average filenames in PGM text format
@@ -38,9 +41,23 @@ class ElectronMicroscopy2D(object):
         @param n_components Number of the largest components to be
                considered for the EM image
         @param hier The root hierarchy for applying the restraint
+        @param use_projection_library If True, use an
+               IMP.pmi.ProjectionLibraryRestraint rather than an
+               IMP.em2d.PCAFitRestraint. Each rigid body is then projected
+               only once, along library_size directions, and projections
+               of the model are composited from these images, which is
+               much faster for large rigid bodies. The score is one minus
+               the best cross correlation, summed over the images.
+               n_components is not used in this case.
+        @param library_size Number of directions in the projection
+               library of each rigid body
+        @param image_cache If True (and use_projection_library is set),
+               read the images through a binary cache
+               (see IMP.pmi.io.images.read_image())
         """
 
-        import IMP.em2d
+        if not use_projection_library:
+            import IMP.em2d
 
         # check input
         if images is None:
@@ -85,7 +102,24 @@ class ElectronMicroscopy2D(object):
         # read PGM FORMAT images
         # format conversion recommendataion - first run "e2proc2d.py $FILE ${NEW_FILE}.pgm"
         # then, run "convert ${NEW_FILE}.pgm -compress none ${NEW_FILE2}.pgm"
-        if (n_components >= 2) :    # Number of the largest components to be considered for the EM image
+        if use_projection_library:
+            import IMP.pmi.io.images
+            data = [IMP.pmi.io.images.read_image(image, pixel_size,
+                                                 image_resolution,
+                                                 use_cache=image_cache)
+                    for image in images]
+            for d, image in zip(data, images):
+                if d.shape != data[0].shape:
+                    raise ValueError("EM2D: all images must have the same "
+                                     "size (%s is %dx%d, not %dx%d)"
+                                     % ((image,) + d.shape + data[0].shape))
+            em2d = IMP.pmi.ProjectionLibraryRestraint(
+                self.m, IMP.get_indexes(particles), data[0].shape[0],
+                data[0].shape[1], pixel_size, image_resolution,
+                projection_number, library_size)
+            for d in data:
+                em2d.add_image(d.ravel().tolist())
+        elif (n_components >= 2) :    # Number of the largest components to be considered for the EM image
             em2d = IMP.em2d.PCAFitRestraint(
                 particles, images, pixel_size, image_resolution, projection_number, True, n_components)
         else :
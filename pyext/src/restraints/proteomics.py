@@ -627,84 +627,9 @@ class SetupConnectivityNetworkRestraint(object):
         return output
 
 
-class ConnectivityNetworkRestraint(IMP.Restraint):
-
-    '''
-    a python restraint that computes the score for a composite of proteins
-    Authors: G. Bouvier, R. Pellarin. Pasteur Institute.
-    '''
-
-    import numpy
-    import math
-
-    def __init__(self, m, slope=1.0, theta=0.0, plateau=0.0000000001, linear_slope=0.015):
-        '''
-        input a list of particles, the slope and theta of the sigmoid potential
-        theta is the cutoff distance for a protein-protein contact
-        '''
-        IMP.Restraint.__init__(self, m, "ConnectivityNetworkRestraint %1%")
-        self.slope = slope
-        self.theta = theta
-        self.linear_slope = linear_slope
-        self.plateau = plateau
-        self.particles_blocks = []
-        self.particle_list = []
-
-    def get_number_of_particle_blocks(self):
-        return len(self.particles_blocks)
-
-    def get_number_of_particles_for_block(self, block_index):
-        return len(self.particles_blocks[block_index])
-
-    def add_particles(self, particles):
-        self.particles_blocks.append(particles)
-        self.particle_list += particles
-
-    def get_full_graph(self):
-        '''
-        get the full graph of distances between every particle pair
-        '''
-        import networkx
-        import scipy.spatial
-
-        pdist_array = self.numpy.array(
-            IMP.pmi.get_list_of_bipartite_minimum_sphere_distance(self.particles_blocks))
-        pdist_mat = scipy.spatial.distance.squareform(pdist_array)
-        pdist_mat[pdist_mat < 0] = 0
-        graph = networkx.Graph(pdist_mat)
-        return graph
-
-    def get_minimum_spanning_tree(self):
-        """
-        return the minimum spanning tree
-        """
-        import networkx
-        graph = self.get_full_graph()
-        graph = networkx.minimum_spanning_tree(graph)
-        return graph
-
-    def sigmoid(self, x):
-        '''
-        a sigmoid function that scores the probability of a contact
-        between two proteins
-        '''
-        # return 1 - (x)**self.slope/ float(((x)**self.slope +
-        # self.theta**self.slope))
-        argvalue = (x - self.theta) / self.slope
-        return 1.0 - (1.0 - self.plateau) / (1.0 + self.math.exp(-argvalue))
-
-    def unprotected_evaluate(self, da):
-        graph = self.get_minimum_spanning_tree()
-        score = 0.0
-        for e in graph.edges():
-            dist = graph.get_edge_data(*e)['weight']
-            prob = self.sigmoid(dist)
-            score += -self.numpy.log(prob)
-            score += self.linear_slope * dist
-        return score
-
-    def do_get_inputs(self):
-        return self.particle_list
+# The restraint is now implemented in C++; this name is kept for
+# scripts that create it directly
+ConnectivityNetworkRestraint = IMP.pmi.ConnectivityNetworkRestraint
 
 
 class SetupMembraneRestraint(object):
@@ -1002,95 +927,65 @@ class FuzzyBoolean(object):
         return op(FuzzyBoolean1.evaluate(), FuzzyBoolean2.evaluate())
 
 
-class FuzzyRestraint(IMP.Restraint):
+class FuzzyRestraint(IMP.pmi.FuzzyRestraint):
 
     '''
     Fully Ambiguous Restraint that can be built using boolean logic
+    (implemented in C++, with derivatives)
     R. Pellarin. Pasteur Institute.
     '''
-    import math
     plateau = 0.00000000000001
     theta = 5.0
     slope = 2.0
     innerslope = 0.01
-    import sys
 
     def __init__(self, m, p1, p2, operator=None):
         '''
         input a list of particles, the slope and theta of the sigmoid potential
         theta is the cutoff distance for a protein-protein contact
         '''
-        IMP.Restraint.__init__(self, m, "FuzzyRestraint %1%")
         self.m = m
-        self.min = self.sys.float_info.min
         if isinstance(p1, FuzzyRestraint) and isinstance(p2, FuzzyRestraint):
             self.operations = [p1, operator, p2]
             self.particle_pair = None
+            IMP.pmi.FuzzyRestraint.__init__(self, p1, p2, operator,
+                                            "FuzzyRestraint %1%")
         elif isinstance(p1, FuzzyRestraint) and p2 is None:
             self.operations = [p1, operator, None]
             self.particle_pair = None
+            IMP.pmi.FuzzyRestraint.__init__(self, p1, None, operator,
+                                            "FuzzyRestraint %1%")
         else:
             self.operations = []
             self.particle_pair = (p1, p2)
+            IMP.pmi.FuzzyRestraint.__init__(self, m, p1, p2, self.theta,
+                                            self.slope, self.plateau,
+                                            self.innerslope,
+                                            "FuzzyRestraint %1%")
 
     def __or__(self, FuzzyRestraint2):
-        return FuzzyRestraint(self.m, self, FuzzyRestraint2, self.or_)
+        return FuzzyRestraint(self.m, self, FuzzyRestraint2,
+                              IMP.pmi.FuzzyRestraint.OR_OPERATOR)
 
     def __and__(self, FuzzyRestraint2):
-        return FuzzyRestraint(self.m, self, FuzzyRestraint2, self.and_)
+        return FuzzyRestraint(self.m, self, FuzzyRestraint2,
+                              IMP.pmi.FuzzyRestraint.AND_OPERATOR)
 
     def __invert__(self):
-        return FuzzyRestraint(self.m, self, None, self.invert_)
-
-    def and_(self, a, b):
-        c = a + b
-        return c
-
-    def or_(self, a, b):
-        c = self.math.exp(-a) + self.math.exp(-b) - self.math.exp(-a - b)
-        return -self.math.log(c)
-
-    def invert_(self, a):
-        c = 1.0 - self.math.exp(-a)
-        return -self.math.log(c)
-
-    def evaluate(self):
-        if len(self.operations) == 0:
-            return self.distance()
-        FuzzyRestraint1, op, FuzzyRestraint2 = self.operations
-
-        if FuzzyRestraint2 is not None:
-            return op(FuzzyRestraint1.evaluate(), FuzzyRestraint2.evaluate())
-        else:
-            return op(FuzzyRestraint1.evaluate())
-
-    def distance(self):
-        d1 = IMP.core.XYZ(self.particle_pair[0])
-        d2 = IMP.core.XYZ(self.particle_pair[1])
-        d = IMP.core.get_distance(d1, d2)
-        argvalue = (d-self.theta)/self.slope
-        return -self.math.log(1.0 -(1.0-self.plateau)/(1.0+self.math.exp(-argvalue)))+self.innerslope*d
+        return FuzzyRestraint(self.m, self, None,
+                              IMP.pmi.FuzzyRestraint.NOT_OPERATOR)
 
     def add_to_model(self):
         IMP.pmi.tools.add_restraint_to_model(self.m, self)
 
-    def unprotected_evaluate(self, da):
-        return self.evaluate()
-
     def __str__(self):
         if len(self.operations) == 0:
             return str(self.particle_pair)
         FuzzyRestraint1, op, FuzzyRestraint2 = self.operations
+        opname = {IMP.pmi.FuzzyRestraint.AND_OPERATOR: "&",
+                  IMP.pmi.FuzzyRestraint.OR_OPERATOR: "|",
+                  IMP.pmi.FuzzyRestraint.NOT_OPERATOR: "~"}[op]
         if FuzzyRestraint2 is not None:
-            return str(FuzzyRestraint1) +str(op)+str(FuzzyRestraint2)
-        else:
-            return str(FuzzyRestraint1) +str(op)
-
-    def do_get_inputs(self):
-        if len(self.operations) == 0:
-            return list(self.particle_pair)
-        FuzzyRestraint1, op, FuzzyRestraint2 = self.operations
-        if FuzzyRestraint2 is not None:
-            return list(set(FuzzyRestraint1.do_get_inputs() +FuzzyRestraint2.do_get_inputs()))
+            return str(FuzzyRestraint1) + opname + str(FuzzyRestraint2)
         else:
-            return list(set(FuzzyRestraint1.do_get_inputs()))
+            return opname + str(FuzzyRestraint1)
@@ -14,6 +14,25 @@ import IMP.pmi.restraints
 import IMP.saxs
 
 
+def _golden_section_minimize(func, a, b, tolerance):
+    """Find a minimum of func within [a, b] by golden-section search"""
+    ratio = (math.sqrt(5.) - 1.) / 2.
+    c = b - ratio * (b - a)
+    d = a + ratio * (b - a)
+    fc = func(c)
+    fd = func(d)
+    while abs(b - a) > tolerance:
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = func(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = func(d)
+    return (a + b) / 2.
+
+
 class SAXSRestraint(IMP.pmi.restraints.RestraintBase):
 
     """Basic SAXS restraint."""
@@ -110,6 +129,8 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
         # take identity covariance matrix for the start
         self.cov = [[1 if i == j else 0 for j in range(self.prof.size())]
                     for i in range(self.prof.size())]
+        # c1, c2 and coordinates the covariance matrix was computed for
+        self._cov_parameters = None
 
         print("create saxs restraint")
         self.saxs = IMP.isd2.SAXSRestraint(self.prof, self.sigma, self.tau,
@@ -128,6 +149,7 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
         self.rs2.add_restraint(j1)
         j2 = IMP.isd.JeffreysRestraint(self.m, self.tau)
         self.rs2.add_restraint(j2)
+        self._tau_prior = j2
         j3 = IMP.isd.JeffreysRestraint(self.m, self.gamma)
         self.rs2.add_restraint(j3)
 
@@ -145,30 +167,54 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
                             self.saxs.get_loggamma_jOg_parameter())
         IMP.isd.Scale(self.gamma).set_scale(gammahat)
 
-    def optimize_tau(self, ltaumin=-2, ltaumax=3, npoints=100):
-        values = []
+    def _get_tau_score(self, tauval):
+        """Score of the terms that depend on tau, at the given tau"""
+        IMP.isd.Scale(self.tau).set_scale(tauval)
+        try:
+            return self.saxs.unprotected_evaluate(None) \
+                + self._tau_prior.unprotected_evaluate(None)
+        except Exception:
+            return float('inf')
+
+    def optimize_tau(self, ltaumin=-2, ltaumax=3, npoints=10,
+                     tolerance=1e-3, output_prefix=None):
+        """Set tau to the value that minimizes the SAXS score.
+        Only the SAXS restraint and the prior on tau are evaluated. Tau is
+        first scanned on a coarse grid to bracket the minimum, which is
+        then refined by golden-section search in log10(tau).
+        @param ltaumin Lower bound of log10(tau)
+        @param ltaumax Upper bound of log10(tau)
+        @param npoints Number of points in the coarse scan
+        @param tolerance Tolerance on log10(tau) of the refinement
+        @param output_prefix If given, write the structure to
+               output_prefix.pdb and the tau values tried, with their
+               scores, to output_prefix.txt
+        @return the optimal tau
+        """
         self.m.update()
-        IMP.atom.write_pdb(self.atoms, 'tauvals.pdb')
-        fl = open('tauvals.txt', 'w')
-        for tauval in self._logspace(ltaumin, ltaumax, npoints):
-            IMP.isd.Scale(self.tau).set_scale(tauval)
-            try:
-                values.append((self.m.evaluate(False), tauval))
-            except:
-                pass
-            fl.write('%G %G\n' % (values[-1][1], values[-1][0]))
-        values.sort()
-        ltcenter = math.log(values[0][1]) / math.log(10)
-        spacing = (ltaumax - ltaumin) / float(npoints)
         values = []
-        for tauval in self._logspace(
-            ltcenter - 2 * spacing, ltcenter + 2 * spacing,
-                npoints):
-            IMP.isd.Scale(self.tau).set_scale(tauval)
-            values.append((self.m.evaluate(False), tauval))
-            fl.write('%G %G\n' % (values[-1][1], values[-1][0]))
-        values.sort()
-        IMP.isd.Scale(self.tau).set_scale(values[0][1])
+
+        def score(ltau):
+            val = self._get_tau_score(10 ** ltau)
+            values.append((10 ** ltau, val))
+            return val
+
+        spacing = (ltaumax - ltaumin) / float(npoints - 1)
+        scan = [score(ltaumin + spacing * i) for i in range(npoints)]
+        best = min(range(npoints), key=lambda i: scan[i])
+        ltau = _golden_section_minimize(
+            score, max(ltaumin, ltaumin + spacing * (best - 1)),
+            min(ltaumax, ltaumin + spacing * (best + 1)), tolerance)
+        tauval = 10 ** ltau
+        if score(ltau) > scan[best]:
+            tauval = 10 ** (ltaumin + spacing * best)
+        IMP.isd.Scale(self.tau).set_scale(tauval)
+        if output_prefix is not None:
+            IMP.atom.write_pdb(self.atoms, output_prefix + '.pdb')
+            with open(output_prefix + '.txt', 'w') as fl:
+                for val in values:
+                    fl.write('%G %G\n' % val)
+        return tauval
 
     def get_gamma_value(self):
         """Get value of gamma."""
@@ -187,9 +233,25 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
         self.m.update()
         self.saxs.draw_gamma()
 
-    def update_covariance_matrix(self):
+    def update_covariance_matrix(self, tolerance=1e-4, force=False):
+        """Recompute the covariance matrix of the computed profile.
+        The matrix is only recomputed if c1 or c2 have changed by more
+        than tolerance, or any atom has moved by more than tolerance
+        angstroms, since it was last computed.
+        @param tolerance Tolerance on c1, c2 and the atom coordinates
+        @param force Recompute the matrix regardless of the tolerance
+        @return True if the matrix was recomputed
+        """
         c1 = IMP.isd.Nuisance(self.c1).get_nuisance()
         c2 = IMP.isd.Nuisance(self.c2).get_nuisance()
+        coords = [IMP.core.XYZ(p).get_coordinates() for p in self.atoms]
+        if not force and self._cov_parameters is not None:
+            old_c1, old_c2, old_coords = self._cov_parameters
+            if abs(c1 - old_c1) <= tolerance \
+                    and abs(c2 - old_c2) <= tolerance \
+                    and all(IMP.algebra.get_distance(a, b) <= tolerance
+                            for a, b in zip(coords, old_coords)):
+                return False
         # tau = IMP.isd.Nuisance(self.tau).get_nuisance()
         tau = 1.0
         self.cov = IMP.isd2.compute_relative_covariance(self.atoms, c1, c2,
@@ -198,6 +260,8 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
         #    for j in xrange(len(self.cov)):
         #        self.cov[i][j] = self.cov[i][j]/tau**2
         self.saxs.set_cov(0, self.cov)
+        self._cov_parameters = (c1, c2, coords)
+        return True
 
     def write_covariance_matrix(self, fname):
         fl = open(fname, 'w')
@@ -215,10 +279,3 @@ class SAXSISDRestraint(IMP.pmi.restraints.RestraintBase):
         output["SAXSISDRestraint_Gamma" +
                suffix] = str(self.gamma.get_scale())
         return output
-
-    @staticmethod
-    def _logspace(a, b, num=100):
-        """Mimick numpy's logspace function"""
-        for i in range(num):
-            val = a + float(b - a) / float(num - 1) * i
-            yield 10 ** val
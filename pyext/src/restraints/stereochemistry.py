@@ -11,6 +11,7 @@ import IMP.container
 import IMP.isd
 import itertools
 import IMP.pmi.tools
+from collections import defaultdict
 import IMP.pmi.representation
 from operator import itemgetter
 from math import pi,log,sqrt
@@ -52,6 +53,7 @@ class ConnectivityRestraint(object):
         self.kappa = 10  # spring constant used for the harmonic restraints
         self.m = list(hiers)[0].get_model()
         SortedSegments = []
+        self.particle_pairs = []
         self.rs = IMP.RestraintSet(self.m, "connectivity_restraint")
         for h in hiers:
             try:
@@ -124,6 +126,7 @@ class ConnectivityRestraint(object):
 
                 print("Adding sequence connectivity restraint between", pt0.get_name(), " and ", pt1.get_name(), 'of distance', optdist)
                 self.rs.add_restraint(r)
+                self.particle_pairs.append(IMP.ParticlePair(pt0, pt1))
 
     def set_label(self, label):
         self.label = label
@@ -153,6 +156,10 @@ class ConnectivityRestraint(object):
         """ Returns number of connectivity restraints """
         return len(self.rs.get_restraints())
 
+    def get_particle_pairs(self):
+        """ Returns the pairs of particles connected by this restraint """
+        return self.particle_pairs
+
     def evaluate(self):
         return self.weight * self.rs.unprotected_evaluate(None)
 
@@ -168,7 +175,10 @@ class ExcludedVolumeSphere(object):
                  included_objects=None,
                  other_objects=None,
                  resolution=1000,
-                 kappa=1.0):
+                 kappa=1.0,
+                 slack=None,
+                 exclude_overlapping=True,
+                 connectivity_restraints=None):
         """Constructor.
         @param representation DEPRECATED - just pass objects
         @param included_objects Can be one of the following inputs:
@@ -180,12 +190,28 @@ class ExcludedVolumeSphere(object):
                If a number is chosen, for each particle, the closest
                resolution will be used (see IMP.atom.Selection).
         @param kappa Restraint strength
+        @param slack Slack of the close pair container. If None, it is
+               set from the step sizes of the movers of the sampler passed
+               to set_slack_from_sampler() (10.0 until then, and always
+               for bipartite restraints).
+        @param exclude_overlapping If True, pairs of particles of the
+               same molecule that cover some of the same residues (i.e.
+               different representations of the same residues) are not
+               scored. Pairs of atoms are always scored.
+        @param connectivity_restraints A ConnectivityRestraint, or a list
+               of them. Pairs of particles that they connect are not
+               scored (see add_connectivity_restraints()).
+               Pairs of particles in the same rigid body are never scored.
         """
 
         self.weight = 1.0
         self.kappa = kappa
         self.label = "None"
         self.cpc = None
+        self.auto_slack = slack is None
+        self.slack = 10.0 if slack is None else slack
+        self.sampler = None
+        self._connectivity_restraints = []
         bipartite = False
 
         # gather IMP hierarchies from input objects
@@ -229,10 +255,12 @@ class ExcludedVolumeSphere(object):
         lsa = IMP.container.ListSingletonContainer(self.mdl)
         lsa.add(IMP.get_indexes(included_ps))
 
-        # setup close pair container
+        # setup close pair container; the rigid close pairs finder
+        # skips pairs within the same rigid body
+        rbcpf = IMP.core.RigidClosePairsFinder()
         if not bipartite:
-            rbcpf = IMP.core.RigidClosePairsFinder()
-            self.cpc = IMP.container.ClosePairContainer(lsa, 0.0, rbcpf, 10.0)
+            self.cpc = IMP.container.ClosePairContainer(lsa, 0.0, rbcpf,
+                                                        self.slack)
             evr = IMP.container.PairsRestraint(ssps, self.cpc)
         else:
             other_lsa = IMP.container.ListSingletonContainer(self.mdl)
@@ -241,10 +269,96 @@ class ExcludedVolumeSphere(object):
                 lsa,
                 other_lsa,
                 0.0,
-                10.0)
+                rbcpf,
+                self.slack)
             evr = IMP.container.PairsRestraint(ssps, self.cpc)
 
         self.rs.add_restraint(evr)
+        self.auto_slack = self.auto_slack and not bipartite
+
+        if exclude_overlapping:
+            if bipartite:
+                pairs = self._get_overlapping_pairs(included_ps + other_ps)
+            else:
+                pairs = self._get_overlapping_pairs(included_ps)
+            if pairs:
+                self.add_excluded_particle_pairs(pairs)
+        if connectivity_restraints is not None:
+            self.add_connectivity_restraints(connectivity_restraints)
+
+    @staticmethod
+    def _get_overlapping_pairs(particles):
+        """Get pairs of particles of the same molecule that cover some of
+           the same residues, other than pairs of atoms"""
+        by_molecule = defaultdict(list)
+        for p in particles:
+            h = IMP.atom.Hierarchy(p)
+            resinds = IMP.pmi.tools.get_residue_indexes(h)
+            mol = h.get_parent()
+            while mol and not IMP.atom.Molecule.get_is_setup(mol):
+                mol = mol.get_parent()
+            if not resinds or not mol:
+                continue
+            by_molecule[mol.get_particle_index()].append(
+                (min(resinds), max(resinds), IMP.atom.Atom.get_is_setup(p),
+                 p))
+        pairs = []
+        for beads in by_molecule.values():
+            beads.sort(key=lambda b: (b[0], b[1]))
+            for i, (start, end, is_atom, p) in enumerate(beads):
+                for start2, end2, is_atom2, p2 in beads[i + 1:]:
+                    if start2 > end:
+                        break
+                    if not (is_atom and is_atom2):
+                        pairs.append(IMP.ParticlePair(p, p2))
+        return pairs
+
+    def add_connectivity_restraints(self, connectivity_restraints):
+        """Do not score pairs of particles connected by the given
+        restraints. IMP.pmi.macros.ReplicaExchange0 calls this with all
+        ConnectivityRestraints it is given.
+        @param connectivity_restraints A ConnectivityRestraint, or a list
+               of them
+        """
+        if isinstance(connectivity_restraints, ConnectivityRestraint):
+            connectivity_restraints = [connectivity_restraints]
+        pairs = []
+        for cr in connectivity_restraints:
+            if cr in self._connectivity_restraints:
+                continue
+            self._connectivity_restraints.append(cr)
+            pairs += cr.get_particle_pairs()
+        if pairs:
+            self.add_excluded_particle_pairs(pairs)
+
+    def set_slack_from_sampler(self, sampler):
+        """Set the close pair container slack from the mover step sizes.
+        This has no effect if a slack was passed to the constructor.
+        The slack is updated as the step sizes adapt, each time
+        get_output() is called.
+        @param sampler An IMP.pmi.samplers.MonteCarlo object
+        """
+        self.sampler = sampler
+        self._update_slack()
+
+    def _update_slack(self):
+        if not self.auto_slack or self.sampler is None:
+            return
+        step = self.sampler.get_maximum_step_size()
+        if step is None:
+            return
+        # a rebuild is needed once a particle moves by half the slack;
+        # allow for about two maximal steps between rebuilds, and only
+        # change the slack (forcing a rebuild) if it changed noticeably
+        slack = max(4.0 * step, 1.0)
+        if abs(slack - self.slack) > 0.1 * self.slack:
+            self.slack = slack
+            self.cpc.set_slack(slack)
+
+    def get_number_of_close_pairs(self):
+        """Get the number of pairs currently in the close pair list"""
+        self.rs.evaluate(False)
+        return len(self.cpc.get_contents())
 
     def add_excluded_particle_pairs(self, excluded_particle_pairs):
         # add pairs to be filtered when calculating the score
@@ -272,6 +386,7 @@ class ExcludedVolumeSphere(object):
         score = self.weight * self.rs.unprotected_evaluate(None)
         output["_TotalScore"] = str(score)
         output["ExcludedVolumeSphere_" + self.label] = str(score)
+        self._update_slack()
         return output
 
     def evaluate(self):
@@ -889,11 +1004,14 @@ class ElasticNetworkRestraint(object):
 
         # create score
         self.rs = IMP.pmi.create_elastic_network(particles,dist_cutoff,strength)
-        for r in self.rs.get_restraints():
-            a1,a2 = r.get_inputs()
+        self.enr = IMP.pmi.ElasticNetworkRestraint.get_from(
+                                          self.rs.get_restraint(0))
+        for pi1,pi2 in self.enr.get_pairs():
+            a1 = self.m.get_particle(pi1)
+            a2 = self.m.get_particle(pi2)
             self.pairslist.append(IMP.ParticlePair(a1,a2))
             self.pairslist.append(IMP.ParticlePair(a2,a1))
-        print('ElasticNetwork: created',self.rs.get_number_of_restraints(),'restraints')
+        print('ElasticNetwork: created',self.enr.get_number_of_pairs(),'pairs')
 
     def set_label(self, label):
         self.label = label
@@ -914,6 +1032,10 @@ class ElasticNetworkRestraint(object):
     def get_excluded_pairs(self):
         return self.pairslist
 
+    def get_number_of_pairs(self):
+        """Get the number of restrained particle pairs"""
+        return self.enr.get_number_of_pairs()
+
     def get_output(self):
         self.m.update()
         output = {}
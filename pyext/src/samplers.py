@@ -4,8 +4,11 @@
 
 from __future__ import print_function
 import IMP
+import IMP.algebra
 import IMP.core
 from IMP.pmi.tools import get_restraint_set
+import collections
+import math
 
 class _SerialReplicaExchange(object):
     """Dummy replica exchange class used in non-MPI builds.
@@ -43,13 +46,20 @@ class MonteCarlo(object):
     except ImportError:
         isd_available = False
 
-    def __init__(self, m, objects=None, temp=1.0, filterbyname=None):
+    def __init__(self, m, objects=None, temp=1.0, filterbyname=None,
+                 score_moved=False):
         """Setup Monte Carlo sampling
         @param m             The IMP Model
         @param objects       What to sample. Use flat list of particles or
                (deprecated) 'MC Sample Objects' from PMI1
         @param temp The MC temperature
         @param filterbyname Not used
+        @param score_moved If True, use incremental scoring: after each
+               move only the restraints that depend on the moved particles
+               are re-evaluated (see IMP.core.IncrementalScoringFunction).
+               This is much faster for systems with many independently
+               moving parts, but requires that every restraint correctly
+               reports its input particles.
         """
         self.losp = [
             "Rigid_Bodies",
@@ -59,6 +69,10 @@ class MonteCarlo(object):
             "Weights"]
         self.simulated_annealing = False
         self.selfadaptive = False
+        self.adapt_structural = False
+        self.target_acceptance = 0.3
+        self.adaptive_window = 10
+        self.adaptive_nframes = None
         # that is -1 because mc has not yet run
         self.nframe = -1
         self.temp = temp
@@ -66,6 +80,7 @@ class MonteCarlo(object):
         self.mvslabels = []
         self.label = "None"
         self.m = m
+        self.score_moved = score_moved
 
         # check if using PMI1 or just passed a list of movers
         gather_objects = False
@@ -131,15 +146,38 @@ class MonteCarlo(object):
         self.smv = IMP.core.SerialMover(self.mvs)
 
         self.mc = IMP.core.MonteCarlo(self.m)
-        self.mc.set_scoring_function(get_restraint_set(self.m))
+        self._set_mc_scoring_function(get_restraint_set(self.m))
         self.mc.set_return_best(False)
         self.mc.set_kt(self.temp)
         self.mc.add_mover(self.smv)
 
+        self._adaptable_movers = [self._get_adaptable_mover(mv)
+                                  for mv in self.smv.get_movers()]
+        self._last_counts = [(0, 0)] * len(self._adaptable_movers)
+        self._window_acceptances = [0.0] * len(self._adaptable_movers)
+        self._ladder_index = None
+        self._step_sizes_by_index = {}
+        self._reset_acceptance_window()
+
     def set_kt(self, temp):
         self.temp = temp
         self.mc.set_kt(temp)
 
+    def set_ladder_index(self, index):
+        """Set the position of the current temperature in the replica
+           exchange ladder. If structural step sizes are adapted, a
+           separate set is kept for each position, so that replicas keep
+           suitable steps when they exchange temperatures."""
+        if (self.selfadaptive and self.adapt_structural
+                and self._ladder_index is not None
+                and index != self._ladder_index):
+            self._step_sizes_by_index[self._ladder_index] = \
+                self._get_step_sizes()
+            if index in self._step_sizes_by_index:
+                self._set_step_sizes(self._step_sizes_by_index[index])
+            self._reset_acceptance_window()
+        self._ladder_index = index
+
     def get_mc(self):
         return self.mc
 
@@ -147,8 +185,31 @@ class MonteCarlo(object):
         rs = IMP.RestraintSet(self.m, 1.0, 'sfo')
         for ob in objectlist:
             rs.add_restraint(ob.get_restraint())
-        sf = IMP.core.RestraintsScoringFunction([rs])
-        self.mc.set_scoring_function(sf)
+        self._set_mc_scoring_function(rs)
+
+    def _get_moved_particle_indexes(self):
+        """Get the indexes of all particles that the movers can change"""
+        pis = []
+        seen = set()
+        for mv in self.mvs:
+            for obj in mv.get_outputs():
+                try:
+                    p = IMP.Particle.get_from(obj)
+                except ValueError:
+                    continue
+                if p.get_index() not in seen:
+                    seen.add(p.get_index())
+                    pis.append(p.get_index())
+        return pis
+
+    def _set_mc_scoring_function(self, rs):
+        """Score with the given RestraintSet, incrementally if requested"""
+        if self.score_moved:
+            isf = IMP.core.IncrementalScoringFunction(
+                self.m, self._get_moved_particle_indexes(), [rs])
+            self.mc.set_incremental_scoring_function(isf)
+        else:
+            self.mc.set_scoring_function(rs)
 
     def set_simulated_annealing(
         self,
@@ -162,8 +223,137 @@ class MonteCarlo(object):
         self.timemin = min_temp_time
         self.timemax = max_temp_time
 
-    def set_self_adaptive(self, isselfadaptive=True):
+    def set_self_adaptive(self, isselfadaptive=True, target_acceptance=0.3,
+                          window=10, nframes=None, structural=False):
+        """Adapt the mover step sizes while sampling.
+        Nuisance and weight movers are tuned toward 40-60% acceptance.
+        If structural is True, rigid body, floppy body (BallMover) and
+        super rigid body (IMP.pmi.TransformMover) step sizes are also
+        scaled toward target_acceptance, using the acceptance observed
+        over the last `window` calls to optimize(). Under replica exchange
+        a separate set of step sizes is kept for each position in the
+        temperature ladder (see set_ladder_index()).
+        @param isselfadaptive Turn the adaptation on or off
+        @param target_acceptance Acceptance ratio for the structural movers
+        @param window Number of frames over which acceptance is measured
+        @param nframes If set, freeze the step sizes after this many
+               frames (burn-in), so that the rest of the sampling obeys
+               detailed balance
+        @param structural Also adapt the structural movers
+        """
         self.selfadaptive = isselfadaptive
+        self.adapt_structural = structural
+        self.target_acceptance = target_acceptance
+        self.adaptive_window = window
+        self.adaptive_nframes = nframes
+        self._reset_acceptance_window()
+
+    def get_is_adapting(self):
+        """Return True if step sizes are still being adapted"""
+        return self.selfadaptive and (self.adaptive_nframes is None
+                                      or self.nframe < self.adaptive_nframes)
+
+    @staticmethod
+    def _get_adaptable_mover(mv):
+        """Cast the mover to a type with adaptable step size, or None"""
+        for cls in (IMP.core.RigidBodyMover, IMP.core.BallMover,
+                    IMP.pmi.TransformMover):
+            try:
+                return cls.get_from(mv)
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def _get_mover_step_sizes(mv):
+        if isinstance(mv, IMP.core.BallMover):
+            return [mv.get_radius()]
+        else:
+            return [mv.get_maximum_translation(), mv.get_maximum_rotation()]
+
+    @staticmethod
+    def _set_mover_step_sizes(mv, steps):
+        # zero steps (e.g. rotation-only movers) are left alone
+        if isinstance(mv, IMP.core.BallMover):
+            if steps[0] > 0.:
+                mv.set_radius(steps[0])
+        else:
+            if steps[0] > 0.:
+                mv.set_maximum_translation(steps[0])
+            if steps[1] > 0.:
+                mv.set_maximum_rotation(min(steps[1], math.pi))
+
+    def _get_step_sizes(self):
+        return [None if mv is None else self._get_mover_step_sizes(mv)
+                for mv in self._adaptable_movers]
+
+    def _set_step_sizes(self, step_sizes):
+        for mv, steps in zip(self._adaptable_movers, step_sizes):
+            if mv is not None:
+                self._set_mover_step_sizes(mv, steps)
+
+    def _reset_acceptance_window(self):
+        self._acceptance_window = [
+            collections.deque(maxlen=self.adaptive_window)
+            for mv in self._adaptable_movers]
+
+    def _update_acceptance_window(self):
+        """Record the moves accepted and proposed since the last frame"""
+        for i, mv in enumerate(self.smv.get_movers()):
+            acc = mv.get_number_of_accepted()
+            prp = mv.get_number_of_proposed()
+            lastacc, lastprp = self._last_counts[i]
+            self._last_counts[i] = (acc, prp)
+            window = self._acceptance_window[i]
+            window.append((acc - lastacc, prp - lastprp))
+            nprp = sum(w[1] for w in window)
+            if nprp > 0:
+                self._window_acceptances[i] = \
+                    float(sum(w[0] for w in window)) / nprp
+
+    def _adapt_structural_movers(self):
+        """Scale step sizes of movers with a full acceptance window"""
+        for i, mv in enumerate(self._adaptable_movers):
+            window = self._acceptance_window[i]
+            if mv is None or len(window) < self.adaptive_window:
+                continue
+            factor = self._window_acceptances[i] / self.target_acceptance
+            factor = min(max(factor, 0.5), 2.0)
+            self._set_mover_step_sizes(
+                mv, [s * factor for s in self._get_mover_step_sizes(mv)])
+            window.clear()
+
+    def get_checkpoint(self):
+        """Get the sampler state needed to restart from a checkpoint"""
+        legacy_steps = {}
+        for i, mv in enumerate(self.smv.get_movers()):
+            name = mv.get_name()
+            if "Nuisances" in name:
+                legacy_steps[i] = IMP.core.NormalMover.get_from(mv).get_sigma()
+            elif "Weights" in name:
+                legacy_steps[i] = IMP.isd.WeightMover.get_from(mv).get_radius()
+        return {"nframe": self.nframe,
+                "temp": self.temp,
+                "step_sizes": self._get_step_sizes(),
+                "ladder_index": self._ladder_index,
+                "step_sizes_by_index": self._step_sizes_by_index,
+                "legacy_step_sizes": legacy_steps}
+
+    def restore_checkpoint(self, data):
+        """Restore a state returned by get_checkpoint()"""
+        self.nframe = data["nframe"]
+        self.temp = data["temp"]
+        self.mc.set_kt(self.temp)
+        self._set_step_sizes(data["step_sizes"])
+        self._ladder_index = data["ladder_index"]
+        self._step_sizes_by_index = data["step_sizes_by_index"]
+        movers = self.smv.get_movers()
+        for i, step in data["legacy_step_sizes"].items():
+            if "Nuisances" in movers[i].get_name():
+                IMP.core.NormalMover.get_from(movers[i]).set_sigma(step)
+            else:
+                IMP.isd.WeightMover.get_from(movers[i]).set_radius(step)
+        self._reset_acceptance_window()
 
     def get_nuisance_movers_parameters(self):
         '''
@@ -181,20 +371,63 @@ class MonteCarlo(object):
     def get_number_of_movers(self):
         return len(self.smv.get_movers())
 
+    @staticmethod
+    def _get_moved_coordinates(m, pis):
+        """Get the coordinates of the particles (and rigid body members)
+           moved along with the given particles"""
+        ret = []
+        for pi in pis:
+            if IMP.core.RigidBody.get_is_setup(m, pi):
+                ret += MonteCarlo._get_moved_coordinates(
+                    m, IMP.core.RigidBody(m, pi).get_member_particle_indexes())
+            elif IMP.core.XYZ.get_is_setup(m, pi):
+                ret.append(IMP.core.XYZ(m, pi).get_coordinates())
+        return ret
+
+    def _get_mover_diameter(self, mv):
+        """Get an upper bound on the size of the set of particles moved
+           by a mover, so that no particle moves by more than this times
+           the rotation angle when rotated about a point of the set"""
+        coords = self._get_moved_coordinates(
+            self.m, [p.get_index() for p in
+                     [IMP.Particle.get_from(o) for o in mv.get_inputs()]])
+        if len(coords) < 2:
+            return 0.
+        center = IMP.algebra.get_centroid(coords)
+        return 2. * max(IMP.algebra.get_distance(c, center) for c in coords)
+
+    def get_maximum_step_size(self):
+        """Get the largest distance a particle can currently move in one
+           step of the coordinate movers, or None if there are no such
+           movers. For rigid body movers this includes the rotation,
+           which moves particles far from the rotation center the most."""
+        steps = []
+        for mv in self._adaptable_movers:
+            if mv is None:
+                continue
+            step_sizes = self._get_mover_step_sizes(mv)
+            step = step_sizes[0]
+            if len(step_sizes) > 1 and step_sizes[1] > 0.:
+                step += step_sizes[1] * self._get_mover_diameter(mv)
+            steps.append(step)
+        return max(steps) if steps else None
+
     def get_particle_types():
         return self.losp
 
     def optimize(self, nstep):
         self.nframe += 1
         self.mc.optimize(nstep * self.get_number_of_movers())
+        self._update_acceptance_window()
 
         # apply simulated annealing protocol
         if self.simulated_annealing:
-            self.temp = self.temp_simulated_annealing()
-            self.mc.set_kt(self.temp)
+            self.set_kt(self.temp_simulated_annealing())
 
         # apply self adaptive protocol
-        if self.selfadaptive:
+        if self.get_is_adapting():
+            if self.adapt_structural:
+                self._adapt_structural_movers()
             for i, mv in enumerate(self.smv.get_movers()):
                 name = mv.get_name()
 
@@ -351,6 +584,16 @@ class MonteCarlo(object):
                 mvacr = 0.0
             output["MonteCarlo_Acceptance_" +
                    mvname + "_" + str(i)] = str(mvacr)
+            output["MonteCarlo_WindowAcceptance_" +
+                   mvname + "_" + str(i)] = str(self._window_acceptances[i])
+            amv = self._adaptable_movers[i]
+            if amv is not None:
+                steps = self._get_mover_step_sizes(amv)
+                output["MonteCarlo_StepSize_" + mvname + "_" +
+                       str(i)] = str(steps[0])
+                if len(steps) > 1:
+                    output["MonteCarlo_RotationStepSize_" + mvname + "_" +
+                           str(i)] = str(steps[1])
             if "Nuisances" in mvname:
                 output["MonteCarlo_StepSize_" + mvname + "_" +
                        str(i)] = str(IMP.core.NormalMover.get_from(mv).get_sigma())
@@ -426,6 +669,14 @@ class MolecularDynamics(object):
             self.set_kt(self.temp)
         self.md.optimize(nsteps)
 
+    def get_checkpoint(self):
+        """Get the sampler state needed to restart from a checkpoint"""
+        return {"nframe": self.nframe}
+
+    def restore_checkpoint(self, data):
+        """Restore a state returned by get_checkpoint()"""
+        self.nframe = data["nframe"]
+
     def get_output(self):
         output={}
         output["MolecularDynamics_KineticEnergy"]=str(self.md.get_kinetic_energy())
@@ -521,28 +772,157 @@ class ReplicaExchange(object):
         myindex = self.rem.get_my_index()
         # set initial value of the parameter (temperature) to exchange
         self.rem.set_my_parameter("temp", [self.temperatures[myindex]])
-        for so in self.samplerobjects:
-            so.set_kt(self.temperatures[myindex])
+        self._set_sampler_temperature(self.temperatures[myindex], myindex)
         self.nattempts = 0
         self.nmintemp = 0
         self.nmaxtemp = 0
         self.nsuccess = 0
 
+        # per neighbour-pair swap statistics; pair k is between
+        # temperatures k and k+1 of the ladder
+        self.npairs = max(nproc - 1, 0)
+        self.pair_attempts = [0] * self.npairs
+        self.pair_successes = [0] * self.npairs
+        # round trips between the lowest and highest temperatures; the
+        # direction is "up" after visiting the lowest temperature and
+        # "down" after visiting the highest one
+        self.direction = None
+        self.round_trip_start = None
+        self.round_trip_times = []
+        self.nup = [0] * nproc
+        self.ndown = [0] * nproc
+        self.ladder_optimization = None
+        self.ladder_nframes = 0
+        self.ladder_update_interval = 0
+
     def get_temperatures(self):
         return self.temperatures
 
+    def _set_sampler_temperature(self, temp, index):
+        """Set the temperature, and its position in the ladder, of all
+           sampler objects"""
+        for so in self.samplerobjects:
+            so.set_kt(temp)
+            set_ladder_index = getattr(so, "set_ladder_index", None)
+            if set_ladder_index is not None:
+                set_ladder_index(index)
+
+    def set_ladder_optimization(self, mode="uniform", nframes=1000,
+                                update_interval=100):
+        """Optimize the temperature ladder during a warm-up phase.
+        Every update_interval frames, swap statistics are gathered from
+        all replicas and the intermediate temperatures are moved (the
+        minimum and maximum are kept fixed). Needs mpi4py when running
+        in parallel.
+        @param mode "uniform" to equalize the swap acceptance of all
+               neighbouring pairs, or "round_trip" to maximize the rate of
+               round trips between the extreme temperatures (feedback
+               optimization of Katzgraber et al., J Stat Mech 2006)
+        @param nframes Length of the warm-up phase; the ladder is fixed
+               afterwards
+        @param update_interval Number of frames between ladder updates
+        """
+        if mode not in ("uniform", "round_trip"):
+            raise ValueError("Ladder optimization mode must be 'uniform' "
+                             "or 'round_trip', not %s" % mode)
+        self.ladder_optimization = mode
+        self.ladder_nframes = nframes
+        self.ladder_update_interval = update_interval
+
+    _checkpoint_attributes = ("temperatures", "nattempts", "nmintemp",
+                              "nmaxtemp", "nsuccess", "pair_attempts",
+                              "pair_successes", "direction",
+                              "round_trip_start", "round_trip_times",
+                              "nup", "ndown")
+
+    def get_checkpoint(self):
+        """Get the replica exchange state needed to restart from a
+           checkpoint"""
+        return dict((a, getattr(self, a)) for a in self._checkpoint_attributes)
+
+    def restore_checkpoint(self, data):
+        """Restore a state returned by get_checkpoint().
+           The temperature is set from the (possibly optimized) ladder
+           at the current temperature index."""
+        myindex = self.get_my_temperature_index()
+        for a in self._checkpoint_attributes:
+            setattr(self, a, data[a])
+        temp = self.temperatures[myindex]
+        self.rem.set_my_parameter("temp", [temp])
+        self._set_sampler_temperature(temp, myindex)
+
+    def _get_temperature_index(self, temp):
+        """Get the position of the given temperature in the ladder"""
+        return min(range(len(self.temperatures)),
+                   key=lambda i: abs(self.temperatures[i] - temp))
+
+    def _gather_ladder_statistics(self):
+        """Sum swap and round-trip statistics over all replicas"""
+        stats = [self.pair_attempts, self.pair_successes,
+                 self.nup, self.ndown]
+        if self.rem.get_number_of_replicas() == 1:
+            return stats
+        from mpi4py import MPI
+        allstats = MPI.COMM_WORLD.allgather(stats)
+        return [[sum(vals) for vals in zip(*[s[n] for s in allstats])]
+                for n in range(len(stats))]
+
+    def _update_ladder(self):
+        """Move the intermediate temperatures using gathered statistics"""
+        attempts, successes, nup, ndown = self._gather_ladder_statistics()
+        if self.ladder_optimization == "uniform":
+            temps = _get_uniform_acceptance_ladder(
+                self.temperatures, attempts, successes)
+        else:
+            temps = _get_round_trip_ladder(self.temperatures, nup, ndown)
+        self.pair_attempts = [0] * self.npairs
+        self.pair_successes = [0] * self.npairs
+        self.nup = [0] * len(self.temperatures)
+        self.ndown = [0] * len(self.temperatures)
+        if temps is None:
+            return
+        myindex = self.get_my_temperature_index()
+        self.temperatures = temps
+        self.rem.set_my_parameter("temp", [temps[myindex]])
+        self._set_sampler_temperature(temps[myindex], myindex)
+
+    def _update_round_trips(self, nframe, myindex):
+        if myindex == 0:
+            if self.direction == "down":
+                self.round_trip_times.append(nframe - self.round_trip_start)
+            if self.direction != "up":
+                self.round_trip_start = nframe
+            self.direction = "up"
+        elif myindex == len(self.temperatures) - 1:
+            if self.direction == "up":
+                self.direction = "down"
+        if self.direction == "up":
+            self.nup[myindex] += 1
+        elif self.direction == "down":
+            self.ndown[myindex] += 1
+
     def get_my_temp(self):
         return self.rem.get_my_parameter("temp")[0]
 
     def get_my_index(self):
         return self.rem.get_my_index()
 
+    def get_my_temperature_index(self):
+        """Get the position of this replica's temperature in the ladder"""
+        return self._get_temperature_index(self.get_my_temp())
+
     def swap_temp(self, nframe, score=None):
         if score is None:
             score = self.m.evaluate(False)
+        if (self.ladder_optimization and self.npairs > 1
+                and 0 < nframe <= self.ladder_nframes
+                and nframe % self.ladder_update_interval == 0):
+            self._update_ladder()
         # get my replica index and temperature
         myindex = self.rem.get_my_index()
         mytemp = self.rem.get_my_parameter("temp")[0]
+        mytempindex = self._get_temperature_index(mytemp)
+        self._update_round_trips(nframe, mytempindex)
 
         if mytemp == self.TEMPMIN_:
             self.nmintemp += 1
@@ -563,10 +943,15 @@ class ReplicaExchange(object):
         flag = self.rem.do_exchange(myscore, fscore, findex)
 
         self.nattempts += 1
+        ftempindex = self._get_temperature_index(ftemp)
+        if ftempindex != mytempindex:
+            pair = min(mytempindex, ftempindex)
+            self.pair_attempts[pair] += 1
+            if flag:
+                self.pair_successes[pair] += 1
         # if accepted, change temperature
         if (flag):
-            for so in self.samplerobjects:
-                so.set_kt(ftemp)
+            self._set_sampler_temperature(ftemp, ftempindex)
             self.nsuccess += 1
 
     def get_output(self):
@@ -584,9 +969,78 @@ class ReplicaExchange(object):
             output["ReplicaExchange_MinTempFrequency"] = str(0)
             output["ReplicaExchange_MaxTempFrequency"] = str(0)
         output["ReplicaExchange_CurrentTemp"] = str(self.get_my_temp())
+        for k in range(self.npairs):
+            if self.pair_attempts[k] != 0:
+                ratio = float(self.pair_successes[k]) / self.pair_attempts[k]
+            else:
+                ratio = 0.
+            output["ReplicaExchange_PairSwapSuccessRatio_%d" % k] = str(ratio)
+        output["ReplicaExchange_Temperatures"] = str(list(self.temperatures))
+        output["ReplicaExchange_NumberOfRoundTrips"] = str(
+            len(self.round_trip_times))
+        if self.round_trip_times:
+            output["ReplicaExchange_MeanRoundTripTime"] = str(
+                float(sum(self.round_trip_times)) / len(self.round_trip_times))
+        else:
+            output["ReplicaExchange_MeanRoundTripTime"] = str(0)
         return output
 
 
+def _get_ladder_from_weights(ladder, weights):
+    """Place len(ladder) points so that each new interval holds the same
+       share of the total weight. weights[k] is the weight of the interval
+       between ladder[k] and ladder[k+1], assumed uniform within it."""
+    total = float(sum(weights))
+    n = len(ladder)
+    newladder = [ladder[0]]
+    k = 0
+    cumulative = 0.
+    for i in range(1, n - 1):
+        target = total * i / (n - 1)
+        while k < len(weights) - 1 and cumulative + weights[k] < target:
+            cumulative += weights[k]
+            k += 1
+        fraction = (target - cumulative) / weights[k]
+        newladder.append(ladder[k] + fraction * (ladder[k + 1] - ladder[k]))
+    newladder.append(ladder[-1])
+    return newladder
+
+
+def _get_uniform_acceptance_ladder(temperatures, attempts, successes,
+                                   min_acceptance=1e-3):
+    """Get a ladder that equalizes swap acceptance between neighbours.
+       Each interval is weighted by -ln(acceptance) on a logarithmic
+       temperature scale. Return None if some pair was never attempted."""
+    if 0 in attempts:
+        return None
+    weights = []
+    for natt, nsucc in zip(attempts, successes):
+        accept = float(nsucc) / natt
+        accept = min(max(accept, min_acceptance), 1. - min_acceptance)
+        weights.append(-math.log(accept))
+    logtemps = _get_ladder_from_weights(
+        [math.log(t) for t in temperatures], weights)
+    # keep the endpoints exact; they are compared with TEMPMIN_ and TEMPMAX_
+    return ([temperatures[0]] + [math.exp(t) for t in logtemps[1:-1]]
+            + [temperatures[-1]])
+
+
+def _get_round_trip_ladder(temperatures, nup, ndown, min_df=1e-3):
+    """Get a ladder that maximizes the round-trip rate.
+       f(T), the fraction of replicas at T that last visited the lowest
+       temperature, should fall linearly along the ladder; the optimal
+       density of temperatures in each interval is proportional to
+       sqrt(df/dT / dT). Return None if some temperature has no data."""
+    fractions = []
+    for up, down in zip(nup, ndown):
+        if up + down == 0:
+            return None
+        fractions.append(float(up) / (up + down))
+    weights = [math.sqrt(max(f0 - f1, min_df))
+               for f0, f1 in zip(fractions[:-1], fractions[1:])]
+    return _get_ladder_from_weights(temperatures, weights)
+
+
 class PyMCMover(object):
     # only works if the sampled particles are rigid bodies
 
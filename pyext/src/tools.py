@@ -1081,6 +1081,118 @@ def get_residue_to_particle_map(particles):
                           for p in particles]
     return dict(zip(particles_residues, particles))
 
+
+class ResidueParticleIndex(object):
+    """Map (state, molecule, copy, residue, resolution) to particles.
+
+    Restraints built from many residue pairs (e.g. cross-links) would
+    otherwise do one IMP.atom.Selection per residue. Here the particles of
+    each molecule are selected once per resolution (or atom type) and
+    indexed by the residues they contain, so each lookup is a dictionary
+    access. Indexes are built on first use and kept, so a single object
+    can be shared by several restraints on the same hierarchy.
+    """
+
+    def __init__(self, root_hier=None, representations=None):
+        """Constructor.
+        @param root_hier The canonical PMI2 hierarchy containing all states
+        @param representations DEPRECATED list of PMI1
+               IMP.pmi.representation.Representation objects, one per state
+        """
+        if root_hier is None and representations is None:
+            raise ValueError("You must pass either root_hier or "
+                             "representations")
+        self.root_hier = root_hier
+        if representations is not None and type(representations) != list:
+            representations = [representations]
+        self.representations = representations
+        self._molecules = None
+        self._indexes = {}
+
+    def _get_molecules(self):
+        """Get (state index, molecule name, copy index, hierarchy) tuples"""
+        if self._molecules is None:
+            self._molecules = []
+            states = IMP.atom.get_by_type(self.root_hier, IMP.atom.STATE_TYPE)
+            if len(states) == 0:
+                states = [self.root_hier]
+            for s in states:
+                if IMP.atom.State.get_is_setup(s):
+                    nstate = IMP.atom.State(s).get_state_index()
+                else:
+                    nstate = 0
+                for mol in IMP.atom.get_by_type(s, IMP.atom.MOLECULE_TYPE):
+                    if IMP.atom.Copy.get_is_setup(mol):
+                        ncopy = IMP.atom.Copy(mol).get_copy_index()
+                    else:
+                        ncopy = 0
+                    self._molecules.append((nstate, mol.get_name(), ncopy,
+                                            IMP.atom.Hierarchy(mol)))
+        return self._molecules
+
+    def _build_index(self, resolution, atom_type):
+        index = defaultdict(list)
+        if self.representations is not None:
+            for nstate, r in enumerate(self.representations):
+                if resolution is None:
+                    allowed = None
+                else:
+                    allowed = set()
+                    for h in r.get_hierarchies_at_given_resolution(resolution):
+                        allowed.update(p.get_particle()
+                                       for p in IMP.atom.get_leaves(h))
+                for name in r.hier_dict:
+                    for h in IMP.atom.get_leaves(r.hier_dict[name]):
+                        p = h.get_particle()
+                        if allowed is not None and p not in allowed:
+                            continue
+                        for ri in get_residue_indexes(h):
+                            index[(nstate, name, 0, ri)].append(p)
+        else:
+            for nstate, name, ncopy, mol in self._get_molecules():
+                if atom_type is not None:
+                    sel = IMP.atom.Selection(
+                        mol, atom_type=IMP.atom.AtomType(atom_type))
+                else:
+                    sel = IMP.atom.Selection(mol, resolution=resolution)
+                for p in sel.get_selected_particles():
+                    for ri in get_residue_indexes(p):
+                        index[(nstate, name, ncopy, ri)].append(p)
+        return index
+
+    def get_particles(self, state_index, molecule, residue_index,
+                      copy_index=None, resolution=None, atom_type=None):
+        """Get the particles containing a given residue.
+        @param state_index The state index
+        @param molecule The molecule name
+        @param residue_index The residue index
+        @param copy_index The copy index. If None, particles from all
+               copies of the molecule are returned.
+        @param resolution The representation resolution
+        @param atom_type Select atoms of this type (e.g. "CA")
+               instead of a resolution (PMI2 hierarchies only)
+        @return a list of IMP.Particle objects
+        """
+        key = (resolution, atom_type)
+        if key not in self._indexes:
+            self._indexes[key] = self._build_index(resolution, atom_type)
+        index = self._indexes[key]
+        if copy_index is not None:
+            return list(index.get((state_index, molecule, copy_index,
+                                   residue_index), []))
+        ps = []
+        for ncopy in self.get_copy_indexes(state_index, molecule):
+            ps += index.get((state_index, molecule, ncopy, residue_index), [])
+        return ps
+
+    def get_copy_indexes(self, state_index, molecule):
+        """Get the copy indexes of a molecule in a given state"""
+        if self.representations is not None:
+            return [0]
+        return sorted(set(ncopy for nstate, name, ncopy, mol
+                          in self._get_molecules()
+                          if nstate == state_index and name == molecule))
+
 #
 # Parallel Computation
 #
@@ -1491,6 +1603,32 @@ def set_coordinates_from_rmf(hier,rmf_fn,frame_num=0):
     IMP.rmf.load_frame(rh, RMF.FrameID(frame_num))
     del rh
 
+def get_optimized_attributes(model):
+    """Get the values of all optimized float attributes in the model.
+    These are the coordinates and orientations of everything that is
+    sampled, plus nuisances and weights, so they are enough to restore the
+    sampled state of the system with set_optimized_attributes().
+    @param model The IMP Model
+    @return a list of (particle index, key index, value) tuples
+    """
+    values = []
+    for pi in model.get_particle_indexes():
+        p = model.get_particle(pi)
+        for k in p.get_float_keys():
+            if p.get_is_optimized(k):
+                values.append((pi.get_index(), k.get_index(), p.get_value(k)))
+    return values
+
+def set_optimized_attributes(model, values):
+    """Restore float attributes saved by get_optimized_attributes().
+    The Model is updated afterwards, so that constrained particles
+    (e.g. rigid body members) follow.
+    """
+    for pi, ki, value in values:
+        model.get_particle(IMP.ParticleIndex(pi)).set_value(IMP.FloatKey(ki),
+                                                            value)
+    model.update()
+
 def input_adaptor(stuff,
                   pmi_resolution=0,
                   flatten=False,
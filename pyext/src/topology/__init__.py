@@ -25,11 +25,11 @@ import IMP.pmi
 import IMP.pmi.tools
 import csv
 import os
+import numpy as np
 from collections import defaultdict
 from . import system_tools
-from bisect import bisect_left
+from . import build_cache
 from math import pi,cos,sin
-from operator import itemgetter
 
 def _build_ideal_helix(mdl, residues, coord_finder):
     """Creates an ideal helix from the specified residue range
@@ -102,11 +102,27 @@ class _SystemBase(object):
 
 class System(_SystemBase):
     """This class initializes the root node of the global IMP.atom.Hierarchy."""
-    def __init__(self,mdl=None,name="System"):
+    def __init__(self,mdl=None,name="System",build_cache_file=None):
+        """Constructor.
+        @param mdl The IMP Model (a new one is created if None)
+        @param name The name of the root hierarchy
+        @param build_cache_file If given, an RMF file used to cache the built
+               hierarchy (see IMP::pmi::topology::build_cache). If it holds
+               a hierarchy built from the same inputs, build() reads it
+               instead, and add_structure() does not read PDB files.
+               Otherwise build() writes it. When running with MPI,
+               only rank 0 builds; the other ranks read its cache.
+        """
         _SystemBase.__init__(self,mdl)
         self._number_of_states = 0
         self.states = []
         self.built=False
+        self._build_cache_file = build_cache_file
+        self._build_cache_structures = {}
+        if build_cache_file is not None:
+            metadata = build_cache.read_metadata(build_cache_file)
+            if metadata is not None:
+                self._build_cache_structures = metadata['structures']
 
         # the root hierarchy node
         self.hier=self._create_hierarchy()
@@ -132,14 +148,100 @@ class System(_SystemBase):
     def get_hierarchy(self):
         return self.hier
 
-    def build(self,**kwargs):
-        """call build on all states"""
+    def build(self,gmm_store=None,gmm_processes=1,**kwargs):
+        """call build on all states
+        @param gmm_store If given, a directory used as a content-addressed
+               store of the GMMs fitted for density representations
+               (see IMP::pmi::io::gmm::fit_gmms). A GMM is only fitted if
+               the store has no fit to the same coordinates, so changing
+               one domain only refits that domain. An existing
+               density_prefix file is still read, unless
+               density_force_compute is set.
+        @param gmm_processes Number of processes used to fit the GMMs
+               missing from gmm_store
+        """
         if not self.built:
-            for state in self.states:
-                state.build(**kwargs)
+            if self._build_cache_file is None:
+                self._build_states(gmm_store,gmm_processes,**kwargs)
+            else:
+                self._build_with_cache(gmm_store,gmm_processes,**kwargs)
+            # all structures were copied into the molecules by now
+            system_tools.clear_structure_cache(self.mdl)
             self.built=True
         return self.hier
 
+    def _build_states(self,gmm_store,gmm_processes,**kwargs):
+        if gmm_store is not None:
+            # fit all GMMs at once, so that they can be fitted in parallel
+            fits = []
+            for state in self.states:
+                for copies in state.get_molecules().values():
+                    for mol in copies:
+                        for rep in mol.representations:
+                            # ideal helices only get coordinates when built,
+                            # and existing density_prefix files are read
+                            if rep.density_residues_per_component \
+                               and all(r.get_has_structure() for r in rep.residues) \
+                               and (rep.density_force_compute or not
+                                    os.path.exists(rep.density_prefix+'.txt')):
+                                fits.append(system_tools.get_density_fit(rep))
+            if len(fits)>0:
+                import IMP.pmi.io.gmm
+                IMP.pmi.io.gmm.fit_gmms(fits,gmm_store,gmm_processes)
+        for state in self.states:
+            state.build(gmm_store=gmm_store,**kwargs)
+
+    def _get_cached_structure(self,key):
+        """Get the residues read by an add_structure() call from the
+        build cache, as a list of (index, residue type name), or None"""
+        return self._build_cache_structures.get(key)
+
+    def _build_with_cache(self,gmm_store,gmm_processes,**kwargs):
+        try:
+            from mpi4py import MPI
+            comm = MPI.COMM_WORLD
+            rank = comm.Get_rank()
+        except ImportError:
+            comm = None
+            rank = 0
+        fingerprint = build_cache.get_fingerprint(self)
+        if rank == 0:
+            metadata = build_cache.read_metadata(self._build_cache_file)
+            cached = metadata is not None \
+                     and metadata['fingerprint'] == fingerprint
+        if comm is not None:
+            # all ranks must agree, even if the cache is written meanwhile
+            cached = comm.bcast(cached if rank == 0 else None, root=0)
+        if not cached and rank == 0:
+            for state in self.states:
+                for copies in state.get_molecules().values():
+                    for mol in copies:
+                        mol._read_deferred_structures()
+            self._build_states(gmm_store,gmm_processes,**kwargs)
+            print('writing build cache', self._build_cache_file)
+            build_cache.write(self._build_cache_file, self)
+        if comm is not None:
+            comm.Barrier()
+        if cached or rank != 0:
+            print('reading build cache', self._build_cache_file)
+            self._set_built_hierarchy(
+                build_cache.read_hierarchy(self._build_cache_file, self.mdl))
+
+    def _set_built_hierarchy(self,hier):
+        """Replace the (unbuilt) hierarchy with one read from the cache"""
+        IMP.atom.destroy(self.hier)
+        self.hier = hier
+        for state, state_hier in zip(self.states, hier.get_children()):
+            state.hier = state_hier
+            mol_hiers = {}
+            for mol_hier in state_hier.get_children():
+                copy_index = IMP.atom.Copy(mol_hier).get_copy_index()
+                mol_hiers[mol_hier.get_name(), copy_index] = mol_hier
+            for molname, copies in state.get_molecules().items():
+                for copy_index, mol in enumerate(copies):
+                    mol._set_built_hierarchy(mol_hiers[molname, copy_index])
+            state.built = True
+
 #------------------------
 
 class State(_SystemBase):
@@ -251,6 +353,8 @@ class Molecule(_SystemBase):
         self._represented = IMP.pmi.tools.OrderedSet()   # residues with representation
         self.coord_finder = _FindCloseStructure() # helps you place beads by storing structure
         self._ideal_helices = [] # list of OrderedSets of tempresidues set to ideal helix
+        self._structures = [] # build cache key and residues of each add_structure call
+        self._deferred_structures = [] # add_structure calls answered by the build cache
 
         # create root node and set it as child to passed parent hierarchy
         self.hier = self._create_child(self.state.get_hierarchy())
@@ -372,17 +476,33 @@ class Molecule(_SystemBase):
 
         self.pdb_fn = pdb_fn
 
-        # get IMP.atom.Residues from the pdb file
-        rhs = system_tools.get_structure(self.mdl,pdb_fn,chain_id,res_range,offset,ca_only=ca_only)
-        self.coord_finder.add_residues(rhs)
+        # if the build cache knows which residues this reads, reading the
+        # pdb file is left to build(), and only needed if the cache is stale
+        cached = None
+        if self.state.system._build_cache_file is not None:
+            key = build_cache.get_structure_key(pdb_fn,chain_id,res_range,offset,
+                                                model_num,ca_only,soft_check,
+                                                self.sequence)
+            cached = self.state.system._get_cached_structure(key)
+        if cached is None:
+            # get IMP.atom.Residues from the pdb file
+            rhs = system_tools.get_structure(self.mdl,pdb_fn,chain_id,res_range,offset,ca_only=ca_only)
+            self.coord_finder.add_residues(rhs)
+            residues = [(rh.get_index(),rh.get_residue_type(),rh) for rh in rhs]
+        else:
+            self._deferred_structures.append((pdb_fn,chain_id,res_range,offset,
+                                              ca_only,soft_check))
+            residues = [(idx,IMP.atom.ResidueType(rtype),None) for idx,rtype in cached]
+        if self.state.system._build_cache_file is not None:
+            self._structures.append((key,[(idx,rtype.get_string())
+                                          for idx,rtype,rh in residues]))
 
         if len(self.residues)==0:
             print("WARNING: Extracting sequence from structure. Potentially dangerous.")
 
         # load those into TempResidue object
         atomic_res = IMP.pmi.tools.OrderedSet() # collect integer indexes of atomic residues to return
-        for nrh,rh in enumerate(rhs):
-            pdb_idx = rh.get_index()
+        for pdb_idx,rtype,rh in residues:
             raw_idx = pdb_idx - 1
 
             # add ALA to fill in gaps
@@ -393,11 +513,24 @@ class Molecule(_SystemBase):
 
             internal_res = self.residues[raw_idx]
             if len(self.sequence)<raw_idx:
-                self.sequence += IMP.atom.get_one_letter_code(rh.get_residue_type())
-            internal_res.set_structure(rh,soft_check)
+                self.sequence += IMP.atom.get_one_letter_code(rtype)
+            if rh is None:
+                internal_res.set_structure_type(rtype,soft_check)
+            else:
+                internal_res.set_structure(rh,soft_check)
             atomic_res.add(internal_res)
         return atomic_res
 
+    def _read_deferred_structures(self):
+        """Read the pdb files skipped by add_structure() because the build
+        cache had their residues, when the cache turns out to be stale"""
+        for pdb_fn,chain_id,res_range,offset,ca_only,soft_check in self._deferred_structures:
+            rhs = system_tools.get_structure(self.mdl,pdb_fn,chain_id,res_range,offset,ca_only=ca_only)
+            self.coord_finder.add_residues(rhs)
+            for rh in rhs:
+                self.residues[rh.get_index()-1].set_structure(rh,soft_check)
+        self._deferred_structures = []
+
     def add_representation(self,
                            residues=None,
                            resolutions=[],
@@ -547,10 +680,12 @@ class Molecule(_SystemBase):
                                                     ideal_helix,
                                                     color))
 
-    def build(self):
+    def build(self,gmm_store=None):
         """Create all parts of the IMP hierarchy
         including Atoms, Residues, and Fragments/Representations and, finally, Copies
         Will only build requested representations.
+        @param gmm_store If given, a directory used as a content-addressed
+               store of fitted GMMs (see System.build())
         /note Any residues assigned a resolution must have an IMP.atom.Residue hierarchy
               containing at least a CAlpha. For missing residues, these can be constructed
               from the PDB file
@@ -596,8 +731,12 @@ class Molecule(_SystemBase):
 
             # build all the representations
             built_reps = []
+            res_hiers = {}
             for rep in self.representations:
-                built_reps += system_tools.build_representation(self.hier,rep,self.coord_finder)
+                reps, hiers = system_tools.build_representation(
+                    self.hier, rep, self.coord_finder, gmm_store)
+                built_reps += reps
+                res_hiers.update(hiers)
 
             # sort them before adding as children
             built_reps.sort(key=lambda r: IMP.atom.Fragment(r).get_residue_indexes()[0])
@@ -606,29 +745,34 @@ class Molecule(_SystemBase):
                 br.update_parents()
             self.built = True
 
+            # store the highest resolution available in residue.hier
             for res in self.residues:
-                idx = res.get_index()
-
-                # first off, store the highest resolution available in residue.hier
-                new_ps = IMP.atom.Selection(
-                    self.hier,
-                    residue_index=res.get_index(),
-                    resolution=1).get_selected_particles()
-                if len(new_ps)>0:
-                    new_p = new_ps[0]
-                    if IMP.atom.Atom.get_is_setup(new_p):
-                        # if only found atomic, store the residue
-                        new_hier = IMP.atom.get_residue(IMP.atom.Atom(new_p))
-                    else:
-                        # otherwise just store what you found
-                        new_hier = IMP.atom.Hierarchy(new_p)
-                    res.hier = new_hier
-                else:
-                    res.hier = None
+                res.hier = res_hiers.get(res.get_index())
             self._represented = IMP.pmi.tools.OrderedSet([a for a in self._represented])
         print('done building',self.get_hierarchy())
         return self.hier
 
+    def _set_built_hierarchy(self,hier):
+        """Use a built Molecule hierarchy read from the build cache"""
+        self.hier = hier
+        if self.mol_to_clone is not None:
+            for nr,r in enumerate(self.mol_to_clone.residues):
+                if r.get_has_structure():
+                    self.residues[nr].set_structure_type(r.get_residue_type(),
+                                                         soft_check=True)
+            for old_rep in self.mol_to_clone.representations:
+                for r in old_rep.residues:
+                    self._represented.add(self.residues[r.get_internal_index()])
+        for rep in self.representations:
+            if rep.ideal_helix:
+                for r in rep.residues:
+                    r.set_structure_type(r.get_residue_type())
+        res_hiers = system_tools.get_residue_hierarchies(hier)
+        for res in self.residues:
+            res.hier = res_hiers.get(res.get_index())
+        self._deferred_structures = []
+        self.built = True
+
     def get_particles_at_all_resolutions(self,residue_indexes=None):
         """Helpful utility for getting particles at all resolutions from this molecule.
         Can optionally pass a set of residue indexes"""
@@ -673,31 +817,38 @@ class _Representation(object):
 class _FindCloseStructure(object):
     """Utility to get the nearest observed coordinate"""
     def __init__(self):
-        self.coords=[]
+        # residue indexes (sorted) and the corresponding CA coordinates
+        self.indexes = np.zeros(0, dtype=int)
+        self.coords = np.zeros((0, 3))
     def add_residues(self,residues):
+        idxs = []
+        coords = []
         for r in residues:
-            idx = IMP.atom.Residue(r).get_index()
-            ca = IMP.atom.Selection(r,atom_type=IMP.atom.AtomType("CA")).get_selected_particles()[0]
-            xyz = IMP.core.XYZ(ca).get_coordinates()
-            self.coords.append([idx,xyz])
-        self.coords.sort(key=itemgetter(0))
+            for a in IMP.atom.Hierarchy(r).get_children():
+                if IMP.atom.Atom(a).get_atom_type()==IMP.atom.AT_CA:
+                    idxs.append(IMP.atom.Residue(r).get_index())
+                    coords.append(list(IMP.core.XYZ(a).get_coordinates()))
+                    break
+        if len(idxs)==0:
+            return
+        indexes = np.concatenate((self.indexes, idxs))
+        coords = np.concatenate((self.coords, np.array(coords, dtype=float)))
+        order = np.argsort(indexes, kind='mergesort')
+        self.indexes = indexes[order]
+        self.coords = coords[order]
     def find_nearest_coord(self,query):
-        if self.coords==[]:
+        if len(self.indexes)==0:
             return None
-        keys = [r[0] for r in self.coords]
-        pos = bisect_left(keys,query)
+        pos = np.searchsorted(self.indexes,query)
         if pos == 0:
-            ret = self.coords[0]
-        elif pos == len(self.coords):
-            ret = self.coords[-1]
+            ret = 0
+        elif pos == len(self.indexes):
+            ret = pos - 1
+        elif self.indexes[pos] - query < query - self.indexes[pos - 1]:
+            ret = pos
         else:
-            before = self.coords[pos - 1]
-            after = self.coords[pos]
-            if after[0] - query < query - before[0]:
-                ret = after
-            else:
-                ret = before
-        return ret[1]
+            ret = pos - 1
+        return IMP.algebra.Vector3D(*self.coords[ret])
 
 class Sequences(object):
     """A dictionary-like wrapper for reading and storing sequence data"""
@@ -921,24 +1072,27 @@ class TempResidue(object):
         return self.molecule
     def get_has_structure(self):
         return self._structured
-    def set_structure(self,res,soft_check=False):
-        if res.get_residue_type()!=self.get_residue_type():
+    def set_structure_type(self,rtype,soft_check=False):
+        """Mark the residue as structured, without adding coordinates.
+        Checks that rtype matches the sequence, as set_structure() does."""
+        if rtype!=self.get_residue_type():
             if soft_check:
                 print('WARNING: Replacing sequence residue',self.get_index(),self.hier.get_residue_type(),
-                      'with PDB type',res.get_residue_type())
-                self.hier.set_residue_type((res.get_residue_type()))
-                self.rtype = res.get_residue_type()
+                      'with PDB type',rtype)
+                self.hier.set_residue_type(rtype)
+                self.rtype = rtype
             else:
                 raise Exception('ERROR: PDB residue index',self.get_index(),'is',
-                                IMP.atom.get_one_letter_code(res.get_residue_type()),
+                                IMP.atom.get_one_letter_code(rtype),
                                 'and sequence residue is',self.get_code())
-
+        self._structured = True
+    def set_structure(self,res,soft_check=False):
+        self.set_structure_type(res.get_residue_type(),soft_check)
         for a in res.get_children():
             self.hier.add_child(a)
             atype = IMP.atom.Atom(a).get_atom_type()
             a.get_particle().set_name('Atom %s of residue %i'%(atype.__str__().strip('"'),
                                                                self.hier.get_index()))
-        self._structured = True
 
 class TopologyReader(object):
     """Automatically setup Sytem and Degrees of Freedom with a formatted text file.
@@ -0,0 +1,147 @@
+"""@namespace IMP.pmi.topology.build_cache
+   Persistent cache of built System hierarchies.
+
+   Building a large System (reading PDB files, making beads, fitting GMMs)
+   can take minutes, and is repeated by every run and every replica. If a
+   cache file is given to IMP.pmi.topology.System, the built hierarchy is
+   written to it as RMF, together with a fingerprint of everything the
+   build depends on (sequences, checksums of the PDB and GMM files, and
+   all structure and representation parameters). Later runs with the same
+   fingerprint load the hierarchy instead of building it.
+
+   The fingerprint and the residues read by each
+   IMP.pmi.topology.Molecule.add_structure() call are stored as JSON in
+   the description of the RMF file.
+"""
+
+from __future__ import print_function
+import IMP
+import IMP.atom
+import IMP.display
+import IMP.pmi
+import IMP.rmf
+import RMF
+import hashlib
+import json
+import os
+
+_DESCRIPTION_PREFIX = 'IMP.pmi build cache v1\n'
+
+
+def _get_checksum(fn):
+    with open(fn, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def _get_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True)
+                        .encode('utf8')).hexdigest()
+
+
+def get_structure_key(pdb_fn, chain_id, res_range, offset, model_num,
+                      ca_only, soft_check, sequence):
+    """Get the key identifying an add_structure() call.
+       The key depends on the contents of the PDB file, not its name."""
+    if res_range is not None:
+        res_range = list(res_range)
+    return _get_hash([_get_checksum(pdb_fn), chain_id, res_range, offset,
+                      model_num, ca_only, soft_check, sequence])
+
+
+def _get_color_key(color):
+    if isinstance(color, IMP.display.Color):
+        return [color.get_red(), color.get_green(), color.get_blue()]
+    elif hasattr(color, '__iter__') and not isinstance(color, str):
+        return list(color)
+    return color
+
+
+def _get_representation_key(rep):
+    gmm = None
+    if rep.density_residues_per_component and not rep.density_force_compute:
+        gmm_fn = rep.density_prefix + '.txt'
+        if os.path.exists(gmm_fn):
+            gmm = _get_checksum(gmm_fn)
+    return [sorted(r.get_index() for r in rep.residues),
+            list(rep.bead_resolutions), list(rep.bead_extra_breaks),
+            rep.bead_ca_centers, list(rep.bead_default_coord),
+            rep.density_residues_per_component, rep.density_prefix,
+            rep.density_force_compute, rep.density_voxel_size, gmm,
+            rep.setup_particles_as_densities, rep.ideal_helix,
+            _get_color_key(rep.color)]
+
+
+def get_fingerprint(system):
+    """Get a fingerprint of everything the build of a System depends on"""
+    data = [IMP.pmi.get_module_version(), system.get_hierarchy().get_name()]
+    for state in system.get_states():
+        for molname, copies in sorted(state.get_molecules().items()):
+            for mol in copies:
+                clone = None
+                if mol.mol_to_clone is not None:
+                    clone = IMP.atom.Copy(
+                        mol.mol_to_clone.get_hierarchy()).get_copy_index()
+                    # clones copy their representations when built
+                    reps = []
+                else:
+                    reps = [_get_representation_key(rep)
+                            for rep in mol.representations]
+                data.append([molname,
+                             IMP.atom.Copy(mol.hier).get_copy_index(),
+                             IMP.atom.Chain(mol.hier).get_id(),
+                             mol.sequence, clone,
+                             [key for key, residues in mol._structures],
+                             reps])
+    return _get_hash(data)
+
+
+def read_metadata(fn):
+    """Read the metadata stored in a cache file.
+    @return a dict with the fingerprint and the residues of each
+            structure key, or None if the file is missing or not a cache
+    """
+    if not os.path.exists(fn):
+        return None
+    try:
+        rh = RMF.open_rmf_file_read_only(fn)
+        description = rh.get_description()
+    except Exception as err:
+        print("Build cache: could not read %s: %s" % (fn, err))
+        return None
+    if not description.startswith(_DESCRIPTION_PREFIX):
+        return None
+    return json.loads(description[len(_DESCRIPTION_PREFIX):])
+
+
+def read_hierarchy(fn, mdl):
+    """Read the built hierarchy from a cache file"""
+    rh = RMF.open_rmf_file_read_only(fn)
+    hier = IMP.rmf.create_hierarchies(rh, mdl)[0]
+    IMP.rmf.load_frame(rh, RMF.FrameID(0))
+    return hier
+
+
+def write(fn, system):
+    """Write the built hierarchy of a System to a cache file.
+       The file is written atomically, so that other processes never
+       read a partial cache."""
+    structures = {}
+    for state in system.get_states():
+        for copies in state.get_molecules().values():
+            for mol in copies:
+                structures.update(mol._structures)
+    metadata = {'fingerprint': get_fingerprint(system),
+                'structures': structures}
+    base, ext = os.path.splitext(fn)
+    tmp_fn = '%s.%d.tmp%s' % (base, os.getpid(), ext)
+    rh = RMF.create_rmf_file(tmp_fn)
+    rh.set_description(_DESCRIPTION_PREFIX + json.dumps(metadata))
+    IMP.rmf.add_hierarchy(rh, system.get_hierarchy())
+    IMP.rmf.save_frame(rh, "0")
+    del rh
+    try:
+        os.rename(tmp_fn, fn)
+    except OSError:
+        # on Windows, rename does not replace an existing file
+        os.unlink(fn)
+        os.rename(tmp_fn, fn)
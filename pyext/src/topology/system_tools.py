@@ -6,7 +6,10 @@ import IMP.pmi
 import IMP.pmi.tools
 from collections import defaultdict
 from math import pi
+import filecmp
 import os
+import shutil
+import numpy as np
 
 def resnums2str(res):
     """Take iterable of TempResidues and return compatified string"""
@@ -29,6 +32,51 @@ def resnums2str(res):
             ret+=', '
     return ret
 
+# Parsed PDB files, keyed by file name and reader options. Each entry holds
+# the model, the file modification time, the root hierarchy of each model
+# in the file and, for each of them, a dictionary of its chain hierarchies
+# by chain ID.
+_structure_cache = {}
+
+def _destroy_cached(cached):
+    for mh in cached[2]:
+        IMP.atom.destroy(mh)
+
+def clear_structure_cache(mdl=None):
+    """Forget the PDB files read by get_structure(), and remove the parsed
+       hierarchies from their model
+    @param mdl If given, only forget the files read into this model
+    """
+    for key, cached in list(_structure_cache.items()):
+        if mdl is None or cached[0] == mdl:
+            _destroy_cached(cached)
+            del _structure_cache[key]
+
+def _get_cached_chains(mdl,pdb_fn,multimodel,ca_only):
+    """Read all chains of a PDB file, once per process and model"""
+    key = (os.path.abspath(pdb_fn), multimodel, ca_only)
+    mtime = os.path.getmtime(pdb_fn)
+    cached = _structure_cache.get(key)
+    if cached is None or not (cached[0] == mdl and cached[1] == mtime):
+        if cached is not None:
+            _destroy_cached(cached)
+        sel = IMP.atom.get_default_pdb_selector()
+        if ca_only:
+            sel = IMP.atom.CAlphaPDBSelector()
+        if multimodel:
+            mhs = IMP.atom.read_multimodel_pdb(pdb_fn,mdl,sel)
+        else:
+            mhs = [IMP.atom.read_pdb(pdb_fn,mdl,sel)]
+        models = []
+        for mh in mhs:
+            chains = defaultdict(list)
+            for c in IMP.atom.get_by_type(mh,IMP.atom.CHAIN_TYPE):
+                chains[IMP.atom.Chain(c).get_id()].append(c)
+            models.append(chains)
+        cached = (mdl, mtime, mhs, models)
+        _structure_cache[key] = cached
+    return cached[3]
+
 def get_structure(mdl,pdb_fn,chain_id,res_range=None,offset=0,model_num=None,ca_only=False):
     """read a structure from a PDB file and return a list of residues
     @param mdl The IMP model
@@ -41,35 +89,39 @@ def get_structure(mdl,pdb_fn,chain_id,res_range=None,offset=0,model_num=None,ca_
     @param offset    Apply an offset to the residue indexes of the PDB file
     @param model_num Read multi-model PDB and return that model
     @param ca_only Read only CA atoms (by default, all non-waters are read)
+    \note Each file is parsed only once (for all its chains) per process and
+           model; the returned residues are copies of the parsed ones.
+           The parsed files are released by clear_structure_cache(), which
+           System.build() calls for its model.
     """
-    sel = IMP.atom.get_default_pdb_selector()
-    if ca_only:
-        sel = IMP.atom.CAlphaPDBSelector()
+    models = _get_cached_chains(mdl,pdb_fn,model_num is not None,ca_only)
     if model_num is None:
-        mh = IMP.atom.read_pdb(pdb_fn,mdl,
-                               IMP.atom.AndPDBSelector(IMP.atom.ChainPDBSelector(chain_id), sel))
-
-    else:
-        mhs = IMP.atom.read_multimodel_pdb(pdb_fn,mdl,sel)
-        if model_num>=len(mhs):
-            raise Exception("you requested model num "+str(model_num)+\
-                            " but the PDB file only contains "+str(len(mhs))+" models")
-        mh = IMP.atom.Selection(mhs[model_num],chain=chain_id,with_representation=True)
+        model_num = 0
+    elif model_num>=len(models):
+        raise Exception("you requested model num "+str(model_num)+\
+                        " but the PDB file only contains "+str(len(models))+" models")
 
-    if res_range==[] or res_range is None:
-        sel = IMP.atom.Selection(mh,chain=chain_id,atom_type=IMP.atom.AtomType('CA'))
-    else:
-        start = res_range[0]
-        end = res_range[1]
-        if end=="END":
-            end = IMP.atom.Residue(mh.get_children()[0].get_children()[-1]).get_index()
-        sel = IMP.atom.Selection(mh,chain=chain_id,residue_indexes=range(start,end+1),
-                                 atom_type=IMP.atom.AtomType('CA'))
     ret = []
-    for p in sel.get_selected_particles():
-        res = IMP.atom.Residue(IMP.atom.Atom(p).get_parent())
-        res.set_index(res.get_index() + offset)
-        ret.append(res)
+    residues = [IMP.atom.Residue(r) for c in models[model_num].get(chain_id,[])
+                for r in c.get_children() if IMP.atom.Residue.get_is_setup(r)]
+    if len(residues)>0:
+        if res_range==[] or res_range is None:
+            start = end = None
+        else:
+            start = res_range[0]
+            end = res_range[1]
+            if end=="END":
+                end = residues[-1].get_index()
+        for r in residues:
+            if start is not None and not start<=r.get_index()<=end:
+                continue
+            # only residues with a CA atom (as IMP.atom.Selection would give)
+            if not any(IMP.atom.Atom(a).get_atom_type()==IMP.atom.AT_CA
+                       for a in r.get_children()):
+                continue
+            res = IMP.atom.Residue(IMP.atom.create_clone(r))
+            res.set_index(res.get_index() + offset)
+            ret.append(res)
     if len(ret) == 0:
         print("WARNING: no residues selected from %s in range %s"
               % (pdb_fn, res_range))
@@ -170,7 +222,22 @@ def show_representation(node):
     else:
         return False
 
-def build_representation(parent,rep,coord_finder):
+def get_density_fit(rep):
+    """Get what a GMM is fitted to for a density representation
+    @param rep An instance of pmi::topology::_Representation
+    @return a tuple of the points to fit (as an (n, 3) array), the
+            number of components, and the total mass
+    """
+    num_components = len(rep.residues)//rep.density_residues_per_component+1
+    fit_coords = []
+    total_mass = 0.0
+    for r in rep.residues:
+        for p in IMP.core.get_leaves(r.hier):
+            fit_coords.append(list(IMP.core.XYZ(p).get_coordinates()))
+            total_mass += IMP.atom.Mass(p).get_mass()
+    return np.array(fit_coords), num_components, total_mass
+
+def build_representation(parent,rep,coord_finder,gmm_store=None):
     """Create requested representation.
     For beads, identifies continuous segments and sets up as Representation.
     If any volume-based representations (e.g.,densities) are requested,
@@ -179,8 +246,18 @@ def build_representation(parent,rep,coord_finder):
     @param parent The Molecule to which we'll add add representations
     @param rep What to build. An instance of pmi::topology::_Representation
     @param coord_finder A _FindCloseStructure object to help localize beads
+    @param gmm_store If given, GMMs that would be fitted (because the
+           density_prefix file is missing, does not match, or
+           density_force_compute is set) are taken from this
+           content-addressed store of fits (see
+           IMP::pmi::io::gmm::fit_gmms), fitting them only if missing.
+           The GMM (and map) are still written with density_prefix.
+    @return a tuple of the list of built representations and a dictionary
+            mapping each residue index to its highest resolution hierarchy
+            (as would be found by IMP.atom.Selection with resolution=1)
     """
     built_reps = []
+    res_hiers = {}
     atomic_res = 0
     ca_res = 1
     mdl = parent.get_model()
@@ -201,6 +278,13 @@ def build_representation(parent,rep,coord_finder):
     # first get the primary representation (currently, the smallest bead size)
     #  eventually we won't require beads to be present at all
     primary_resolution = min(rep.bead_resolutions)
+    # the resolution that IMP.atom.Selection picks for resolution=1: the
+    # closest one, preferring the primary resolution and then the order
+    # in which the resolutions are added
+    map_resolution = min([primary_resolution] +
+                         [r for r in rep.bead_resolutions
+                          if r != primary_resolution],
+                         key=lambda r: abs(r - 1))
 
     # if collective densities, will return single node with everything
     # below we sample or read the GMMs and add them as representation
@@ -219,29 +303,39 @@ def build_representation(parent,rep,coord_finder):
         density_frag.get_particle().set_name("Densities %i"%rep.density_residues_per_component)
         density_ps = []
 
-        if os.path.exists(rep.density_prefix+'.txt') and not rep.density_force_compute:
-            IMP.isd.gmm_tools.decorate_gmm_from_text(rep.density_prefix+'.txt',
+        prefix_fn = rep.density_prefix+'.txt'
+        if os.path.exists(prefix_fn) and not rep.density_force_compute:
+            IMP.isd.gmm_tools.decorate_gmm_from_text(prefix_fn,
                                                      density_ps,
                                                      mdl)
-        if len(density_ps)!=num_components or not os.path.exists(rep.density_prefix+'.txt') or rep.density_force_compute:
-            fit_coords = []
-            total_mass = 0.0
-            for r in rep.residues:
-                for p in IMP.core.get_leaves(r.hier):
-                    fit_coords.append(IMP.core.XYZ(p).get_coordinates())
-                    total_mass += IMP.atom.Mass(p).get_mass()
+        if len(density_ps)!=num_components or not os.path.exists(prefix_fn) or rep.density_force_compute:
+            if gmm_store is not None:
+                import IMP.pmi.io.gmm
+                # drop any GMM read from a file that does not match
+                for p in density_ps:
+                    mdl.remove_particle(p.get_index())
+                density_ps = []
+                gmm_fn = IMP.pmi.io.gmm.fit_gmms([get_density_fit(rep)],gmm_store)[0]
+                IMP.pmi.io.gmm.decorate_gmm_from_text(gmm_fn,density_ps,mdl)
+                if not os.path.exists(prefix_fn) or not filecmp.cmp(prefix_fn,gmm_fn,shallow=False):
+                    shutil.copyfile(gmm_fn,prefix_fn)
+                    if rep.density_voxel_size>0.0:
+                        IMP.isd.gmm_tools.write_gmm_to_map(density_ps,rep.density_prefix+'.mrc',
+                                                           rep.density_voxel_size,fast=True)
+            else:
+                fit_coords, num_components, total_mass = get_density_fit(rep)
 
-            # fit GMM
-            IMP.isd.gmm_tools.fit_gmm_to_points(fit_coords,
-                                                num_components,
-                                                mdl,
-                                                density_ps,
-                                                mass_multiplier=total_mass)
+                # fit GMM
+                IMP.isd.gmm_tools.fit_gmm_to_points([IMP.algebra.Vector3D(*c) for c in fit_coords],
+                                                    num_components,
+                                                    mdl,
+                                                    density_ps,
+                                                    mass_multiplier=total_mass)
 
-            IMP.isd.gmm_tools.write_gmm_to_text(density_ps,rep.density_prefix+'.txt')
-            if rep.density_voxel_size>0.0:
-                IMP.isd.gmm_tools.write_gmm_to_map(density_ps,rep.density_prefix+'.mrc',
-                                                   rep.density_voxel_size,fast=True)
+                IMP.isd.gmm_tools.write_gmm_to_text(density_ps,prefix_fn)
+                if rep.density_voxel_size>0.0:
+                    IMP.isd.gmm_tools.write_gmm_to_map(density_ps,rep.density_prefix+'.mrc',
+                                                       rep.density_voxel_size,fast=True)
 
         for d in density_ps:
             density_frag.add_child(d)
@@ -320,6 +414,17 @@ def build_representation(parent,rep,coord_finder):
                 for bead in beads:
                     this_resolution.add_child(bead)
 
+            # store the residue to hierarchy map while we have the beads
+            if resolution==map_resolution:
+                if frag_res[0].get_has_structure() and resolution==atomic_res:
+                    for residue in frag_res:
+                        res_hiers[residue.get_index()] = residue.get_hierarchy()
+                else:
+                    for bead in this_resolution.get_children():
+                        for idx in IMP.pmi.tools.get_residue_indexes(bead):
+                            if idx not in res_hiers:
+                                res_hiers[idx] = IMP.atom.Hierarchy(bead)
+
             # if requested, color all resolutions the same
             if color:
                 for lv in IMP.core.get_leaves(this_resolution):
@@ -362,4 +467,31 @@ def build_representation(parent,rep,coord_finder):
                 root_representation.add_representation(this_resolution,
                                                        IMP.atom.BALLS,
                                                        resolution)
-    return built_reps
+    return built_reps, res_hiers
+
+def get_residue_hierarchies(mol_hier):
+    """Map residue indexes to hierarchies for a built (or read) Molecule.
+    Gives the same result as build_representation, but from the final
+    hierarchy (e.g. one read from an RMF file).
+    @param mol_hier The Molecule hierarchy
+    @return a dictionary mapping each residue index to its highest
+            resolution hierarchy
+    """
+    res_hiers = {}
+    for child in mol_hier.get_children():
+        if not IMP.atom.Representation.get_is_setup(child):
+            continue
+        rep = IMP.atom.Representation(child)
+        # the base resolution comes first
+        resolutions = rep.get_resolutions(IMP.atom.BALLS)
+        map_resolution = min(resolutions, key=lambda r: abs(r - 1))
+        if map_resolution == resolutions[0]:
+            frags = child.get_children()
+        else:
+            frags = [rep.get_representation(map_resolution, IMP.atom.BALLS)]
+        for frag in frags:
+            for h in frag.get_children():
+                for idx in IMP.pmi.tools.get_residue_indexes(h):
+                    if idx not in res_hiers:
+                        res_hiers[idx] = h
+    return res_hiers
@@ -0,0 +1,62 @@
+/**
+ *  \file pmi/BiStableDistanceRestraint.cpp
+ *  \brief A distance restraint with a bistable potential.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/BiStableDistanceRestraint.h>
+#include <IMP/core/XYZ.h>
+#include <IMP/exception.h>
+#include <cmath>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+BiStableDistanceRestraint::BiStableDistanceRestraint(Model *m,
+                          ParticleIndexAdaptor p1, ParticleIndexAdaptor p2,
+                          double dist1, double dist2,
+                          double sigma1, double sigma2,
+                          double weight1, double weight2,
+                          std::string name):
+                          Restraint(m, name), p1_(p1), p2_(p2),
+                          dist1_(dist1), dist2_(dist2),
+                          sigma1_(sigma1), sigma2_(sigma2),
+                          weight1_(weight1), weight2_(weight2)
+{
+    if (weight1_+weight2_ != 1.0) {
+      IMP_THROW("The sum of the weights must be one", ValueException);
+    }
+}
+
+double BiStableDistanceRestraint::
+                 unprotected_evaluate(DerivativeAccumulator *accum) const
+{
+    core::XYZ d1(get_model(),p1_);
+    core::XYZ d2(get_model(),p2_);
+    algebra::Vector3D diff=d1.get_coordinates()-d2.get_coordinates();
+    double dist=diff.get_magnitude();
+    double x1=dist-dist1_;
+    double x2=dist-dist2_;
+    double g1=weight1_*std::exp(-x1*x1/(2.0*sigma1_*sigma1_));
+    double g2=weight2_*std::exp(-x2*x2/(2.0*sigma2_*sigma2_));
+    double prob=g1+g2;
+    if (accum && dist>0.0){
+      double dscore=(g1*x1/(sigma1_*sigma1_)+g2*x2/(sigma2_*sigma2_))/prob;
+      algebra::Vector3D deriv=diff*(dscore/dist);
+      d1.add_to_derivatives(deriv,*accum);
+      d2.add_to_derivatives(-deriv,*accum);
+    }
+    return -std::log(prob);
+}
+
+ModelObjectsTemp BiStableDistanceRestraint::do_get_inputs() const
+{
+  ParticlesTemp ret;
+  ret.push_back(get_model()->get_particle(p1_));
+  ret.push_back(get_model()->get_particle(p2_));
+  return ret;
+}
+
+IMPPMI_END_NAMESPACE
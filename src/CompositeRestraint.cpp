@@ -11,6 +11,7 @@
 
 #include <IMP/pmi/CompositeRestraint.h>
 #include <IMP/core/XYZR.h>
+#include <IMP/algebra/Sphere3D.h>
 #include <math.h>
 #include <limits.h>
 
@@ -38,17 +39,22 @@ CompositeRestraint::CompositeRestraint(Model *m,
                              }
                           }
 
+void CompositeRestraint::add_composite_particle(ParticleIndexesAdaptor pi)
+{
+    // the probability table grows as n*2^(n-1)
+    if (pis_.size()>=20) {
+      IMP_THROW("CompositeRestraint supports at most 20 elements",
+                ValueException);
+    }
+    pis_.push_back(pi);
+}
 
 double CompositeRestraint::
                  unprotected_evaluate(DerivativeAccumulator *accum) const
 {
     double score=0;
-    //std::cout << "here" << std::endl;
-    Cache cache;
-    CachePot cachepot;
-    Ints excluded_ps;
-    excluded_ps.push_back(0);
-    double prob=get_probability_per_particle_excluding(0,excluded_ps,cache,cachepot);
+    update_pair_probabilities();
+    double prob=get_probability_from_table();
     if (prob==0.0){score += std::numeric_limits<double>::max( );}
     else{score+=-log(prob);}
 
@@ -57,78 +63,78 @@ double CompositeRestraint::
     return score;
 }
 
-double CompositeRestraint::get_probability_per_particle_excluding(unsigned int ipart,
-                                    Ints excluded_ps, Cache& cache, CachePot& cachepot ) const
+void CompositeRestraint::update_pair_probabilities() const
 {
-    std::sort(excluded_ps.begin(),excluded_ps.end());
-    CacheKey key(ipart,excluded_ps);
-    if (cache.find(key)!=cache.end()){
-      return cache.find(key)->second;
-    }
-
-
-    double onemprob=1.0;
-
-
-    for(unsigned int k=0;k<get_number_of_elements();++k){
-      //std::cout << k << std::endl;
-      if (std::find(excluded_ps.begin(), excluded_ps.end(), k) == excluded_ps.end()){
-         //std::cout << "ex " << k << std::endl;
-
-         //check that the probability term was already calculated
-         //before
-         excluded_ps.push_back(k);
-         CacheKeyPot keypot1(ipart,k);
-
-
-         double p;
-
-         if (cachepot.find(keypot1)!=cachepot.end()){
-            p=cachepot.find(keypot1)->second;
-         }
-         //otherwise look in the cache of precalculated terms
-         else {
-
-            double onemprob1=1.0;
-
-            ParticleIndexes ppi=pis_[ipart];
-            ParticleIndexes ppk=pis_[k];
-
-            for(unsigned int ii=0;ii<ppi.size();++ii){
-              for(unsigned int kk=0;kk<ppk.size();++kk){
-
-                core::XYZR di(get_model(), ppi[ii]);
-                core::XYZR dk(get_model(), ppk[kk]);
-		            double dist = core::get_distance(di,dk);
-		            //onemprob1*=(arg/(1.0+std::abs(arg))+1.0)/2.0;
-                onemprob1*=calc_prob(dist);
-                //p=1.0;
-
-                }
-              }
-            p=1.0-onemprob1;
-            CacheKeyPot keypot2(k,ipart);
-            cachepot[keypot1]=p;
-            cachepot[keypot2]=p;
-         }
-
+    unsigned int n=get_number_of_elements();
+    pair_prob_.resize(n*n);
 
+    // read each particle's sphere once
+    Ints offsets(n+1,0);
+    for(unsigned int k=0;k<n;++k){
+      offsets[k+1]=offsets[k]+pis_[k].size();
+    }
+    coords_.resize(offsets[n]);
+    for(unsigned int k=0;k<n;++k){
+      for(unsigned int kk=0;kk<pis_[k].size();++kk){
+        coords_[offsets[k]+kk]=core::XYZR(get_model(),pis_[k][kk]).get_sphere();
+      }
+    }
 
-         if (excluded_ps.size()==get_number_of_elements())
-         {
-         onemprob *= 1.0-p;
-         }
-         else
-         {
-         onemprob *= 1.0-p*get_probability_per_particle_excluding(k,excluded_ps,cache,cachepot);
-         }
-         excluded_ps.pop_back();
+    for(unsigned int i=0;i<n;++i){
+      pair_prob_[i*n+i]=0.0;
+      for(unsigned int k=i+1;k<n;++k){
+        double onemprob1=1.0;
+        for(int ii=offsets[i];ii<offsets[i+1];++ii){
+          for(int kk=offsets[k];kk<offsets[k+1];++kk){
+            // distance between the sphere surfaces
+            double dist=algebra::get_distance(coords_[ii],coords_[kk]);
+            onemprob1*=calc_prob(dist);
+          }
+        }
+        pair_prob_[i*n+k]=1.0-onemprob1;
+        pair_prob_[k*n+i]=1.0-onemprob1;
       }
     }
+}
 
-  double prob=1.0-onemprob;
-  cache[key]=prob;
-  return prob;
+/* The probability for element i given the set of already excluded
+   elements (a bitmask that always contains i) is
+     P(i,S) = 1 - prod_{k not in S} (1 - p_ik P(k, S+k))
+   where the term for the last remaining element is (1 - p_ik).
+   Starting from element 0, only sets containing element 0 are reached,
+   and P(i,S) only depends on larger sets, so the table is filled in
+   order of decreasing S. Sets are stored with bit 0 dropped. */
+double CompositeRestraint::get_probability_from_table() const
+{
+    unsigned int n=get_number_of_elements();
+    IMP_USAGE_CHECK(n<=20, "CompositeRestraint supports at most 20 elements");
+    if (n<2) return 0.0;
+    unsigned int full=(1u<<n)-1;
+    unsigned int nsets=1u<<(n-1);
+    table_.resize(static_cast<size_t>(nsets)*n);
+
+    for(unsigned int set=full;;set-=2){
+      double *row=&table_[static_cast<size_t>(set>>1)*n];
+      for(unsigned int i=0;i<n;++i){
+        if (!(set&(1u<<i))) continue;
+        const double *pi=&pair_prob_[i*n];
+        double onemprob=1.0;
+        for(unsigned int k=0;k<n;++k){
+          unsigned int bit=1u<<k;
+          if (set&bit) continue;
+          unsigned int newset=set|bit;
+          if (newset==full){
+            onemprob*=1.0-pi[k];
+          }
+          else{
+            onemprob*=1.0-pi[k]*table_[static_cast<size_t>(newset>>1)*n+k];
+          }
+        }
+        row[i]=1.0-onemprob;
+      }
+      if (set==1) break;
+    }
+    return table_[0];
 }
 
 
@@ -0,0 +1,139 @@
+/**
+ *  \file pmi/ConnectivityNetworkRestraint.cpp
+ *  \brief Restrain a set of particle blocks to form a connected network.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/ConnectivityNetworkRestraint.h>
+#include <IMP/core/XYZR.h>
+#include <cmath>
+#include <limits>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+ConnectivityNetworkRestraint::ConnectivityNetworkRestraint(Model *m,
+                          double slope, double theta, double plateau,
+                          double linear_slope, std::string name):
+                          Restraint(m, name),
+                          slope_(slope), theta_(theta), plateau_(plateau),
+                          linear_slope_(linear_slope) {}
+
+double ConnectivityNetworkRestraint::get_sigmoid(double dist) const
+{
+    double argvalue=(dist-theta_)/slope_;
+    return 1.0-(1.0-plateau_)/(1.0+std::exp(-argvalue));
+}
+
+void ConnectivityNetworkRestraint::compute_minimum_spanning_tree(
+                          IntPairs &edges, Floats &distances,
+                          ParticleIndexPairs &closest) const
+{
+    unsigned int nb=blocks_.size();
+    edges.clear();
+    distances.clear();
+    closest.clear();
+
+    grids_.resize(nb);
+    for(unsigned int b=0;b<nb;++b){
+      algebra::Sphere3Ds spheres(blocks_[b].size());
+      for(unsigned int n=0;n<blocks_[b].size();++n){
+        spheres[n]=core::XYZR(get_model(),blocks_[b][n]).get_sphere();
+      }
+      grids_[b].set_spheres(spheres);
+    }
+
+    // dense matrix of block distances, clamped at zero; blocks that touch
+    // are found as soon as one overlapping pair is seen
+    Floats dist;
+    Ints closest1, closest2;
+    internal::get_bipartite_minimum_sphere_distances(grids_,0.0,dist,
+                                                     closest1,closest2);
+    for(unsigned int k=0;k<dist.size();++k){
+      dist[k]=std::max(dist[k],0.0);
+    }
+
+    // Prim's algorithm on the dense matrix; unreachable blocks (only
+    // possible with empty blocks) start a new tree
+    const double inf=std::numeric_limits<double>::infinity();
+    std::vector<bool> intree(nb,false);
+    Floats key(nb,inf);
+    Ints parent(nb,-1);
+    for(unsigned int n=0;n<nb;++n){
+      int next=-1;
+      for(unsigned int v=0;v<nb;++v){
+        if (!intree[v] && (next<0 || key[v]<key[next])) next=v;
+      }
+      intree[next]=true;
+      if (parent[next]>=0){
+        edges.push_back(IntPair(parent[next],next));
+        distances.push_back(key[next]);
+        unsigned int k=parent[next]*nb+next;
+        closest.push_back(ParticleIndexPair(blocks_[parent[next]][closest1[k]],
+                                            blocks_[next][closest2[k]]));
+      }
+      for(unsigned int v=0;v<nb;++v){
+        if (!intree[v] && dist[next*nb+v]<key[v]){
+          key[v]=dist[next*nb+v];
+          parent[v]=next;
+        }
+      }
+    }
+}
+
+IntPairs ConnectivityNetworkRestraint::get_minimum_spanning_tree() const
+{
+    IntPairs edges;
+    Floats distances;
+    ParticleIndexPairs closest;
+    compute_minimum_spanning_tree(edges,distances,closest);
+    return edges;
+}
+
+double ConnectivityNetworkRestraint::
+                 unprotected_evaluate(DerivativeAccumulator *accum) const
+{
+    IntPairs edges;
+    Floats distances;
+    ParticleIndexPairs closest;
+    compute_minimum_spanning_tree(edges,distances,closest);
+
+    double score=0.0;
+    for(unsigned int e=0;e<edges.size();++e){
+      double dist=distances[e];
+      double prob=get_sigmoid(dist);
+      score+=-std::log(prob)+linear_slope_*dist;
+
+      // touching blocks have zero distance and no gradient
+      if (accum && dist>0.0){
+        double onemprob=1.0-prob;
+        double dscore=onemprob*(1.0-onemprob/(1.0-plateau_))/slope_/prob
+                      +linear_slope_;
+        core::XYZ d1(get_model(),closest[e][0]);
+        core::XYZ d2(get_model(),closest[e][1]);
+        algebra::Vector3D diff=d1.get_coordinates()-d2.get_coordinates();
+        double norm=diff.get_magnitude();
+        if (norm>0.0){
+          algebra::Vector3D deriv=diff*(dscore/norm);
+          d1.add_to_derivatives(deriv,*accum);
+          d2.add_to_derivatives(-deriv,*accum);
+        }
+      }
+    }
+    return score;
+}
+
+ModelObjectsTemp ConnectivityNetworkRestraint::do_get_inputs() const
+{
+  ParticlesTemp ret;
+  for(unsigned int b=0;b<blocks_.size();++b){
+     for(unsigned int n=0;n<blocks_[b].size();++n){
+        ret.push_back(get_model()->get_particle(blocks_[b][n]));
+     }
+  }
+  return ret;
+}
+
+IMPPMI_END_NAMESPACE
@@ -0,0 +1,79 @@
+/**
+ *  \file pmi/CylinderRestraint.cpp
+ *  \brief Restrain particles within a cylinder along the z axis.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/CylinderRestraint.h>
+#include <IMP/pmi/internal/sigmoid.h>
+#include <IMP/core/XYZ.h>
+#include <cmath>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+CylinderRestraint::CylinderRestraint(Model *m, ParticleIndexesAdaptor ps,
+                                     double radius, bool repulsive,
+                                     std::string name):
+                          Restraint(m, name), pis_(ps), radius_(radius),
+                          mintheta_(0.0), maxtheta_(0.0), use_angles_(false),
+                          repulsive_(repulsive), softness_(3.0),
+                          softness_angle_(0.5), plateau_(1e-10) {}
+
+CylinderRestraint::CylinderRestraint(Model *m, ParticleIndexesAdaptor ps,
+                                     double radius, double mintheta,
+                                     double maxtheta, bool repulsive,
+                                     std::string name):
+                          Restraint(m, name), pis_(ps), radius_(radius),
+                          mintheta_(mintheta), maxtheta_(maxtheta),
+                          use_angles_(true), repulsive_(repulsive),
+                          softness_(3.0), softness_angle_(0.5),
+                          plateau_(1e-10) {}
+
+double CylinderRestraint::unprotected_evaluate(DerivativeAccumulator *accum)
+                                                                  const
+{
+    Model *m = get_model();
+    double score=0.0;
+    for(unsigned int n=0;n<pis_.size();++n){
+      core::XYZ d(m,pis_[n]);
+      const algebra::Vector3D &v=d.get_coordinates();
+      double r=std::sqrt(v[0]*v[0]+v[1]*v[1]);
+      double argvalue=(r-radius_)/softness_;
+      double sign=1.0;
+      if (repulsive_) {
+        argvalue=-argvalue;
+        sign=-1.0;
+      }
+      double dscore;
+      score+=internal::get_sigmoid_score(argvalue,plateau_,dscore);
+      algebra::Vector3D deriv(0.0,0.0,0.0);
+      if (accum && r>0.0){
+        double dr=sign*dscore/softness_/r;
+        deriv[0]+=dr*v[0];
+        deriv[1]+=dr*v[1];
+      }
+      if (use_angles_){
+        double dx, dy;
+        double angle=internal::get_cylindrical_angle(v,dx,dy);
+        score+=internal::get_angle_range_score(angle,mintheta_,maxtheta_,
+                                               softness_angle_,plateau_,
+                                               dscore);
+        deriv[0]+=dscore*dx;
+        deriv[1]+=dscore*dy;
+      }
+      if (accum){
+        d.add_to_derivatives(deriv,*accum);
+      }
+    }
+    return score;
+}
+
+ModelObjectsTemp CylinderRestraint::do_get_inputs() const
+{
+  return IMP::get_particles(get_model(),pis_);
+}
+
+IMPPMI_END_NAMESPACE
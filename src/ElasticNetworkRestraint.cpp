@@ -0,0 +1,50 @@
+/**
+ *  \file pmi/ElasticNetworkRestraint.cpp
+ *  \brief Harmonic restraints on a list of particle pairs.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/ElasticNetworkRestraint.h>
+#include <IMP/core/XYZ.h>
+#include <IMP/algebra/Vector3D.h>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+ElasticNetworkRestraint::ElasticNetworkRestraint(Model *m, double strength,
+                                                 std::string name):
+                          Restraint(m, name), strength_(strength) {}
+
+double ElasticNetworkRestraint::
+                 unprotected_evaluate(DerivativeAccumulator *accum) const
+{
+    Model *m = get_model();
+    double score=0.0;
+    for(unsigned int n=0;n<pairs_.size();++n){
+      algebra::Vector3D diff=m->get_sphere(pairs_[n][0]).get_center()
+                            -m->get_sphere(pairs_[n][1]).get_center();
+      double dist=diff.get_magnitude();
+      double x=dist-lengths_[n];
+      score+=0.5*strength_*x*x;
+      if (accum && dist>0.0){
+        algebra::Vector3D deriv=diff*(strength_*x/dist);
+        core::XYZ(m,pairs_[n][0]).add_to_derivatives(deriv,*accum);
+        core::XYZ(m,pairs_[n][1]).add_to_derivatives(-deriv,*accum);
+      }
+    }
+    return score;
+}
+
+ModelObjectsTemp ElasticNetworkRestraint::do_get_inputs() const
+{
+  ParticlesTemp ret;
+  for(unsigned int n=0;n<pairs_.size();++n){
+    ret.push_back(get_model()->get_particle(pairs_[n][0]));
+    ret.push_back(get_model()->get_particle(pairs_[n][1]));
+  }
+  return ret;
+}
+
+IMPPMI_END_NAMESPACE
@@ -0,0 +1,130 @@
+/**
+ *  \file pmi/FuzzyRestraint.cpp
+ *  \brief Fully ambiguous contact restraint built with boolean logic.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/FuzzyRestraint.h>
+#include <IMP/pmi/internal/sigmoid.h>
+#include <IMP/core/XYZ.h>
+#include <algorithm>
+#include <cmath>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+FuzzyRestraint::FuzzyRestraint(Model *m, ParticleIndexAdaptor p1,
+                               ParticleIndexAdaptor p2, double theta,
+                               double slope, double plateau,
+                               double innerslope, std::string name):
+                          Restraint(m, name), p1_(p1), p2_(p2),
+                          theta_(theta), slope_(slope), plateau_(plateau),
+                          innerslope_(innerslope), leaf_(true),
+                          op_(AND_OPERATOR), value_(0.0) {}
+
+FuzzyRestraint::FuzzyRestraint(FuzzyRestraint *r1, FuzzyRestraint *r2,
+                               Operator op, std::string name):
+                          Restraint(r1->get_model(), name),
+                          theta_(0.0), slope_(1.0), plateau_(0.0),
+                          innerslope_(0.0), leaf_(false), op_(op),
+                          r1_(r1), r2_(r2), value_(0.0)
+{
+    IMP_USAGE_CHECK(op == NOT_OPERATOR || r2,
+                    "AND and OR need two restraints");
+}
+
+double FuzzyRestraint::compute_value() const
+{
+    if (leaf_){
+      double dist=core::get_distance(core::XYZ(get_model(),p1_),
+                                     core::XYZ(get_model(),p2_));
+      double dscore;
+      value_=internal::get_sigmoid_score((dist-theta_)/slope_,plateau_,dscore)
+             +innerslope_*dist;
+      return value_;
+    }
+    double a=r1_->compute_value();
+    switch (op_){
+      case AND_OPERATOR:
+        value_=a+r2_->compute_value();
+        break;
+      case OR_OPERATOR: {
+        double b=r2_->compute_value();
+        value_=-std::log(std::exp(-a)+std::exp(-b)-std::exp(-a-b));
+        break;
+      }
+      case NOT_OPERATOR:
+        value_=-std::log(1.0-std::exp(-a));
+        break;
+    }
+    return value_;
+}
+
+void FuzzyRestraint::add_derivatives(double dscore,
+                                     DerivativeAccumulator &accum) const
+{
+    if (leaf_){
+      core::XYZ d1(get_model(),p1_);
+      core::XYZ d2(get_model(),p2_);
+      algebra::Vector3D diff=d1.get_coordinates()-d2.get_coordinates();
+      double dist=diff.get_magnitude();
+      if (dist>0.0){
+        double dsigmoid;
+        internal::get_sigmoid_score((dist-theta_)/slope_,plateau_,dsigmoid);
+        double ddist=dscore*(dsigmoid/slope_+innerslope_);
+        algebra::Vector3D deriv=diff*(ddist/dist);
+        d1.add_to_derivatives(deriv,accum);
+        d2.add_to_derivatives(-deriv,accum);
+      }
+      return;
+    }
+    double ea=std::exp(-r1_->value_);
+    switch (op_){
+      case AND_OPERATOR:
+        r1_->add_derivatives(dscore,accum);
+        r2_->add_derivatives(dscore,accum);
+        break;
+      case OR_OPERATOR: {
+        double eb=std::exp(-r2_->value_);
+        double c=ea+eb-ea*eb;
+        r1_->add_derivatives(dscore*ea*(1.0-eb)/c,accum);
+        r2_->add_derivatives(dscore*eb*(1.0-ea)/c,accum);
+        break;
+      }
+      case NOT_OPERATOR:
+        r1_->add_derivatives(-dscore*ea/(1.0-ea),accum);
+        break;
+    }
+}
+
+void FuzzyRestraint::add_particle_indexes(ParticleIndexes &pis) const
+{
+    if (leaf_){
+      pis.push_back(p1_);
+      pis.push_back(p2_);
+    } else {
+      r1_->add_particle_indexes(pis);
+      if (op_!=NOT_OPERATOR) r2_->add_particle_indexes(pis);
+    }
+}
+
+double FuzzyRestraint::unprotected_evaluate(DerivativeAccumulator *accum)
+                                                                  const
+{
+    double score=compute_value();
+    if (accum) add_derivatives(1.0,*accum);
+    return score;
+}
+
+ModelObjectsTemp FuzzyRestraint::do_get_inputs() const
+{
+  ParticleIndexes pis;
+  add_particle_indexes(pis);
+  std::sort(pis.begin(),pis.end());
+  pis.erase(std::unique(pis.begin(),pis.end()),pis.end());
+  return IMP::get_particles(get_model(),pis);
+}
+
+IMPPMI_END_NAMESPACE
@@ -0,0 +1,122 @@
+/**
+ *  \file pmi/HierarchicalGaussianEMRestraint.cpp
+ *  \brief Gaussian EM restraint with a tree of merged target Gaussians.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/HierarchicalGaussianEMRestraint.h>
+#include <IMP/core/Gaussian.h>
+#include <IMP/core/XYZ.h>
+#include <IMP/atom/Mass.h>
+#include <IMP/algebra/Vector3D.h>
+#include <cmath>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+namespace {
+Vector<internal::WeightedGaussian> get_weighted_gaussians(
+    Model *m, const ParticleIndexes &pis) {
+  Vector<internal::WeightedGaussian> ret;
+  ret.reserve(pis.size());
+  for (unsigned int n = 0; n < pis.size(); ++n) {
+    ret.push_back(internal::get_weighted_gaussian(
+        core::Gaussian(m, pis[n]).get_gaussian(),
+        atom::Mass(m, pis[n]).get_mass()));
+  }
+  return ret;
+}
+}
+
+HierarchicalGaussianEMRestraint::HierarchicalGaussianEMRestraint(
+    Model *m, ParticleIndexes model_ps, ParticleIndexes density_ps,
+    double tolerance, std::string name):
+      Restraint(m, name), model_ps_(model_ps), density_ps_(density_ps),
+      tolerance_(tolerance), dd_(0.0) {
+  update_target();
+}
+
+void HierarchicalGaussianEMRestraint::update_target()
+{
+  Vector<internal::WeightedGaussian> gs =
+      get_weighted_gaussians(get_model(), density_ps_);
+  tree_.set_gaussians(gs);
+  // The self overlap of each Gaussian is a lower bound on its row of DD,
+  // and at most 2n nodes are approximated per row, so the total error
+  // is at most half the tolerance times DD.
+  dd_ = 0.0;
+  double error = 0.0;
+  for (unsigned int n = 0; n < gs.size(); ++n) {
+    double max_error = 0.5 * tolerance_ * internal::get_overlap(gs[n], gs[n])
+                       / (2.0 * gs.size());
+    dd_ += tree_.get_overlap(gs[n], max_error, error, nullptr);
+  }
+}
+
+double HierarchicalGaussianEMRestraint::
+                 unprotected_evaluate(DerivativeAccumulator *accum) const
+{
+  Model *m = get_model();
+  Vector<internal::WeightedGaussian> gs = get_weighted_gaussians(m, model_ps_);
+  unsigned int nmodel = gs.size();
+
+  // model-model term, exactly
+  double mm = 0.0;
+  algebra::Vector3Ds dmm(nmodel, algebra::Vector3D(0.0, 0.0, 0.0));
+  algebra::Vector3D dv;
+  for (unsigned int i = 0; i < nmodel; ++i) {
+    mm += internal::get_overlap(gs[i], gs[i]);
+    for (unsigned int k = i + 1; k < nmodel; ++k) {
+      mm += 2.0 * internal::get_overlap(gs[i], gs[k], accum ? &dv : nullptr);
+      if (accum) {
+        dmm[i] += 2.0 * dv;
+        dmm[k] -= 2.0 * dv;
+      }
+    }
+  }
+
+  // model-density term, approximated with the tree. The allowed error of
+  // each node is set from sqrt(MM*DD), an upper bound on MD, so that the
+  // score only depends on the current coordinates; if the total error is
+  // then more than half the tolerance times MD, MD is computed exactly.
+  double max_error = 0.5 * tolerance_ * std::sqrt(mm * dd_) /
+                     (2.0 * nmodel * std::max(tree_.get_number_of_gaussians(),
+                                              1U));
+  algebra::Vector3Ds dmd(nmodel, algebra::Vector3D(0.0, 0.0, 0.0));
+  double md = 0.0, error = 0.0;
+  for (unsigned int i = 0; i < nmodel; ++i) {
+    md += tree_.get_overlap(gs[i], max_error, error, accum ? &dmd[i] : nullptr);
+  }
+  if (error > 0.5 * tolerance_ * md) {
+    // MD is much smaller than its bound; fall back to the exact sum
+    md = 0.0;
+    for (unsigned int i = 0; i < nmodel; ++i) {
+      dmd[i] = algebra::Vector3D(0.0, 0.0, 0.0);
+      md += tree_.get_overlap(gs[i], 0.0, error, accum ? &dmd[i] : nullptr);
+    }
+  }
+  double score = -std::log(2.0 * md / (mm + dd_));
+  if (accum) {
+    for (unsigned int i = 0; i < nmodel; ++i) {
+      algebra::Vector3D deriv = -dmd[i] / md + dmm[i] / (mm + dd_);
+      core::XYZ(m, model_ps_[i]).add_to_derivatives(deriv, *accum);
+    }
+  }
+  return score;
+}
+
+ModelObjectsTemp HierarchicalGaussianEMRestraint::do_get_inputs() const
+{
+  ParticlesTemp ret;
+  for (unsigned int n = 0; n < model_ps_.size(); ++n) {
+    ret.push_back(get_model()->get_particle(model_ps_[n]));
+  }
+  for (unsigned int n = 0; n < density_ps_.size(); ++n) {
+    ret.push_back(get_model()->get_particle(density_ps_[n]));
+  }
+  return ret;
+}
+
+IMPPMI_END_NAMESPACE
@@ -0,0 +1,245 @@
+/**
+ *  \file pmi/ProjectionLibraryRestraint.cpp
+ *  \brief Fit of model projections to EM class averages.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/ProjectionLibraryRestraint.h>
+#include <IMP/core/XYZR.h>
+#include <IMP/core/rigid_bodies.h>
+#include <IMP/atom/Mass.h>
+#include <IMP/algebra/vector_generators.h>
+#include <IMP/algebra/Sphere3D.h>
+#include <IMP/thread_macros.h>
+#include <cmath>
+#include <map>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+namespace {
+// Rotation taking the direction d to the z axis
+algebra::Rotation3D get_rotation_to_z(const algebra::Vector3D &d) {
+  algebra::Vector3D z(0.0, 0.0, 1.0);
+  if (d * z < -0.999999) {
+    return algebra::get_rotation_about_axis(algebra::Vector3D(1.0, 0.0, 0.0),
+                                            PI);
+  }
+  return algebra::get_rotation_taking_first_to_second(d, z);
+}
+}
+
+ProjectionLibraryRestraint::ProjectionLibraryRestraint(
+    Model *m, ParticleIndexes ps, unsigned int rows, unsigned int cols,
+    double pixel_size, double resolution, unsigned int projection_number,
+    unsigned int library_size, std::string name):
+      Restraint(m, name), ps_(ps), rows_(rows), cols_(cols),
+      pixel_size_(pixel_size), resolution_(resolution),
+      library_size_(library_size), nthreads_(1), library_built_(false) {
+  algebra::Sphere3D unit(algebra::Vector3D(0.0, 0.0, 0.0), 1.0);
+  algebra::Vector3Ds dirs =
+      algebra::get_uniform_surface_cover(unit, projection_number);
+  for (unsigned int k = 0; k < dirs.size(); ++k) {
+    projection_rotations_.push_back(get_rotation_to_z(dirs[k]));
+  }
+  library_directions_ = algebra::get_uniform_surface_cover(unit,
+                                                           library_size);
+  for (unsigned int k = 0; k < library_directions_.size(); ++k) {
+    library_rotations_.push_back(get_rotation_to_z(library_directions_[k]));
+  }
+}
+
+void ProjectionLibraryRestraint::add_image(const Floats &pixels)
+{
+  if (pixels.size() != rows_ * cols_) {
+    IMP_THROW("Expected an image of " << rows_ * cols_ << " pixels, got "
+              << pixels.size(), ValueException);
+  }
+  internal::ProjectionImage img(rows_, cols_, pixel_size_);
+  double mean = 0.0;
+  for (unsigned int n = 0; n < pixels.size(); ++n) mean += pixels[n];
+  mean /= pixels.size();
+  double var = 0.0;
+  for (unsigned int n = 0; n < pixels.size(); ++n) {
+    img.data[n] = pixels[n] - mean;
+    var += img.data[n] * img.data[n];
+  }
+  images_.push_back(img);
+  image_moments_.push_back(internal::get_moments(img));
+  image_sds_.push_back(std::sqrt(var / pixels.size()));
+}
+
+double ProjectionLibraryRestraint::get_sigma(ParticleIndex pi) const
+{
+  // Gaussian with the resolution as its full width at half maximum,
+  // widened by the projection of a ball of the particle's radius
+  double sigma = resolution_ / (2.0 * std::sqrt(2.0 * std::log(2.0)));
+  double r = 0.0;
+  if (core::XYZR::get_is_setup(get_model(), pi)) {
+    r = core::XYZR(get_model(), pi).get_radius();
+  }
+  return std::sqrt(sigma * sigma + r * r / 5.0);
+}
+
+double ProjectionLibraryRestraint::get_weight(ParticleIndex pi) const
+{
+  if (atom::Mass::get_is_setup(get_model(), pi)) {
+    return atom::Mass(get_model(), pi).get_mass();
+  }
+  return 1.0;
+}
+
+void ProjectionLibraryRestraint::build_library() const
+{
+  Model *m = get_model();
+  bodies_.clear();
+  library_.clear();
+  body_radii_.clear();
+  flexible_.clear();
+  std::map<ParticleIndex, unsigned int> body_index;
+  Vector<ParticleIndexes> members;
+  for (unsigned int n = 0; n < ps_.size(); ++n) {
+    if (core::RigidMember::get_is_setup(m, ps_[n])) {
+      ParticleIndex rb = core::RigidMember(m, ps_[n]).get_rigid_body()
+                            .get_particle_index();
+      if (body_index.find(rb) == body_index.end()) {
+        body_index[rb] = bodies_.size();
+        bodies_.push_back(rb);
+        members.push_back(ParticleIndexes());
+      }
+      members[body_index[rb]].push_back(ps_[n]);
+    } else {
+      flexible_.push_back(ps_[n]);
+    }
+  }
+  for (unsigned int b = 0; b < bodies_.size(); ++b) {
+    algebra::Vector3Ds coords;
+    Floats sigmas, weights;
+    double radius = 0.0;
+    for (unsigned int n = 0; n < members[b].size(); ++n) {
+      coords.push_back(core::RigidMember(m, members[b][n])
+                           .get_internal_coordinates());
+      sigmas.push_back(get_sigma(members[b][n]));
+      weights.push_back(get_weight(members[b][n]));
+      radius = std::max(radius,
+                        coords.back().get_magnitude() + 3.0 * sigmas.back());
+    }
+    unsigned int side = 2 * static_cast<unsigned int>(
+                                std::ceil(radius / pixel_size_)) + 1;
+    library_.push_back(Vector<internal::ProjectionImage>());
+    for (unsigned int j = 0; j < library_rotations_.size(); ++j) {
+      internal::ProjectionImage img(side, side, pixel_size_);
+      for (unsigned int n = 0; n < coords.size(); ++n) {
+        algebra::Vector3D v = library_rotations_[j].get_rotated(coords[n]);
+        img.add_gaussian(v[0], v[1], sigmas[n], weights[n]);
+      }
+      library_.back().push_back(img);
+    }
+    body_radii_.push_back(radius);
+  }
+  library_built_ = true;
+}
+
+internal::ProjectionImage ProjectionLibraryRestraint::get_projection_image(
+                               unsigned int k, bool use_library) const
+{
+  Model *m = get_model();
+  const algebra::Rotation3D &rot = projection_rotations_[k];
+  internal::ProjectionImage img(rows_, cols_, pixel_size_);
+  // center the projection on the centroid of the model
+  algebra::Vector3D center(0.0, 0.0, 0.0);
+  double wsum = 0.0;
+  for (unsigned int n = 0; n < ps_.size(); ++n) {
+    double w = get_weight(ps_[n]);
+    center += w * m->get_sphere(ps_[n]).get_center();
+    wsum += w;
+  }
+  if (wsum > 0.0) center /= wsum;
+
+  const ParticleIndexes &direct = use_library ? flexible_ : ps_;
+  for (unsigned int n = 0; n < direct.size(); ++n) {
+    algebra::Vector3D v = rot.get_rotated(
+        m->get_sphere(direct[n]).get_center() - center);
+    img.add_gaussian(v[0], v[1], get_sigma(direct[n]),
+                     get_weight(direct[n]));
+  }
+  if (!use_library) return img;
+
+  algebra::Vector3D xaxis(1.0, 0.0, 0.0), zaxis(0.0, 0.0, 1.0);
+  for (unsigned int b = 0; b < bodies_.size(); ++b) {
+    algebra::Transformation3D tr = core::RigidBody(m, bodies_[b])
+                           .get_reference_frame().get_transformation_to();
+    // the body is projected along the direction d of its own frame
+    algebra::Rotation3D total = rot * tr.get_rotation();
+    algebra::Vector3D d = total.get_inverse().get_rotated(zaxis);
+    unsigned int nearest = 0;
+    double best = -2.0;
+    for (unsigned int j = 0; j < library_directions_.size(); ++j) {
+      double dot = d * library_directions_[j];
+      if (dot > best) {
+        best = dot;
+        nearest = j;
+      }
+    }
+    // what remains after the library rotation is (nearly) an in-plane
+    // rotation about z
+    algebra::Vector3D ex = (total * library_rotations_[nearest].get_inverse())
+                               .get_rotated(xaxis);
+    double angle = std::atan2(ex[1], ex[0]);
+    algebra::Vector3D shift = rot.get_rotated(tr.get_translation() - center);
+    img.add_image(library_[b][nearest], shift[0], shift[1], angle,
+                  body_radii_[b]);
+  }
+  return img;
+}
+
+Floats ProjectionLibraryRestraint::get_projection(unsigned int k,
+                                                  bool use_library) const
+{
+  if (use_library && !library_built_) build_library();
+  return get_projection_image(k, use_library).data;
+}
+
+double ProjectionLibraryRestraint::
+                 unprotected_evaluate(DerivativeAccumulator *) const
+{
+  if (!library_built_) build_library();
+  unsigned int nproj = projection_rotations_.size();
+  unsigned int nimages = images_.size();
+  Floats ccs(nproj * nimages, -1.0);
+  IMP_OMP_PRAGMA(parallel for schedule(dynamic) num_threads(nthreads_))
+  for (int k = 0; k < static_cast<int>(nproj); ++k) {
+    internal::ProjectionImage proj = get_projection_image(k, true);
+    internal::ImageMoments moments = internal::get_moments(proj);
+    for (unsigned int i = 0; i < nimages; ++i) {
+      ccs[k * nimages + i] = internal::get_aligned_cross_correlation(
+          images_[i], image_moments_[i], image_sds_[i], proj, moments);
+    }
+  }
+  double score = 0.0;
+  for (unsigned int i = 0; i < nimages; ++i) {
+    double best = -1.0;
+    for (unsigned int k = 0; k < nproj; ++k) {
+      best = std::max(best, ccs[k * nimages + i]);
+    }
+    score += 1.0 - best;
+  }
+  return score;
+}
+
+ModelObjectsTemp ProjectionLibraryRestraint::do_get_inputs() const
+{
+  Model *m = get_model();
+  ParticlesTemp ret;
+  for (unsigned int n = 0; n < ps_.size(); ++n) {
+    ret.push_back(m->get_particle(ps_[n]));
+    if (core::RigidMember::get_is_setup(m, ps_[n])) {
+      ret.push_back(core::RigidMember(m, ps_[n]).get_rigid_body());
+    }
+  }
+  return ret;
+}
+
+IMPPMI_END_NAMESPACE
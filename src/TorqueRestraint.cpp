@@ -0,0 +1,71 @@
+/**
+ *  \file pmi/TorqueRestraint.cpp
+ *  \brief Keep particles within an angular range of their centroid.
+ *
+ *  Copyright 2007-2016 IMP Inventors. All rights reserved.
+ *
+ */
+
+#include <IMP/pmi/TorqueRestraint.h>
+#include <IMP/pmi/internal/sigmoid.h>
+#include <IMP/core/XYZ.h>
+
+
+IMPPMI_BEGIN_NAMESPACE
+
+TorqueRestraint::TorqueRestraint(Model *m, ParticleIndexesAdaptor ps,
+                                 double angular_tolerance,
+                                 double softness_angle, double plateau,
+                                 std::string name):
+                          Restraint(m, name), pis_(ps),
+                          angular_tolerance_(angular_tolerance),
+                          softness_angle_(softness_angle),
+                          plateau_(plateau) {}
+
+double TorqueRestraint::unprotected_evaluate(DerivativeAccumulator *accum)
+                                                                  const
+{
+    if (pis_.empty()) return 0.0;
+    Model *m = get_model();
+    algebra::Vector3D center(0.0, 0.0, 0.0);
+    for(unsigned int n=0;n<pis_.size();++n){
+      center+=core::XYZ(m,pis_[n]).get_coordinates();
+    }
+    center/=pis_.size();
+    double cdx, cdy;
+    double angle_center=internal::get_cylindrical_angle(center,cdx,cdy);
+
+    double score=0.0;
+    // derivative of the score with respect to the centroid angle
+    double dcenter=0.0;
+    for(unsigned int n=0;n<pis_.size();++n){
+      core::XYZ d(m,pis_[n]);
+      double dx, dy, dscore;
+      double angle=internal::get_cylindrical_angle(d.get_coordinates(),dx,dy);
+      // the range moves with the centroid, so only the difference counts
+      score+=internal::get_angle_range_score(angle-angle_center,
+                                             -angular_tolerance_,
+                                             angular_tolerance_,
+                                             softness_angle_,plateau_,dscore);
+      if (accum){
+        d.add_to_derivatives(algebra::Vector3D(dscore*dx,dscore*dy,0.0),
+                             *accum);
+        dcenter-=dscore;
+      }
+    }
+    if (accum){
+      algebra::Vector3D deriv(dcenter*cdx/pis_.size(),
+                              dcenter*cdy/pis_.size(),0.0);
+      for(unsigned int n=0;n<pis_.size();++n){
+        core::XYZ(m,pis_[n]).add_to_derivatives(deriv,*accum);
+      }
+    }
+    return score;
+}
+
+ModelObjectsTemp TorqueRestraint::do_get_inputs() const
+{
+  return IMP::get_particles(get_model(),pis_);
+}
+
+IMPPMI_END_NAMESPACE
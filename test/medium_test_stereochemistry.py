@@ -4,6 +4,7 @@ import IMP.test
 import IMP.pmi
 import IMP.pmi.io
 import IMP.pmi.dof
+import IMP.pmi.samplers
 import IMP.pmi.topology
 import IMP.pmi.restraints.stereochemistry
 
@@ -134,7 +135,9 @@ class Tests(IMP.test.TestCase):
             dist_cutoff=5.0,
             ca_only=True,
             hierarchy=hier)
-        self.assertEqual(er.get_restraint().get_number_of_restraints(),12)
+        self.assertEqual(er.get_restraint().get_number_of_restraints(),1)
+        self.assertEqual(er.get_number_of_pairs(),12)
+        self.assertEqual(len(er.get_excluded_pairs()),24)
 
         lhelix = sses['helix'][0][0][1] - sses['helix'][0][0][0]+1
         hr = IMP.pmi.restraints.stereochemistry.HelixRestraint(hier,sses['helix'][0][0])
@@ -224,6 +227,80 @@ class Tests(IMP.test.TestCase):
             included_objects=resis, resolution=1)
         self.assertEqual(len(ev.cpc.get_all_possible_indexes()), 2)
 
+    def test_excluded_volume_sphere_filters(self):
+        """Test automatic pair filters and slack in excluded volume"""
+        m = IMP.Model()
+        s = IMP.pmi.topology.System(m)
+        st1 = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(self.get_input_file_name('chainA.fasta'))
+        mol = st1.create_molecule("Test", seqs["GCP2_YEAST"][:100])
+        mol.add_structure(self.get_input_file_name('chainA.pdb'), chain_id="A", offset=0,res_range=(1,100))
+        mol.add_representation(mol.get_atomic_residues(), resolutions=[1,10])
+        mol.add_representation(mol.get_non_atomic_residues(), resolutions=[10])
+        hier = s.build()
+
+        cr = IMP.pmi.restraints.stereochemistry.ConnectivityRestraint(
+            mol, resolution=1)
+        ev_all = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+            included_objects=mol, resolution=1)
+        ev = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+            included_objects=mol, resolution=1, connectivity_restraints=cr)
+        self.assertLess(ev.get_number_of_close_pairs(),
+                        ev_all.get_number_of_close_pairs())
+        # no pairs held together by the connectivity restraint are scored
+        connected = set()
+        for pp in cr.get_particle_pairs():
+            connected.add((pp[0].get_index(), pp[1].get_index()))
+            connected.add((pp[1].get_index(), pp[0].get_index()))
+        self.assertGreater(len(connected), 0)
+        for pi1, pi2 in ev.cpc.get_contents():
+            self.assertNotIn((pi1, pi2), connected)
+
+        dof = IMP.pmi.dof.DegreesOfFreedom(m)
+        dof.create_flexible_beads(mol, max_trans=2.0)
+        mc = IMP.pmi.samplers.MonteCarlo(m, dof.get_movers(), 1.0)
+        ev.set_slack_from_sampler(mc)
+        self.assertAlmostEqual(ev.cpc.get_slack(), 8.0, delta=1e-6)
+
+    def test_excluded_volume_sphere_overlapping(self):
+        """Test excluded volume skips different representations of a residue"""
+        m = IMP.Model()
+        s = IMP.pmi.topology.System(m)
+        st1 = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(self.get_input_file_name('chainA.fasta'))
+        mol = st1.create_molecule("Test", seqs["GCP2_YEAST"][:100])
+        mol.add_structure(self.get_input_file_name('chainA.pdb'), chain_id="A", offset=0,res_range=(1,100))
+        mol.add_representation(mol.get_atomic_residues(), resolutions=[1,10])
+        mol.add_representation(mol.get_non_atomic_residues(), resolutions=[10])
+        hier = s.build()
+        ps = (IMP.atom.Selection(hier, resolution=1).get_selected_particles()
+              + IMP.atom.Selection(hier, resolution=10).get_selected_particles())
+        hs = [IMP.atom.Hierarchy(p) for p in set(ps)]
+
+        def overlap(pi1, pi2):
+            r1 = IMP.pmi.tools.get_residue_indexes(IMP.atom.Hierarchy(m, pi1))
+            r2 = IMP.pmi.tools.get_residue_indexes(IMP.atom.Hierarchy(m, pi2))
+            return min(r2) <= max(r1) and min(r1) <= max(r2)
+        ev_all = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+            included_objects=hs, exclude_overlapping=False)
+        ev_all.get_number_of_close_pairs()
+        self.assertTrue(any(overlap(pi1, pi2)
+                            for pi1, pi2 in ev_all.cpc.get_contents()))
+        ev = IMP.pmi.restraints.stereochemistry.ExcludedVolumeSphere(
+            included_objects=hs)
+        ev.get_number_of_close_pairs()
+        for pi1, pi2 in ev.cpc.get_contents():
+            self.assertFalse(overlap(pi1, pi2))
+
+        # rotations of a rigid body move its far particles the most
+        dof = IMP.pmi.dof.DegreesOfFreedom(m)
+        dof.create_rigid_body(mol, max_trans=1.0, max_rot=0.5)
+        mc = IMP.pmi.samplers.MonteCarlo(m, dof.get_movers(), 1.0)
+        step = mc.get_maximum_step_size()
+        self.assertGreater(step, 1.0 + 0.5 * 10.0)
+        ev.set_slack_from_sampler(mc)
+        self.assertAlmostEqual(ev.cpc.get_slack(), 4.0 * step, delta=1e-6)
+
 
     def test_charmm(self):
         """ test PMI setup of CHARMM"""
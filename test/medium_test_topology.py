@@ -453,6 +453,46 @@ class Tests(IMP.test.TestCase):
                          for i in (0, 1, 4, 5, 6, 7, 8)]))
         self.assertEqual(res2, set([m2.residues[i] for i in range(0, 13)]))
 
+    def test_structure_cache(self):
+        """Test that each PDB file is parsed once for all its chains"""
+        import IMP.pmi.topology.system_tools
+        system_tools = IMP.pmi.topology.system_tools
+        system_tools.clear_structure_cache()
+        mdl = IMP.Model()
+        pdb_fn = self.get_input_file_name('prot.pdb')
+        rhs1 = system_tools.get_structure(mdl, pdb_fn, 'A', (55, 63), -54)
+        rhs2 = system_tools.get_structure(mdl, pdb_fn, 'B', (180, 'END'))
+        rhs3 = system_tools.get_structure(mdl, pdb_fn, 'A', (55, 63), -54)
+        self.assertEqual(len(system_tools._structure_cache), 1)
+        self.assertEqual([r.get_index() for r in rhs1], [1, 2, 5, 6, 7, 8, 9])
+        self.assertEqual([r.get_index() for r in rhs3], [1, 2, 5, 6, 7, 8, 9])
+        self.assertEqual(rhs2[0].get_index(), 180)
+        # residues are copies, with their own atoms
+        self.assertNotEqual(rhs1[0].get_particle(), rhs3[0].get_particle())
+        self.assertEqual(len(rhs1[0].get_children()),
+                         len(rhs3[0].get_children()))
+        # forgetting the file removes the parsed hierarchy from the model
+        # but keeps the copies
+        nparticles = len(mdl.get_particle_indexes())
+        system_tools.clear_structure_cache(mdl)
+        self.assertEqual(len(system_tools._structure_cache), 0)
+        self.assertLess(len(mdl.get_particle_indexes()), nparticles)
+        self.assertEqual(len(rhs1[0].get_children()),
+                         len(rhs3[0].get_children()))
+
+        finder = IMP.pmi.topology._FindCloseStructure()
+        self.assertIsNone(finder.find_nearest_coord(1))
+        finder.add_residues(rhs2)
+        finder.add_residues(rhs1)
+        for query, residue in ((0, rhs1[0]), (3, rhs1[1]), (4, rhs1[2]),
+                               (500, rhs2[-1])):
+            ca = IMP.atom.Selection(
+                residue, atom_type=IMP.atom.AT_CA).get_selected_particles()[0]
+            self.assertLess(IMP.algebra.get_distance(
+                finder.find_nearest_coord(query),
+                IMP.core.XYZ(ca).get_coordinates()), 1e-6)
+        system_tools.clear_structure_cache()
+
     def test_get_atomic_non_atomic_residues(self):
         """test if, adding a structure, you get the atomic and non atomic residues sets
         correctly"""
@@ -560,6 +600,96 @@ class Tests(IMP.test.TestCase):
         self.assertNotEquals(sel1.get_selected_particles(),
                              sel2.get_selected_particles())
 
+    def test_residue_hierarchies(self):
+        """Test residue hierarchies stored by build"""
+        s = IMP.pmi.topology.System()
+        st1 = s.create_state()
+        seqs = IMP.pmi.topology.Sequences(
+            self.get_input_file_name('seqs.fasta'))
+        m1 = st1.create_molecule("Prot1", sequence=seqs["Protein_1"])
+        atomic_res = m1.add_structure(
+            self.get_input_file_name('prot.pdb'), chain_id='A',
+            res_range=(55, 63), offset=-54)
+        non_atomic_res = m1.get_residues() - atomic_res
+        m1.add_representation(m1[0:4] & atomic_res, resolutions=[0, 10])
+        m1.add_representation(atomic_res - m1[0:4], resolutions=[1, 10])
+        m1.add_representation(non_atomic_res, resolutions=[2])
+        hier = m1.build()
+        for res in m1.get_residues():
+            ps = IMP.atom.Selection(hier, residue_index=res.get_index(),
+                                    resolution=1).get_selected_particles()
+            expected = ps[0]
+            if IMP.atom.Atom.get_is_setup(expected):
+                expected = IMP.atom.get_residue(
+                    IMP.atom.Atom(expected)).get_particle()
+            self.assertEqual(res.get_hierarchy().get_particle(), expected)
+
+    def test_build_cache(self):
+        """Test reading the built hierarchy from the build cache"""
+        def setup(resolutions):
+            mdl = IMP.Model()
+            s = IMP.pmi.topology.System(mdl, build_cache_file=fname)
+            st1 = s.create_state()
+            seqs = IMP.pmi.topology.Sequences(
+                self.get_input_file_name('seqs.fasta'))
+            m1 = st1.create_molecule("Prot1", sequence=seqs["Protein_1"])
+            atomic_res = m1.add_structure(
+                self.get_input_file_name('prot.pdb'), chain_id='A',
+                res_range=(55, 63), offset=-54)
+            m1.add_representation(atomic_res, resolutions=resolutions)
+            m1.add_representation(m1.get_non_atomic_residues(),
+                                  resolutions=[1])
+            m2 = m1.create_clone('B')
+            return s, m1, m2, atomic_res
+
+        def get_coords(hier):
+            return [IMP.core.XYZ(p).get_coordinates()
+                    for p in IMP.atom.get_leaves(hier)]
+
+        fname = self.get_tmp_file_name('test_build_cache.rmf3')
+        s, m1, m2, atomic_res = setup([0, 10])
+        self.assertEqual(len(m1._deferred_structures), 0)
+        coords = get_coords(s.build())
+        self.assertTrue(os.path.exists(fname))
+
+        # same inputs: the pdb file is not read, and the hierarchy is loaded
+        s2, m1b, m2b, atomic_res2 = setup([0, 10])
+        self.assertEqual(len(m1b._deferred_structures), 1)
+        self.assertEqual([r.get_index() for r in atomic_res2],
+                         [r.get_index() for r in atomic_res])
+        coords2 = get_coords(s2.build())
+        self.assertEqual(len(coords2), len(coords))
+        for c1, c2 in zip(coords, coords2):
+            self.assertLess(IMP.algebra.get_distance(c1, c2), 1e-4)
+        self.assertEqual(
+            len(IMP.atom.Selection(s2.get_hierarchy(),
+                                   resolution=10).get_selected_particles()),
+            len(IMP.atom.Selection(s.get_hierarchy(),
+                                   resolution=10).get_selected_particles()))
+        for mol in (m1b, m2b):
+            self.assertTrue(mol.built)
+            self.assertEqual(len(mol.get_atomic_residues()), 9)
+            for res in mol.get_residues():
+                ps = IMP.atom.Selection(
+                    mol.get_hierarchy(), residue_index=res.get_index(),
+                    resolution=1).get_selected_particles()
+                expected = ps[0]
+                if IMP.atom.Atom.get_is_setup(expected):
+                    expected = IMP.atom.get_residue(
+                        IMP.atom.Atom(expected)).get_particle()
+                self.assertEqual(res.get_hierarchy().get_particle(), expected)
+
+        # changed representation: the pdb file is read and the cache rebuilt
+        s3, m1c, m2c, atomic_res3 = setup([0, 5])
+        self.assertEqual(len(m1c._deferred_structures), 1)
+        s3.build()
+        self.assertEqual(len(m1c._deferred_structures), 0)
+        self.assertEqual(
+            IMP.pmi.topology.build_cache.read_metadata(fname)['fingerprint'],
+            IMP.pmi.topology.build_cache.get_fingerprint(s3))
+        # the deferred structure was read before building
+        self.assertGreater(len(m1c[0].get_hierarchy().get_children()), 0)
+
     def test_build_no0(self):
         """test building without resolution 0"""
         s = IMP.pmi.topology.System()
@@ -783,6 +913,64 @@ class Tests(IMP.test.TestCase):
         self.assertEqual(len(selD.get_selected_particles()),
                          len(atomic_res) // dres + 1)
 
+    def test_gmm_store_density_prefix(self):
+        """Test that building with a GMM store honors density_prefix files"""
+        try:
+            import sklearn
+        except ImportError:
+            self.skipTest("no sklearn package")
+        import IMP.isd.gmm_tools
+
+        def build(prefix, store, force_compute=False):
+            mdl = IMP.Model()
+            s = IMP.pmi.topology.System(mdl)
+            st1 = s.create_state()
+            seqs = IMP.pmi.topology.Sequences(
+                self.get_input_file_name('seqs.fasta'))
+            m1 = st1.create_molecule("Prot1", sequence=seqs["Protein_1"])
+            atomic_res = m1.add_structure(
+                self.get_input_file_name('prot.pdb'),
+                chain_id='A', res_range=(55, 63), offset=-54)
+            m1.add_representation(atomic_res, resolutions=[1],
+                                  density_residues_per_component=2,
+                                  density_prefix=prefix,
+                                  density_force_compute=force_compute)
+            hier = s.build(gmm_store=store)
+            sel = IMP.atom.Selection(
+                hier, representation_type=IMP.atom.DENSITIES)
+            return [IMP.core.Gaussian(p).get_gaussian().get_center()
+                    for p in sel.get_selected_particles()]
+
+        with IMP.test.temporary_directory() as tmpdir:
+            store = os.path.join(tmpdir, 'store')
+            prefix = os.path.join(tmpdir, 'dens')
+            fitted = build(prefix, store)
+
+            # a user-supplied GMM is read, not replaced by the stored fit
+            mdl = IMP.Model()
+            ps = []
+            IMP.isd.gmm_tools.decorate_gmm_from_text(prefix + '.txt', ps, mdl)
+            for p in ps:
+                IMP.core.XYZ(p).set_coordinates(
+                    IMP.core.XYZ(p).get_coordinates()
+                    + IMP.algebra.Vector3D(10., 0., 0.))
+            IMP.isd.gmm_tools.write_gmm_to_text(ps, prefix + '.txt')
+            with open(prefix + '.txt') as fh:
+                user_gmm = fh.read()
+            centers = build(prefix, store)
+            with open(prefix + '.txt') as fh:
+                self.assertEqual(fh.read(), user_gmm)
+            for c, f in zip(centers, fitted):
+                self.assertLess(IMP.algebra.get_distance(
+                    c, f + IMP.algebra.Vector3D(10., 0., 0.)), 1e-4)
+
+            # unless a new fit is forced
+            centers = build(prefix, store, force_compute=True)
+            with open(prefix + '.txt') as fh:
+                self.assertNotEqual(fh.read(), user_gmm)
+            for c, f in zip(centers, fitted):
+                self.assertLess(IMP.algebra.get_distance(c, f), 1e-4)
+
     def test_setup_beads_as_densities(self):
         """Test setup of individual density particles.
         This is mainly for flexible beads or all-atom simulations
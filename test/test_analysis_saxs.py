@@ -0,0 +1,58 @@
+from __future__ import print_function
+import os
+import IMP
+import IMP.test
+import IMP.pmi.analysis
+import numpy as np
+
+
+class Tests(IMP.test.TestCase):
+
+    def get_debye_profile(self, coords, ff, q):
+        dist = np.sqrt(((coords[:, np.newaxis] - coords[np.newaxis]) ** 2)
+                       .sum(axis=2))
+        return np.array([(np.outer(ff, ff) * np.sinc(x * dist / np.pi)).sum()
+                         for x in q]) * np.exp(-0.23 * q ** 2)
+
+    def test_profiles(self):
+        """Test batched SAXS profiles against the Debye formula"""
+        rng = np.random.RandomState(42)
+        coords = rng.uniform(0., 30., (3, 40, 3))
+        ff = rng.uniform(1., 2., 40)
+        q = np.linspace(0., 0.5, 20)
+        profiles = IMP.pmi.analysis.get_saxs_profiles(coords, ff, q,
+                                                      bin_size=0.01)
+        self.assertEqual(profiles.shape, (3, 20))
+        for frame, profile in zip(coords, profiles):
+            exact = self.get_debye_profile(frame, ff, q)
+            self.assertLess(np.abs(profile - exact).max(),
+                            1e-4 * exact.max())
+        # blocking does not change the result
+        blocked = IMP.pmi.analysis.get_saxs_profiles(
+            coords, ff, q, bin_size=0.01, max_block_size=50)
+        self.assertLess(np.abs(profiles - blocked).max(),
+                        1e-8 * profiles.max())
+
+    def test_chi_squares(self):
+        """Test fitting of batched SAXS profiles"""
+        rng = np.random.RandomState(42)
+        coords = rng.uniform(0., 30., (3, 20, 3))
+        q = np.linspace(0.01, 0.5, 20)
+        profiles = IMP.pmi.analysis.get_saxs_profiles(
+            coords, np.ones(20), q)
+        errors = 0.1 * profiles[1]
+        with IMP.test.temporary_directory() as tmpdir:
+            fn = os.path.join(tmpdir, 'exp.dat')
+            np.savetxt(fn, np.transpose([q, 2. * profiles[1], errors]),
+                       header='q I err')
+            fit_profiles, chi2 = IMP.pmi.analysis.get_saxs_fits(
+                coords, np.ones(20), fn)
+        self.assertLess(np.abs(fit_profiles - profiles).max(), 1e-6)
+        self.assertEqual(np.argmin(chi2), 1)
+        self.assertAlmostEqual(chi2[1], 0., delta=1e-8)
+        chi2, scales = IMP.pmi.analysis.get_saxs_chi_squares(
+            profiles, 2. * profiles[1], errors)
+        self.assertAlmostEqual(scales[1], 2., delta=1e-8)
+
+if __name__ == '__main__':
+    IMP.test.main()
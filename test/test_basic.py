@@ -1,8 +1,11 @@
 import math
 import IMP
 import IMP.core
+import IMP.algebra
+import IMP.atom
 import IMP.pmi.topology
 import IMP.pmi.restraints.basic
+import IMP.pmi.restraints.proteomics
 import IMP.test
 
 
@@ -67,12 +70,65 @@ class Tests(IMP.test.TestCase):
         tscore = -math.log(tprob)
         self.assertAlmostEqual(rscore, tscore, delta=1e-6)
         self.assertEqual(len(r.do_get_inputs()), 2)
-        self.assertListEqual(r.do_get_inputs(), [p1, p2])
+        self.assertListEqual(r.do_get_inputs(),
+                             [p1.get_particle(), p2.get_particle()])
         self.assertRaises(
             ValueError, IMP.pmi.restraints.basic.BiStableDistanceRestraint, m,
             p1, p2, dists[0], dists[1], sigmas[0], sigmas[1], weights[0],
             weights[1] + 1e-5)
 
+    def _make_particles(self, m, n, center, radius):
+        ps = []
+        for i in range(n):
+            p = IMP.Particle(m)
+            d = IMP.core.XYZ.setup_particle(p,
+                IMP.algebra.get_random_vector_in(
+                    IMP.algebra.Sphere3D(center, radius)))
+            d.set_coordinates_are_optimized(True)
+            IMP.atom.Hierarchy.setup_particle(p)
+            ps.append(p)
+        return ps
+
+    def _check_derivatives(self, r, ps):
+        sf = IMP.core.RestraintsScoringFunction([r])
+        for p in ps:
+            self.assertXYZDerivativesInTolerance(sf, IMP.core.XYZ(p),
+                                                 1e-3, 1.0)
+
+    def test_derivatives(self):
+        """Test derivatives of the C++ basic restraints"""
+        m = IMP.Model()
+        ps = self._make_particles(m, 5, IMP.algebra.Vector3D(15, 10, 0), 4.)
+        hs = [IMP.atom.Hierarchy(p) for p in ps]
+        r = IMP.pmi.restraints.basic.TorqueRestraint(m, hs, 1, 10.)
+        self._check_derivatives(r, ps)
+        r = IMP.pmi.restraints.basic.CylinderRestraint(m, hs, 1, 18.,
+                                                       -10., 40.)
+        self._check_derivatives(r, ps)
+        r = IMP.pmi.restraints.basic.BiStableDistanceRestraint(
+            m, ps[0], ps[1], 3., 8., 1., 2., .4, .6)
+        self._check_derivatives(r, ps[:2])
+
+    def test_fuzzy(self):
+        """Test FuzzyRestraint scores and derivatives"""
+        m = IMP.Model()
+        ps = self._make_particles(m, 4, IMP.algebra.Vector3D(0, 0, 0), 8.)
+        FR = IMP.pmi.restraints.proteomics.FuzzyRestraint
+        def leaf(p1, p2):
+            d = IMP.core.get_distance(IMP.core.XYZ(p1), IMP.core.XYZ(p2))
+            prob = (1.0 - FR.plateau) / (1.0 + math.exp(-(d - FR.theta) / FR.slope))
+            return -math.log(1.0 - prob) + FR.innerslope * d
+        a = leaf(ps[0], ps[1])
+        b = leaf(ps[2], ps[3])
+        r = (FR(m, ps[0], ps[1]) | FR(m, ps[2], ps[3])) & ~FR(m, ps[0], ps[2])
+        c = leaf(ps[0], ps[2])
+        expected = (-math.log(math.exp(-a) + math.exp(-b) - math.exp(-a - b))
+                    - math.log(1.0 - math.exp(-c)))
+        self.assertAlmostEqual(r.unprotected_evaluate(None), expected,
+                               delta=1e-6)
+        self.assertEqual(len(r.do_get_inputs()), 4)
+        self._check_derivatives(r, ps)
+
 
 if __name__ == '__main__':
     IMP.test.main()
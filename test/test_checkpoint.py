@@ -0,0 +1,100 @@
+from __future__ import print_function
+import IMP
+import IMP.test
+import IMP.pmi.topology
+import IMP.pmi.dof
+import IMP.pmi.macros
+import RMF
+import os
+import glob
+import shutil
+
+try:
+    import IMP.mpi
+    rem = IMP.mpi.ReplicaExchange()
+except ImportError:
+    rem = None
+
+class Tests(IMP.test.TestCase):
+    def run_macro(self, number_of_frames):
+        mdl = IMP.Model()
+        pdb_file = self.get_input_file_name("mini.pdb")
+        fasta_file = self.get_input_file_name("mini.fasta")
+
+        seqs = IMP.pmi.topology.Sequences(fasta_file)
+        s = IMP.pmi.topology.System(mdl)
+        st = s.create_state()
+        molA = st.create_molecule("P1",seqs[0],chain_id='A')
+        aresA = molA.add_structure(pdb_file,chain_id='A',soft_check=True)
+        molA.add_representation(aresA,[1])
+        molA.add_representation(molA[:]-aresA,20)
+        root_hier = s.build()
+
+        dof = IMP.pmi.dof.DegreesOfFreedom(mdl)
+        dof.create_rigid_body(molA,name="test RB")
+        rex = IMP.pmi.macros.ReplicaExchange0(mdl,
+                                              root_hier=root_hier,
+                                              monte_carlo_sample_objects = dof.get_movers(),
+                                              number_of_frames=number_of_frames,
+                                              monte_carlo_steps=10,
+                                              number_of_best_scoring_models=2,
+                                              checkpoint_interval=2,
+                                              global_output_directory='checkpoint_test/',
+                                              replica_exchange_object = rem)
+        rex.execute_macro()
+
+    def get_number_of_rmf_frames(self, fname):
+        rh = RMF.open_rmf_file_read_only(fname)
+        return rh.get_number_of_frames()
+
+    def test_checkpoint_restart(self):
+        """Test restart of ReplicaExchange0 from a checkpoint"""
+        if os.path.exists("checkpoint_test/"):
+            shutil.rmtree("checkpoint_test/")
+        stat_files = ["checkpoint_test/stat.0.out",
+                      "checkpoint_test/stat_replica.0.out"]
+        rmfname = "checkpoint_test/rmfs/0.rmf3"
+        self.run_macro(6)
+        # checkpoints are written after frames 1, 3 and 5; only the last
+        # two are kept
+        self.assertEqual(sorted(os.path.basename(f) for f in
+                                glob.glob("checkpoint_test/checkpoints/*.pkl")),
+                         ["3.0.pkl", "5.0.pkl"])
+        self.assertTrue(os.path.isdir("checkpoint_test/checkpoints/best_pdbs.5"))
+        self.assertEqual(self.get_number_of_rmf_frames(rmfname), 6)
+        stat_lines = []
+        for fname in stat_files:
+            with open(fname) as fh:
+                stat_lines.append(fh.readlines())
+            # header plus one line per frame
+            self.assertEqual(len(stat_lines[-1]), 7)
+
+        # simulate a crash after frame 5, part way through writing the
+        # checkpoint, during a restart that was itself interrupted while
+        # copying the rmf frames
+        os.unlink("checkpoint_test/checkpoints/5.0.pkl")
+        for fname in stat_files:
+            with open(fname, "a") as fh:
+                fh.write("partial line")
+        os.rename(rmfname, rmfname + ".old")
+        with open(rmfname, "w") as fh:
+            fh.write("partial rmf")
+
+        self.run_macro(6)
+        self.assertFalse(os.path.exists(rmfname + ".old"))
+        self.assertEqual(self.get_number_of_rmf_frames(rmfname), 6)
+        self.assertEqual(sorted(os.path.basename(f) for f in
+                                glob.glob("checkpoint_test/checkpoints/*.pkl")),
+                         ["3.0.pkl", "5.0.pkl"])
+        for fname, old_lines in zip(stat_files, stat_lines):
+            with open(fname) as fh:
+                lines = fh.readlines()
+            # the junk is dropped and frames 4 and 5 are written again
+            self.assertEqual(len(lines), 7)
+            self.assertEqual(lines[:5], old_lines[:5])
+            for l in lines:
+                self.assertEqual(type(eval(l)), dict)
+        shutil.rmtree("checkpoint_test/")
+
+if __name__ == '__main__':
+    IMP.test.main()
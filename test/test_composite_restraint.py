@@ -0,0 +1,93 @@
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.core
+import IMP.test
+import IMP.pmi
+import math
+
+
+def _get_probability(m, pis, coffd, l, plateau):
+    """Reference implementation: recursion over the excluded elements"""
+    n = len(pis)
+
+    def pair_prob(i, k):
+        onemprob = 1.0
+        for pi in pis[i]:
+            for pk in pis[k]:
+                dist = IMP.core.get_distance(IMP.core.XYZR(m, pi),
+                                             IMP.core.XYZR(m, pk))
+                onemprob *= (1.0 - plateau) / (1.0 + math.exp(-(dist - coffd) / l))
+        return 1.0 - onemprob
+
+    def prob(i, excluded):
+        onemprob = 1.0
+        for k in range(n):
+            if k in excluded:
+                continue
+            p = pair_prob(i, k)
+            if len(excluded) + 1 == n:
+                onemprob *= 1.0 - p
+            else:
+                onemprob *= 1.0 - p * prob(k, excluded | set([k]))
+        return 1.0 - onemprob
+    return prob(0, set([0]))
+
+
+class Tests(IMP.test.TestCase):
+    def test_composite_restraint(self):
+        """Test CompositeRestraint against a reference implementation"""
+        m = IMP.Model()
+        bb = IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(0, 0, 0),
+                                       IMP.algebra.Vector3D(30, 30, 30))
+        pis = []
+        for i in range(6):
+            elem = []
+            for j in range(2):
+                p = IMP.Particle(m)
+                IMP.core.XYZR.setup_particle(p, IMP.algebra.Sphere3D(
+                    IMP.algebra.get_random_vector_in(bb), 1.0))
+                elem.append(p.get_index())
+            pis.append(elem)
+        r = IMP.pmi.CompositeRestraint(m, pis[0], 10.0, 1.0, False, 0.01)
+        for elem in pis[1:]:
+            r.add_composite_particle(elem)
+        for i in range(3):
+            expected = _get_probability(m, pis, 10.0, 1.0, 0.01)
+            self.assertAlmostEqual(r.unprotected_evaluate(None),
+                                   -math.log(expected), delta=1e-6)
+            for elem in pis:
+                for pi in elem:
+                    IMP.core.XYZ(m, pi).set_coordinates(
+                        IMP.algebra.get_random_vector_in(bb))
+
+    def test_single_element(self):
+        """Test CompositeRestraint with a single element"""
+        m = IMP.Model()
+        p = IMP.Particle(m)
+        IMP.core.XYZR.setup_particle(p, IMP.algebra.Sphere3D(
+            IMP.algebra.Vector3D(0, 0, 0), 1.0))
+        r = IMP.pmi.CompositeRestraint(m, [p.get_index()], 10.0, 1.0,
+                                       False, 0.01)
+        self.assertGreater(r.unprotected_evaluate(None), 1e300)
+
+    def test_too_many_elements(self):
+        """Test CompositeRestraint rejects more than 20 elements"""
+        m = IMP.Model()
+        pis = []
+        for i in range(21):
+            p = IMP.Particle(m)
+            IMP.core.XYZR.setup_particle(p, IMP.algebra.Sphere3D(
+                IMP.algebra.Vector3D(i, 0, 0), 1.0))
+            pis.append(p.get_index())
+        r = IMP.pmi.CompositeRestraint(m, [pis[0]], 10.0, 1.0, False, 0.01)
+        for pi in pis[1:20]:
+            r.add_composite_particle([pi])
+        self.assertEqual(r.get_number_of_elements(), 20)
+        self.assertRaises(ValueError, r.add_composite_particle, [pis[20]])
+        self.assertEqual(r.get_number_of_elements(), 20)
+
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -0,0 +1,85 @@
+from __future__ import print_function
+import IMP
+import IMP.algebra
+import IMP.core
+import IMP.test
+import IMP.pmi
+import math
+
+
+def _get_score(m, blocks, slope, theta, plateau, linear_slope):
+    """Reference implementation: brute-force distances, Kruskal MST"""
+    n = len(blocks)
+    edges = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = min(IMP.core.get_distance(IMP.core.XYZR(m, p1),
+                                          IMP.core.XYZR(m, p2))
+                    for p1 in blocks[i] for p2 in blocks[j])
+            edges.append((max(d, 0.), i, j))
+    component = list(range(n))
+
+    def find(i):
+        while component[i] != i:
+            i = component[i]
+        return i
+    score = 0.
+    for d, i, j in sorted(edges):
+        ci, cj = find(i), find(j)
+        if ci == cj:
+            continue
+        component[ci] = cj
+        prob = 1.0 - (1.0 - plateau) / (1.0 + math.exp(-(d - theta) / slope))
+        score += -math.log(prob) + linear_slope * d
+    return score
+
+
+class Tests(IMP.test.TestCase):
+    def make_blocks(self, m, nblocks, nparticles):
+        blocks = []
+        for i in range(nblocks):
+            center = IMP.algebra.get_random_vector_in(
+                IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(0, 0, 0),
+                                          IMP.algebra.Vector3D(100, 100, 100)))
+            block = []
+            for j in range(nparticles):
+                p = IMP.Particle(m)
+                IMP.core.XYZR.setup_particle(p, IMP.algebra.Sphere3D(
+                    center + IMP.algebra.get_random_vector_in(
+                        IMP.algebra.Sphere3D(IMP.algebra.Vector3D(0, 0, 0),
+                                             10.)), 2.0))
+                IMP.core.XYZ(p).set_coordinates_are_optimized(True)
+                block.append(p)
+            blocks.append(block)
+        return blocks
+
+    def test_score(self):
+        """Test ConnectivityNetworkRestraint against a reference"""
+        m = IMP.Model()
+        blocks = self.make_blocks(m, 8, 20)
+        r = IMP.pmi.ConnectivityNetworkRestraint(m, 2.0, 10.0, 1e-3, 0.015)
+        for b in blocks:
+            r.add_particles(b)
+        self.assertEqual(r.get_number_of_particle_blocks(), 8)
+        self.assertEqual(r.get_number_of_particles_for_block(3), 20)
+        self.assertEqual(len(r.get_minimum_spanning_tree()), 7)
+        self.assertAlmostEqual(r.unprotected_evaluate(None),
+                               _get_score(m, blocks, 2.0, 10.0, 1e-3, 0.015),
+                               delta=1e-6)
+
+    def test_derivatives(self):
+        """Test ConnectivityNetworkRestraint derivatives"""
+        m = IMP.Model()
+        blocks = self.make_blocks(m, 4, 5)
+        r = IMP.pmi.ConnectivityNetworkRestraint(m, 2.0, 10.0, 1e-3, 0.015)
+        for b in blocks:
+            r.add_particles(b)
+        sf = IMP.core.RestraintsScoringFunction([r])
+        for b in blocks:
+            for p in b:
+                self.assertXYZDerivativesInTolerance(sf, IMP.core.XYZ(p),
+                                                     1e-3, 1.0)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -1,10 +1,14 @@
 from __future__ import print_function
+import os
 import IMP
 import IMP.test
 import IMP.core
 import IMP.algebra
 import IMP.atom
 import IMP.container
+import IMP.pmi
+import IMP.pmi.io.images
+
 
 class Tests(IMP.test.TestCase):
     def test_something(self):
@@ -14,5 +18,79 @@ class Tests(IMP.test.TestCase):
             self.skipTest("No EM2D module")
         import IMP.pmi.restraints.em2d
 
+    def setup_model(self):
+        m = IMP.Model()
+        bb = IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(-20, -10, -5),
+                                       IMP.algebra.Vector3D(20, 10, 5))
+        ps = []
+        for i in range(30):
+            p = IMP.Particle(m)
+            IMP.core.XYZR.setup_particle(
+                p, IMP.algebra.Sphere3D(
+                    IMP.algebra.get_random_vector_in(bb), 2.0))
+            IMP.atom.Mass.setup_particle(p, 1.0)
+            ps.append(p)
+        rb = IMP.core.RigidBody.setup_particle(IMP.Particle(m), ps[:20])
+        IMP.core.transform(rb, IMP.algebra.Transformation3D(
+            IMP.algebra.get_random_rotation_3d(),
+            IMP.algebra.Vector3D(3, 4, 5)))
+        return m, ps
+
+    def test_projection_library(self):
+        """Test projections composited from a rigid body library"""
+        m, ps = self.setup_model()
+        r = IMP.pmi.ProjectionLibraryRestraint(
+            m, IMP.get_indexes(ps), 40, 40, 2.0, 8.0, 10)
+        self.assertEqual(r.get_number_of_projections(), 10)
+        for k in range(r.get_number_of_projections()):
+            direct = r.get_projection(k, False)
+            library = r.get_projection(k)
+            mean_d = sum(direct) / len(direct)
+            mean_l = sum(library) / len(library)
+            cov = sum((d - mean_d) * (l - mean_l)
+                      for d, l in zip(direct, library))
+            var_d = sum((d - mean_d) ** 2 for d in direct)
+            var_l = sum((l - mean_l) ** 2 for l in library)
+            self.assertGreater(cov / (var_d * var_l) ** 0.5, 0.95)
+
+    def test_projection_library_score(self):
+        """Test ProjectionLibraryRestraint score"""
+        m, ps = self.setup_model()
+        r = IMP.pmi.ProjectionLibraryRestraint(
+            m, IMP.get_indexes(ps), 40, 40, 2.0, 8.0, 10)
+        self.assertRaises(ValueError, r.add_image, [0.] * 10)
+        r.add_image(r.get_projection(3, False))
+        self.assertEqual(r.get_number_of_images(), 1)
+        self.assertLess(r.evaluate(False), 0.05)
+        # scrambling the flexible particles makes the fit worse
+        for p in ps[20:]:
+            IMP.core.XYZ(p).set_coordinates(IMP.algebra.Vector3D(30, 30, 30))
+        self.assertGreater(r.evaluate(False), 0.05)
+
+    def test_image_cache(self):
+        """Test reading PGM images through the binary cache"""
+        with IMP.test.temporary_directory() as tmpdir:
+            fn = os.path.join(tmpdir, 'image.pgm')
+            with open(fn, 'w') as fh:
+                fh.write('P2\n# test image\n4 3\n255\n')
+                fh.write('0 10 20 30\n40 50 60 70\n80 90 100 255\n')
+            image = IMP.pmi.io.images.read_pgm(fn)
+            self.assertEqual(image.shape, (3, 4))
+            self.assertAlmostEqual(image[2, 3], 255., delta=1e-6)
+            ref = IMP.pmi.io.images.read_image(fn, 2.0, 10.0,
+                                               use_cache=False)
+            img = IMP.pmi.io.images.read_image(fn, 2.0, 10.0)
+            cache_fn = IMP.pmi.io.images.get_cache_file_name(fn)
+            self.assertTrue(os.path.exists(cache_fn))
+            self.assertAlmostEqual(abs(img - ref).max(), 0., delta=1e-8)
+            img = IMP.pmi.io.images.read_image(fn, 2.0, 10.0)
+            self.assertAlmostEqual(abs(img - ref).max(), 0., delta=1e-8)
+            self.assertAlmostEqual(img.mean(), 0., delta=1e-8)
+            # a different resolution does not use the stale cache
+            img = IMP.pmi.io.images.read_image(fn, 2.0, 20.0)
+            ref = IMP.pmi.io.images.read_image(fn, 2.0, 20.0,
+                                               use_cache=False)
+            self.assertAlmostEqual(abs(img - ref).max(), 0., delta=1e-8)
+
 if __name__ == '__main__':
     IMP.test.main()
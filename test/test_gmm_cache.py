@@ -0,0 +1,98 @@
+from __future__ import print_function
+import os
+import shutil
+import IMP
+import IMP.test
+import IMP.core
+import IMP.algebra
+import IMP.atom
+import IMP.isd.gmm_tools
+import IMP.pmi.io.gmm
+
+
+class Tests(IMP.test.TestCase):
+
+    def assert_gmms_equal(self, ps1, ps2):
+        self.assertEqual(len(ps1), len(ps2))
+        for p1, p2 in zip(ps1, ps2):
+            g1 = IMP.core.Gaussian(p1).get_gaussian()
+            g2 = IMP.core.Gaussian(p2).get_gaussian()
+            c1 = IMP.algebra.get_covariance(g1)
+            c2 = IMP.algebra.get_covariance(g2)
+            for i in range(3):
+                for j in range(3):
+                    self.assertAlmostEqual(c1[i][j], c2[i][j], delta=1e-6)
+            self.assertLess(IMP.algebra.get_distance(
+                g1.get_center(), g2.get_center()), 1e-6)
+            self.assertAlmostEqual(IMP.atom.Mass(p1).get_mass(),
+                                   IMP.atom.Mass(p2).get_mass(), delta=1e-6)
+            self.assertAlmostEqual(IMP.core.XYZR(p1).get_radius(),
+                                   IMP.core.XYZR(p2).get_radius(), delta=1e-6)
+
+    def test_cache(self):
+        """Test reading GMMs through the binary cache"""
+        with IMP.test.temporary_directory() as tmpdir:
+            fn = os.path.join(tmpdir, 'gmm.txt')
+            shutil.copy(self.get_input_file_name('prot_gmm.txt'), fn)
+            m = IMP.Model()
+            ref = []
+            IMP.isd.gmm_tools.decorate_gmm_from_text(
+                fn, ref, m, radius_scale=3.0, mass_scale=2.0)
+
+            ps = []
+            IMP.pmi.io.gmm.decorate_gmm_from_text(
+                fn, ps, m, radius_scale=3.0, mass_scale=2.0)
+            cache_fn = IMP.pmi.io.gmm.get_cache_file_name(fn)
+            self.assertTrue(os.path.exists(cache_fn))
+            self.assert_gmms_equal(ref, ps)
+
+            # cache hits, including through a memory map
+            for mmap in (False, True):
+                ps = []
+                IMP.pmi.io.gmm.decorate_gmm_from_text(
+                    fn, ps, m, radius_scale=3.0, mass_scale=2.0, mmap=mmap)
+                self.assert_gmms_equal(ref, ps)
+
+            # a changed text file invalidates the cache
+            with open(fn, 'a') as fh:
+                fh.write('|%d|1.0|1 2 3|4 0 0 0 5 0 0 0 6|\n' % len(ref))
+            gmm = IMP.pmi.io.gmm.read_gmm(fn)
+            self.assertEqual(len(gmm), len(ref) + 1)
+            self.assertAlmostEqual(gmm.covariances[-1][1][1], 5.0,
+                                   delta=1e-6)
+            self.assertEqual(sorted(gmm.variances[-1]), [4.0, 5.0, 6.0])
+
+    def test_fit_store(self):
+        """Test fitting GMMs through the content-addressed store"""
+        try:
+            import sklearn
+        except ImportError:
+            self.skipTest("no sklearn module")
+        import numpy as np
+        rng = np.random.RandomState(42)
+        points1 = rng.normal(size=(200, 3))
+        points2 = rng.normal(loc=10.0, size=(200, 3))
+        with IMP.test.temporary_directory() as tmpdir:
+            store = os.path.join(tmpdir, 'store')
+            fits = [(points1, 2, 100.0), (points2, 3, 50.0)]
+            fns = IMP.pmi.io.gmm.fit_gmms(fits, store, processes=2)
+            self.assertEqual(len(set(fns)), 2)
+            for fn, (points, ncomp, mass) in zip(fns, fits):
+                gmm = IMP.pmi.io.gmm.read_gmm(fn)
+                self.assertEqual(len(gmm), ncomp)
+                self.assertAlmostEqual(sum(gmm.weights), mass, delta=1e-3)
+            mtimes = [os.path.getmtime(fn) for fn in fns]
+
+            # stored fits are reused; changed points are refitted
+            points3 = points2.copy()
+            points3[0] += 1.0
+            fns2 = IMP.pmi.io.gmm.fit_gmms(
+                [(points1.copy(), 2, 100.0), (points3, 3, 50.0)], store)
+            self.assertEqual(fns2[0], fns[0])
+            self.assertEqual(os.path.getmtime(fns[0]), mtimes[0])
+            self.assertNotEqual(fns2[1], fns[1])
+            self.assertTrue(os.path.exists(fns2[1]))
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -0,0 +1,113 @@
+from __future__ import print_function
+import math
+import random
+import IMP
+import IMP.test
+import IMP.core
+import IMP.algebra
+import IMP.atom
+import IMP.pmi
+
+
+def _setup_gaussians(m, n, box, sd):
+    ps = []
+    for i in range(n):
+        p = IMP.Particle(m)
+        center = IMP.algebra.get_random_vector_in(
+            IMP.algebra.BoundingBox3D(IMP.algebra.Vector3D(0, 0, 0),
+                                      IMP.algebra.Vector3D(box, box, box)))
+        variances = [random.uniform(sd[0], sd[1]) ** 2 for k in range(3)]
+        rf = IMP.algebra.ReferenceFrame3D(IMP.algebra.Transformation3D(
+            IMP.algebra.get_random_rotation_3d(), center))
+        IMP.core.Gaussian.setup_particle(
+            p, IMP.algebra.Gaussian3D(rf, IMP.algebra.Vector3D(*variances)))
+        IMP.atom.Mass.setup_particle(p, random.uniform(0.5, 2.0))
+        ps.append(p)
+    return ps
+
+
+def _get_overlap(p1, p2):
+    g1 = IMP.core.Gaussian(p1).get_gaussian()
+    g2 = IMP.core.Gaussian(p2).get_gaussian()
+    c1 = IMP.algebra.get_covariance(g1)
+    c2 = IMP.algebra.get_covariance(g2)
+    s = [[c1[i][j] + c2[i][j] for j in range(3)] for i in range(3)]
+    det = (s[0][0] * (s[1][1] * s[2][2] - s[1][2] * s[2][1])
+           - s[0][1] * (s[1][0] * s[2][2] - s[1][2] * s[2][0])
+           + s[0][2] * (s[1][0] * s[2][1] - s[1][1] * s[2][0]))
+    d = g1.get_center() - g2.get_center()
+    # inverse of s, from its cofactors
+    cof = [[s[(i + 1) % 3][(j + 1) % 3] * s[(i + 2) % 3][(j + 2) % 3]
+            - s[(i + 1) % 3][(j + 2) % 3] * s[(i + 2) % 3][(j + 1) % 3]
+            for j in range(3)] for i in range(3)]
+    sd = [sum(cof[i][j] * d[j] for j in range(3)) / det for i in range(3)]
+    return (IMP.atom.Mass(p1).get_mass() * IMP.atom.Mass(p2).get_mass()
+            * math.exp(-0.5 * sum(d[i] * sd[i] for i in range(3)))
+            / ((2. * math.pi) ** 1.5 * math.sqrt(det)))
+
+
+def _get_score(model_ps, density_ps):
+    mm = sum(_get_overlap(p1, p2) for p1 in model_ps for p2 in model_ps)
+    md = sum(_get_overlap(p1, p2) for p1 in model_ps for p2 in density_ps)
+    dd = sum(_get_overlap(p1, p2) for p1 in density_ps for p2 in density_ps)
+    return -math.log(2. * md / (mm + dd))
+
+
+class Tests(IMP.test.TestCase):
+
+    def test_exact(self):
+        """Test HierarchicalGaussianEMRestraint with no tolerance"""
+        m = IMP.Model()
+        model_ps = _setup_gaussians(m, 10, 20., (1., 3.))
+        density_ps = _setup_gaussians(m, 30, 20., (1., 3.))
+        r = IMP.pmi.HierarchicalGaussianEMRestraint(
+            m, IMP.get_indexes(model_ps), IMP.get_indexes(density_ps))
+        self.assertGreater(r.get_number_of_nodes(), 1)
+        self.assertAlmostEqual(r.evaluate(False),
+                               _get_score(model_ps, density_ps), delta=1e-6)
+        self.assertXYZDerivativesInTolerance(m, IMP.core.XYZ(model_ps[0]),
+                                             0.01, 1.)
+
+    def test_tolerance(self):
+        """Test HierarchicalGaussianEMRestraint within its tolerance"""
+        m = IMP.Model()
+        model_ps = _setup_gaussians(m, 20, 100., (1., 3.))
+        density_ps = _setup_gaussians(m, 200, 100., (1., 3.))
+        exact = IMP.pmi.HierarchicalGaussianEMRestraint(
+            m, IMP.get_indexes(model_ps), IMP.get_indexes(density_ps))
+        tol = 1e-3
+        r = IMP.pmi.HierarchicalGaussianEMRestraint(
+            m, IMP.get_indexes(model_ps), IMP.get_indexes(density_ps), tol)
+        self.assertAlmostEqual(r.get_density_density_overlap(),
+                               exact.get_density_density_overlap(),
+                               delta=tol * exact.get_density_density_overlap())
+        for i in range(5):
+            for p in model_ps:
+                d = IMP.core.XYZ(p)
+                d.set_coordinates(d.get_coordinates()
+                                  + IMP.algebra.get_random_vector_in(
+                                      IMP.algebra.Sphere3D(
+                                          IMP.algebra.Vector3D(0, 0, 0), 1.)))
+            self.assertAlmostEqual(r.evaluate(False), exact.evaluate(False),
+                                   delta=tol)
+
+    def test_history_independent(self):
+        """Test HierarchicalGaussianEMRestraint score depends only on
+           the current coordinates"""
+        m = IMP.Model()
+        model_ps = _setup_gaussians(m, 20, 100., (1., 3.))
+        density_ps = _setup_gaussians(m, 200, 100., (1., 3.))
+        r = IMP.pmi.HierarchicalGaussianEMRestraint(
+            m, IMP.get_indexes(model_ps), IMP.get_indexes(density_ps), 1e-2)
+        coords = [IMP.core.XYZ(p).get_coordinates() for p in model_ps]
+        score = r.evaluate(False)
+        for p in model_ps:
+            IMP.core.XYZ(p).set_coordinates(IMP.algebra.Vector3D(500., 0, 0))
+        r.evaluate(False)
+        for p, c in zip(model_ps, coords):
+            IMP.core.XYZ(p).set_coordinates(c)
+        self.assertEqual(r.evaluate(False), score)
+
+
+if __name__ == '__main__':
+    IMP.test.main()
@@ -273,6 +273,24 @@ class Tests(IMP.test.TestCase):
             nxl+=1
 
 
+    def test_create_set_in_chunks(self):
+        rplp=IMP.pmi.io.crosslink.ResiduePairListParser("MSSTUDIO")
+        cldbkc=IMP.pmi.io.crosslink.CrossLinkDataBaseKeywordsConverter(rplp)
+        cldbkc.set_protein1_key("prot1")
+        cldbkc.set_protein2_key("prot2")
+        cldbkc.set_site_pairs_key("site pairs")
+        cldbkc.set_id_score_key("score")
+        for fn,converter in (("xl_dataset_test.dat",None),
+                             ("xl_dataset_test_crs.dat",cldbkc)):
+            cldb=self.setup_cldb("xl_dataset_test.dat")
+            cldb.create_set_from_file(self.get_input_file_name(fn),converter)
+            for chunk_size in (1,2,100):
+                cldb1=self.setup_cldb("xl_dataset_test.dat")
+                cldb1.create_set_from_file(self.get_input_file_name(fn),
+                                           converter,chunk_size=chunk_size)
+                self.assertEqual(cldb1.data_base,cldb.data_base)
+                self.assertEqual(len(cldb1),len(cldb))
+
     def test_FilterOperator(self):
         import operator
         from IMP.pmi.io.crosslink import FilterOperator as FO
@@ -308,6 +326,102 @@ class Tests(IMP.test.TestCase):
         nentry=len([xl for xl in cldb if (xl[cldb.protein1_key]=="AAA")])
         self.assertEqual(len(cldb1),nentry)
 
+    def test_filter_vectorized(self):
+        import operator
+        from IMP.pmi.io.crosslink import FilterOperator as FO
+        cldb=self.setup_cldb("xl_dataset_test.dat")
+        fos=[(FO(cldb.protein1_key,operator.eq,"AAA")|FO(cldb.residue1_key,operator.gt,10))&FO(cldb.id_score_key,operator.le,10.0),
+             FO(cldb.protein2_key,operator.ge,"BBB"),
+             FO(cldb.redundancy_key,operator.gt,1),
+             FO("sample",operator.contains,"e")]
+        for fo in fos:
+            cldb1=cldb.filter(fo)
+            expected=[xl for xl in cldb if fo.evaluate(xl)]
+            self.assertEqual(len(cldb1),len(expected))
+            self.assertEqual(list(cldb1),expected)
+
+        # filters see cross-links changed through a filtered database
+        fo=FO(cldb.protein1_key,operator.eq,"AAA")
+        nfiltered=len(cldb.filter(fo))
+        self.assertGreater(nfiltered,0)
+        cldb1=cldb.filter(fo)
+        cldb1.set_value(cldb.protein1_key,"ZZZ")
+        self.assertEqual(len(cldb.filter(fo)),0)
+        self.assertEqual(len(cldb.filter(FO(cldb.protein1_key,operator.eq,"ZZZ"))),
+                         nfiltered)
+        # and cross-links changed in place
+        for xl in cldb:
+            if xl[cldb.protein1_key]=="ZZZ":
+                xl[cldb.protein1_key]="AAA"
+        self.assertEqual(len(cldb.filter(fo)),nfiltered)
+
+        # redundancy follows changes to the proteins and residues
+        cldb.set_value(cldb.protein1_key,"AAA")
+        cldb.set_value(cldb.protein2_key,"AAA")
+        cldb.set_value(cldb.residue1_key,1)
+        cldb.set_value(cldb.residue2_key,2)
+        for xl in cldb:
+            self.assertEqual(xl[cldb.redundancy_key],len(cldb))
+        cldb1=cldb.filter(FO(cldb.redundancy_key,operator.eq,len(cldb)))
+        self.assertEqual(len(cldb1),len(cldb))
+
+    def test_set_distances_from_structure(self):
+        import IMP.pmi.topology
+        import IMP.rmf
+        import RMF
+        mdl=IMP.Model()
+        s=IMP.pmi.topology.System(mdl)
+        seqs=IMP.pmi.topology.Sequences(self.get_input_file_name('multi_seq.fasta'),
+                                        name_map={'Protein_1':'Prot1'})
+        st=s.create_state()
+        m1=st.create_molecule("Prot1",sequence=seqs["Prot1"],chain_id='A')
+        m1.add_representation(m1.add_structure(self.get_input_file_name('multi.pdb'),
+                                               chain_id='A',offset=-54,model_num=0),
+                              resolutions=[1])
+        m2=m1.create_copy(chain_id='G')
+        m2.add_representation(m2.add_structure(self.get_input_file_name('multi.pdb'),
+                                               chain_id='G',offset=-54),
+                              resolutions=[1])
+        hier=s.build()
+
+        cldb=IMP.pmi.io.crosslink.CrossLinkDataBase(None,
+                {'1':[{'Protein1':'Prot1.0','Residue1':7,'Protein2':'Prot1.1','Residue2':39},
+                      {'Protein1':'Prot1.0','Residue1':7,'Protein2':'Prot1.0','Residue2':39}],
+                 '2':[{'Protein1':'Prot1','Residue1':7,'Protein2':'Prot1','Residue2':39},
+                      {'Protein1':'Prot1','Residue1':7,'Protein2':'XXX','Residue2':39}]})
+        cldb.set_distances_from_structure(hier)
+
+        def get_xyz(copy_index,residue_index):
+            sel=IMP.atom.Selection(hier,molecule="Prot1",copy_index=copy_index,
+                                   residue_index=residue_index,resolution=1)
+            return IMP.core.XYZ(sel.get_selected_particles()[0])
+        d=[[IMP.core.get_distance(get_xyz(c1,7),get_xyz(c2,39))
+            for c2 in (0,1)] for c1 in (0,1)]
+        xls=list(cldb)
+        self.assertAlmostEqual(xls[0][cldb.distance_key],d[0][1],delta=1e-4)
+        self.assertAlmostEqual(xls[1][cldb.distance_key],d[0][0],delta=1e-4)
+        self.assertAlmostEqual(xls[2][cldb.distance_key],
+                               min(d[0]+d[1]),delta=1e-4)
+        self.assertIsNone(xls[3][cldb.distance_key])
+        for xl in xls[:2]:
+            self.assertAlmostEqual(xl[cldb.min_ambiguous_distance_key],
+                                   min(d[0]),delta=1e-4)
+
+        # the same distances are read from an RMF frame
+        fn=self.get_tmp_file_name("xl_distances.rmf3")
+        rh=RMF.create_rmf_file(fn)
+        IMP.rmf.add_hierarchy(rh,hier)
+        IMP.rmf.save_frame(rh,"0")
+        del rh
+        cldb1=IMP.pmi.io.crosslink.CrossLinkDataBase(None,cldb.data_base)
+        distances=[xl[cldb.distance_key] for xl in cldb]
+        cldb1.set_distances_from_rmf(fn)
+        for xl,distance in zip(cldb1,distances):
+            if distance is None:
+                self.assertIsNone(xl[cldb.distance_key])
+            else:
+                self.assertAlmostEqual(xl[cldb.distance_key],distance,delta=1e-4)
+
     def test_clone_protein(self):
         cldb=self.setup_cldb("xl_dataset_test.dat")
         expected_crosslinks=[]
@@ -20,5 +20,50 @@ class Tests(IMP.test.TestCase):
         self.assertAlmostEqual(center[2], 0., delta=1e-5)
         os.unlink('test_output.pdb')
 
+    def test_stat2_append(self):
+        """Test continuing an existing stat2 file"""
+        class DummyOutput(object):
+            def __init__(self):
+                self.value = 0
+            def get_output(self):
+                self.value += 1
+                return {"Dummy_A": str(self.value), "Dummy_B": "x"}
+        fname = "test_stat2_append.out"
+        obj = DummyOutput()
+        output = IMP.pmi.output.Output()
+        output.init_stat2(fname, [obj], extralabels=["score"])
+        output.set_output_entry("score", 1.0)
+        output.write_stat2(fname)
+        output = IMP.pmi.output.Output()
+        output.init_stat2(fname, [obj], extralabels=["score"], append=True)
+        output.set_output_entry("score", 2.0)
+        output.write_stat2(fname)
+        po = IMP.pmi.output.ProcessOutput(fname)
+        fields = po.get_fields(["Dummy_A", "score"])
+        self.assertEqual(fields["score"], [1.0, 2.0])
+        self.assertEqual(len(fields["Dummy_A"]), 2)
+        os.unlink(fname)
+
+    def test_stat2_vectors(self):
+        """Test expansion of list-valued stat2 entries"""
+        class DummyOutput(object):
+            def get_output(self):
+                return {"Dummy_Distances": [1.5, 2.5], "Dummy_A": "x"}
+            def get_output_vector_labels(self):
+                return {"Dummy_Distances": ("Dummy_Distance_", ["l1", "l2"])}
+        fname = "test_stat2_vectors.out"
+        output = IMP.pmi.output.Output()
+        output.init_stat2(fname, [DummyOutput()])
+        output.write_stat2(fname)
+        output.write_stat2(fname)
+        po = IMP.pmi.output.ProcessOutput(fname)
+        self.assertEqual(sorted(po.get_keys()),
+                         ["Dummy_A", "Dummy_Distance_l1", "Dummy_Distance_l2"])
+        fields = po.get_fields(["Dummy_Distance_l2", "Dummy_A"],
+                               filtertuple=("Dummy_Distance_l1", "<", 2.0))
+        self.assertEqual(fields["Dummy_Distance_l2"], ["2.5", "2.5"])
+        self.assertEqual(fields["Dummy_A"], ["x", "x"])
+        os.unlink(fname)
+
 if __name__ == '__main__':
     IMP.test.main()
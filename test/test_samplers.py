@@ -0,0 +1,157 @@
+from __future__ import print_function
+import IMP
+import IMP.core
+import IMP.algebra
+import IMP.atom
+import IMP.test
+import IMP.pmi.tools
+import IMP.pmi.samplers
+
+
+def _make_rigid_bodies(m, n):
+    rbs = []
+    for i in range(n):
+        p = IMP.Particle(m)
+        d = IMP.core.XYZR.setup_particle(
+            p, IMP.algebra.Sphere3D(IMP.algebra.Vector3D(i * 5., 0, 0), 1.))
+        rbp = IMP.Particle(m)
+        rb = IMP.core.RigidBody.setup_particle(rbp, [p])
+        rb.set_coordinates_are_optimized(True)
+        rbs.append(rb)
+    return rbs
+
+
+class Tests(IMP.test.TestCase):
+    def test_score_moved(self):
+        """Test incremental scoring of moved particles in MonteCarlo"""
+        m = IMP.Model()
+        rbs = _make_rigid_bodies(m, 4)
+        rs = IMP.RestraintSet(m)
+        for rb0, rb1 in zip(rbs[:-1], rbs[1:]):
+            rs.add_restraint(IMP.core.DistanceRestraint(
+                m, IMP.core.Harmonic(5.0, 1.0),
+                rb0.get_member(0), rb1.get_member(0)))
+        IMP.pmi.tools.add_restraint_to_model(m, rs)
+        movers = [IMP.core.RigidBodyMover(rb, 1.0, 0.1) for rb in rbs]
+        mc = IMP.pmi.samplers.MonteCarlo(m, movers, 1.0, score_moved=True)
+        self.assertEqual(len(mc._get_moved_particle_indexes()), 4)
+        for i in range(10):
+            mc.optimize(5)
+            m.update()
+            self.assertAlmostEqual(
+                mc.get_mc().get_last_accepted_energy(),
+                IMP.pmi.tools.get_restraint_set(m).evaluate(False),
+                delta=1e-4)
+
+    def test_self_adaptive_rigid_body(self):
+        """Test adaptation of rigid body mover step sizes"""
+        m = IMP.Model()
+        rbs = _make_rigid_bodies(m, 2)
+        r = IMP.core.DistanceRestraint(
+            m, IMP.core.Harmonic(5.0, 100.0),
+            rbs[0].get_member(0), rbs[1].get_member(0))
+        IMP.pmi.tools.add_restraint_to_model(m, r)
+        movers = [IMP.core.RigidBodyMover(rb, 50.0, 0.1) for rb in rbs]
+        mc = IMP.pmi.samplers.MonteCarlo(m, movers, 1.0)
+        # structural movers are only adapted on request
+        mc.set_self_adaptive(window=2)
+        for i in range(4):
+            mc.optimize(10)
+        self.assertEqual([mv.get_maximum_translation() for mv in movers],
+                         [50.0, 50.0])
+        mc.set_self_adaptive(target_acceptance=0.3, window=2, nframes=20,
+                             structural=True)
+        for i in range(20):
+            mc.optimize(10)
+        # huge initial steps are rarely accepted, so they must shrink
+        steps = [mv.get_maximum_translation() for mv in movers]
+        for s in steps:
+            self.assertLess(s, 50.0)
+        # step sizes are frozen after burn-in
+        for i in range(4):
+            mc.optimize(10)
+        self.assertFalse(mc.get_is_adapting())
+        self.assertEqual([mv.get_maximum_translation() for mv in movers],
+                         steps)
+        out = mc.get_output()
+        self.assertIn("MonteCarlo_StepSize_%s_0" % movers[0].get_name(), out)
+        self.assertIn("MonteCarlo_WindowAcceptance_%s_1"
+                      % movers[1].get_name(), out)
+
+    def test_self_adaptive_temperature(self):
+        """Test step sizes are kept separately for each ladder position"""
+        m = IMP.Model()
+        rbs = _make_rigid_bodies(m, 1)
+        IMP.pmi.tools.add_restraint_to_model(m, IMP.RestraintSet(m))
+        mv = IMP.core.RigidBodyMover(rbs[0], 1.0, 0.1)
+        mc = IMP.pmi.samplers.MonteCarlo(m, [mv], 1.0)
+        mc.set_self_adaptive(structural=True)
+        mc.set_ladder_index(0)
+        mc.set_kt(2.0)
+        mc.set_ladder_index(1)
+        mv.set_maximum_translation(3.0)
+        # a temperature change alone (e.g. annealing) keeps the step sizes
+        mc.set_kt(2.5)
+        self.assertAlmostEqual(mv.get_maximum_translation(), 3.0, delta=1e-6)
+        mc.set_kt(1.0)
+        mc.set_ladder_index(0)
+        self.assertAlmostEqual(mv.get_maximum_translation(), 1.0, delta=1e-6)
+        mc.set_kt(2.0)
+        mc.set_ladder_index(1)
+        self.assertAlmostEqual(mv.get_maximum_translation(), 3.0, delta=1e-6)
+
+    def test_uniform_acceptance_ladder(self):
+        """Test temperature ladder equalizing swap acceptance"""
+        temps = [1.0, 1.5, 2.2, 2.5]
+        # uniform acceptance already: ladder is unchanged
+        newtemps = IMP.pmi.samplers._get_uniform_acceptance_ladder(
+            temps, [10, 10, 10], [5, 5, 5])
+        for t, nt in zip(temps, newtemps):
+            self.assertAlmostEqual(t, nt, delta=1e-6)
+        # never-attempted pairs give no update
+        self.assertIsNone(IMP.pmi.samplers._get_uniform_acceptance_ladder(
+            temps, [10, 0, 10], [5, 0, 5]))
+        # poor acceptance in the first pair moves temperatures down
+        newtemps = IMP.pmi.samplers._get_uniform_acceptance_ladder(
+            temps, [10, 10, 10], [1, 5, 9])
+        self.assertEqual(newtemps[0], 1.0)
+        self.assertEqual(newtemps[-1], 2.5)
+        self.assertLess(newtemps[1], 1.5)
+        self.assertLess(newtemps[2], 2.2)
+        # the endpoints are kept exactly
+        newtemps = IMP.pmi.samplers._get_uniform_acceptance_ladder(
+            [3.0, 4.0, 5.0], [10, 10], [1, 9])
+        self.assertEqual(newtemps[0], 3.0)
+        self.assertEqual(newtemps[-1], 5.0)
+        self.assertLess(3.0, newtemps[1])
+        self.assertLess(newtemps[1], 4.0)
+
+    def test_round_trip_ladder(self):
+        """Test feedback-optimized temperature ladder"""
+        temps = [1.0, 2.0, 3.0, 4.0]
+        # linear f(T) means the ladder is already optimal
+        newtemps = IMP.pmi.samplers._get_round_trip_ladder(
+            temps, [9, 6, 3, 0], [0, 3, 6, 9])
+        for t, nt in zip(temps, newtemps):
+            self.assertAlmostEqual(t, nt, delta=1e-6)
+        self.assertIsNone(IMP.pmi.samplers._get_round_trip_ladder(
+            temps, [9, 0, 3, 0], [0, 0, 6, 9]))
+
+    def test_replica_exchange_output(self):
+        """Test per-pair and round-trip replica exchange output"""
+        m = IMP.Model()
+        rex = IMP.pmi.samplers.ReplicaExchange(
+            m, 1.0, 2.5, [],
+            replica_exchange_object=IMP.pmi.samplers._SerialReplicaExchange())
+        rex.set_ladder_optimization("round_trip", 10, 2)
+        self.assertRaises(ValueError, rex.set_ladder_optimization, "foo")
+        for i in range(5):
+            rex.swap_temp(i, 0.)
+        out = rex.get_output()
+        self.assertEqual(out["ReplicaExchange_NumberOfRoundTrips"], "0")
+        self.assertIn("ReplicaExchange_MeanRoundTripTime", out)
+        self.assertEqual(out["ReplicaExchange_Temperatures"], "[1.0]")
+
+
+if __name__ == '__main__':
+    IMP.test.main()
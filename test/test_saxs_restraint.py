@@ -50,6 +50,18 @@ class Tests(IMP.test.TestCase):
         self.assertEqual(len(saxs_rest2.particles), 31)
         self.assertAlmostEqual(saxs_rest2.evaluate(), 0.491, delta = 0.01)
 
+    def test_golden_section_minimize(self):
+        """Test golden-section search used to optimize tau"""
+        calls = []
+
+        def func(x):
+            calls.append(x)
+            return (x - 0.37) ** 2
+        xmin = IMP.pmi.restraints.saxs._golden_section_minimize(
+            func, -2., 3., 1e-4)
+        self.assertAlmostEqual(xmin, 0.37, delta=1e-4)
+        self.assertLess(len(calls), 30)
+
 
 if __name__ == '__main__':
     IMP.test.main()
\ No newline at end of file
@@ -237,5 +237,45 @@ class Tests(IMP.test.TestCase):
         for c0,c2 in zip(orig_coords,coords2):
             self.assertAlmostEqual(IMP.algebra.get_distance(c0,c2),0.0)
 
+    def test_residue_particle_index(self):
+        """Test residue particle index matches Selection"""
+        mdl = IMP.Model()
+        s = IMP.pmi.topology.System(mdl)
+        seqs = IMP.pmi.topology.Sequences(self.get_input_file_name('seqs.fasta'))
+        st1 = s.create_state()
+        m1 = st1.create_molecule("Prot1",sequence=seqs["Protein_1"])
+        a1 = m1.add_structure(self.get_input_file_name('prot.pdb'),
+                              chain_id='A',res_range=(55,63),offset=-54)
+        m1.add_representation(a1,resolutions=[0,1])
+        m1.add_representation(m1.get_residues()-a1,resolutions=[1,10])
+        m2 = m1.create_clone('B')
+        hier = s.build()
+
+        index = IMP.pmi.tools.ResidueParticleIndex(hier)
+        self.assertEqual(index.get_copy_indexes(0, "Prot1"), [0, 1])
+        nres = len(seqs["Protein_1"])
+        for res in (1, 10):
+            for r in range(1, nres + 1):
+                for copy in (0, 1):
+                    sel = IMP.atom.Selection(hier, state_index=0,
+                                             molecule="Prot1",
+                                             copy_index=copy,
+                                             residue_index=r,
+                                             resolution=res)
+                    self.assertEqual(
+                        set(sel.get_selected_particles()),
+                        set(index.get_particles(0, "Prot1", r,
+                                                copy_index=copy,
+                                                resolution=res)))
+                self.assertEqual(
+                    len(index.get_particles(0, "Prot1", r, resolution=res)),
+                    2)
+        sel = IMP.atom.Selection(hier, molecule="Prot1", residue_index=3,
+                                 atom_type=IMP.atom.AtomType("CA"))
+        self.assertEqual(
+            set(sel.get_selected_particles()),
+            set(index.get_particles(0, "Prot1", 3, atom_type="CA")))
+        self.assertEqual(index.get_particles(1, "Prot1", 3, resolution=1), [])
+
 if __name__ == '__main__':
     IMP.test.main()
@@ -107,5 +107,64 @@ class Tests(IMP.test.TestCase):
         for n,dist in enumerate(dist_array):
             self.assertAlmostEqual(dist,python_dist_array[n],delta=0.00001)
 
+    def test_distance_matrix(self):
+        """Test dense matrix of bipartite minimum distances"""
+        m=IMP.Model()
+        particlestemps=[]
+        for n in range(6):
+            center=IMP.algebra.Vector3D(60.0*n,0,0)
+            ps=[]
+            for i in range(50):
+                p=IMP.Particle(m)
+                d=IMP.core.XYZR.setup_particle(p)
+                d.set_coordinates(IMP.algebra.get_random_vector_in(IMP.algebra.Sphere3D(center,20.0)))
+                d.set_radius(3.0*random.random())
+                ps.append(d)
+            particlestemps.append(ps)
+        particlestemps.append([])
+        matrix=IMP.pmi.get_bipartite_minimum_sphere_distance_matrix(particlestemps,2)
+        nps=len(particlestemps)
+        self.assertEqual(len(matrix),nps*nps)
+        for i in range(nps):
+            self.assertEqual(matrix[i*nps+i],0.0)
+            for j in range(nps):
+                self.assertAlmostEqual(matrix[i*nps+j],
+                    self.python_version_min_distance(particlestemps[i],
+                                                     particlestemps[j]),
+                    delta=1e-5)
+
+    def test_elastic_network(self):
+        """Test elastic network construction and scoring"""
+        m=IMP.Model()
+        ps=[]
+        for i in range(200):
+            p=IMP.Particle(m)
+            d=IMP.core.XYZR.setup_particle(p)
+            d.set_coordinates(IMP.algebra.get_random_vector_in(
+                IMP.algebra.BoundingBox3D((0,0,0),(30,30,30))))
+            d.set_radius(1.0)
+            ps.append(p)
+        rs=IMP.pmi.create_elastic_network(ps,6.0,10.0)
+        self.assertEqual(rs.get_number_of_restraints(),1)
+        r=IMP.pmi.ElasticNetworkRestraint.get_from(rs.get_restraint(0))
+        expected=set()
+        for n1 in range(len(ps)):
+            for n2 in range(n1+1,len(ps)):
+                if IMP.core.get_distance(IMP.core.XYZ(ps[n1]),
+                                         IMP.core.XYZ(ps[n2]))<6.0:
+                    expected.add((ps[n1].get_index(),ps[n2].get_index()))
+        self.assertEqual(set(tuple(p) for p in r.get_pairs()),expected)
+        self.assertAlmostEqual(rs.evaluate(False),0.0,delta=1e-6)
+        for p in ps:
+            d=IMP.core.XYZ(p)
+            d.set_coordinates_are_optimized(True)
+            d.set_coordinates(d.get_coordinates()
+                + IMP.algebra.get_random_vector_in(
+                    IMP.algebra.Sphere3D(IMP.algebra.Vector3D(0,0,0),0.5)))
+        sf=IMP.core.RestraintsScoringFunction([r])
+        for p in ps[:10]:
+            self.assertXYZDerivativesInTolerance(sf,IMP.core.XYZ(p),
+                                                 1e-3,1.0)
+
 if __name__ == '__main__':
     IMP.test.main()